@@ -0,0 +1,75 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+# Batch parsing of same-type records into NumPy structured arrays.
+# This module needs numpy and so is not imported by the fixed package.
+
+import numpy as np
+
+from constants import one_of
+
+def _astype(dtype):
+    def convert(column):
+        return column.astype(dtype)
+    return convert
+
+def _one_of(convertor, column):
+    # only convert each distinct code once
+    codes, inverse = np.unique(column, return_inverse=True)
+    constants = np.empty(len(codes), dtype=object)
+    constants[:] = [convertor(code) for code in codes]
+    return constants[inverse]
+
+def _fallback(convertor, column):
+    return np.frompyfunc(convertor, 1, 1)(column)
+
+# convertor -> callable that converts a whole column of raw values
+vectorized = {
+    int: _astype(np.int64),
+    long: _astype(np.int64),
+    float: _astype(np.float64),
+    }
+
+def register(convertor, function):
+    # function takes a column of raw S values and returns the
+    # converted column
+    vectorized[convertor] = function
+
+def raw_dtype(record, width=None):
+    # if not specified, the width is taken to be the end of the last field
+    names, formats, offsets = [], [], []
+    for name, (s, convert) in zip(record.type._fields, record.fields):
+        names.append(name)
+        formats.append('S%i' % (s.stop - s.start))
+        offsets.append(s.start)
+    if width is None:
+        width = max(s.stop for s, convert in record.fields)
+    return np.dtype(dict(
+        names=names, formats=formats, offsets=offsets, itemsize=width
+        ))
+
+def parse_array(record, data, width=None):
+    # Columns are converted in bulk where the convertor is vectorized or
+    # a one_of, otherwise the convertor is called for each value.
+    # Conversion failures are raised rather than returned as
+    # ConversionErrors; use a Parser to find the problematic records.
+    dtype = raw_dtype(record, width)
+    raw = np.frombuffer(data, dtype, count=len(data) // dtype.itemsize)
+    columns = []
+    for name, (s, convert) in zip(record.type._fields, record.fields):
+        column = raw[name]
+        if convert is None:
+            pass
+        elif isinstance(convert, one_of):
+            column = _one_of(convert, column)
+        elif convert in vectorized:
+            column = vectorized[convert](column)
+        else:
+            column = _fallback(convert, column)
+        columns.append((name, column))
+    result = np.empty(len(raw), dtype=[
+        (name, column.dtype) for name, column in columns
+        ])
+    for name, column in columns:
+        result[name] = column
+    return result
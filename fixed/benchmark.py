@@ -0,0 +1,278 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+# Throughput benchmarks for Record, Parser, Chunker, MappedFile and
+# Handler using synthetic files generated from a schema.
+#
+# Run with: python -m fixed.benchmark --help
+
+import json
+import os
+import resource
+import string
+import sys
+from decimal import Decimal
+from multiprocessing import Process, Queue
+from optparse import OptionParser
+from random import Random
+from tempfile import mkdtemp
+from timeit import default_timer
+
+from constants import Constant, one_of
+from exceptions import ConversionError
+from fields import Discriminator, Field
+from handler import Handler, HandlerMeta
+from parser import Parser, ParserMeta
+from records import Record, RecordMeta
+from sources import Chunker, MappedFile
+
+field_width = 8
+
+# convertor name -> (convertor factory, good value, bad value)
+def _str(random):
+    return ''.join(random.choice(string.ascii_letters)
+                   for i in range(field_width))
+
+def _int(random):
+    return str(random.randint(0, 10**(field_width-1))).rjust(field_width)
+
+def _decimal(random):
+    return ('%.2f' % (random.random() * 10000)).rjust(field_width)
+
+codes = ['CODE%04i' % i for i in range(4)]
+
+def _code(random):
+    return random.choice(codes)
+
+convertors = {
+    'str': (lambda: None, _str, None),
+    'int': (lambda: int, _int, 'X'*field_width),
+    'decimal': (lambda: Decimal, _decimal, 'X'*field_width),
+    'one_of': (lambda: one_of(*[Constant(c) for c in codes]),
+               _code, 'X'*field_width),
+    }
+
+unknown_discriminator = '?'
+
+def make_parser(record_types=3, fields=10, kinds=('str', 'int', 'one_of')):
+    # Returns a Parser subclass with the requested number of record
+    # types, each with a one character discriminator followed by fields
+    # using the named kinds of convertor in turn.
+    records = {}
+    for i in range(record_types):
+        name = 'Record%i' % i
+        attrs = dict(disc=Discriminator(string.ascii_uppercase[i]))
+        for j in range(fields):
+            kind = kinds[j % len(kinds)]
+            attrs['field%02i' % j] = Field(field_width,
+                                           convertors[kind][0]())
+        record = RecordMeta(name, (Record, ), attrs)
+        record.kinds = [kinds[j % len(kinds)] for j in range(fields)]
+        records[name] = record
+    return ParserMeta('BenchmarkParser', (Parser, ), records)
+
+def generate(parser, path, records, mix=None, error_rate=0.0,
+             unknown_rate=0.0, newlines=False, seed=0):
+    # Write a file of records for the parser, with record types chosen
+    # using the weights in mix, some records having a field that cannot
+    # be converted and some having an unknown discriminator.
+    random = Random(seed)
+    types = sorted(parser.record_mapping.values(), key=lambda r: r.disc.text)
+    mix = mix or [1] * len(types)
+    total = float(sum(mix))
+    thresholds = []
+    running = 0
+    for weight in mix:
+        running += weight
+        thresholds.append(running / total)
+    terminator = '\n' if newlines else ''
+    with open(path, 'wb') as output:
+        lines = []
+        for i in xrange(records):
+            chosen = random.random()
+            record = types[-1]
+            for threshold, type in zip(thresholds, types):
+                if chosen < threshold:
+                    record = type
+                    break
+            values = [convertors[kind][1](random) for kind in record.kinds]
+            if random.random() < error_rate:
+                index = random.randrange(len(values))
+                bad = convertors[record.kinds[index]][2]
+                if bad is not None:
+                    values[index] = bad
+            if random.random() < unknown_rate:
+                disc = unknown_discriminator
+            else:
+                disc = record.disc.text
+            lines.append(disc + ''.join(values) + terminator)
+            if len(lines) >= 10000:
+                output.write(''.join(lines))
+                lines = []
+        output.write(''.join(lines))
+    return max(s.stop for r in types for s, _ in r.fields)
+
+def make_handler(parser):
+    def handle(self, source, line_no, record):
+        pass
+    handle.__handles__ = parser.record_mapping.values() + [ConversionError]
+    return HandlerMeta('BenchmarkHandler', (Handler, ), dict(handle=handle))
+
+# stages: name -> function(parser, path, width) returning records seen
+
+def _record(parser, path, width):
+    types = parser.record_mapping
+    count = 0
+    with open(path, 'rb') as source:
+        for line in Chunker(source, width):
+            record = types.get(line[0])
+            if record is not None:
+                try:
+                    record.parse(line)
+                except Exception:
+                    pass
+            count += 1
+    return count
+
+def _chunker(parser, path, width):
+    count = 0
+    with open(path, 'rb') as source:
+        for line in Chunker(source, width):
+            count += 1
+    return count
+
+def _parser(parser, path, width):
+    count = 0
+    with open(path, 'rb') as source:
+        for result in parser(Chunker(source, width)):
+            count += 1
+    return count
+
+def _mapped(parser, path, width):
+    count = 0
+    with open(path, 'rb') as source:
+        with MappedFile(source, width) as mapped:
+            for result in parser(mapped):
+                count += 1
+    return count
+
+def _handler(parser, path, width):
+    handler = make_handler(parser)()
+    handler.parse_unknown = False
+    count = 0
+    with open(path, 'rb') as source:
+        for result in handler.handled(Chunker(source, width)):
+            count += 1
+    return count
+
+stages = dict(
+    record=_record,
+    chunker=_chunker,
+    parser=_parser,
+    mapped=_mapped,
+    handler=_handler,
+    )
+
+def _measure(queue, stage, parser, path, width):
+    try:
+        start = default_timer()
+        count = stages[stage](parser, path, width)
+        seconds = default_timer() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        queue.put((True, (count, seconds, peak)))
+    except Exception, e:
+        queue.put((False, '%s: %s' % (e.__class__.__name__, e)))
+
+def measure(stage, parser, path, width):
+    # Each stage runs in its own forked process so that its peak memory
+    # use can be measured independently of the other stages.
+    queue = Queue()
+    process = Process(target=_measure,
+                      args=(queue, stage, parser, path, width))
+    process.start()
+    ok, outcome = queue.get()
+    process.join()
+    if not ok:
+        raise RuntimeError('%s stage failed: %s' % (stage, outcome))
+    count, seconds, peak = outcome
+    size = os.path.getsize(path)
+    return dict(
+        stage=stage,
+        results=count,
+        bytes=size,
+        seconds=seconds,
+        records_per_second=size // width / seconds if seconds else None,
+        bytes_per_second=size / seconds if seconds else None,
+        peak_rss_kb=peak,
+        )
+
+def run(records=100000, record_types=3, fields=10,
+        kinds=('str', 'int', 'one_of'), mix=None,
+        error_rate=0.0, unknown_rate=0.0,
+        stages=sorted(stages), directory=None, seed=0):
+    parser = make_parser(record_types, fields, kinds)
+    temporary = directory is None
+    if temporary:
+        directory = mkdtemp()
+    path = os.path.join(directory, 'benchmark.dat')
+    try:
+        width = generate(parser, path, records, mix, error_rate,
+                         unknown_rate, seed=seed)
+        results = [measure(stage, parser, path, width) for stage in stages]
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+        if temporary:
+            os.rmdir(directory)
+    return dict(
+        python=sys.version,
+        options=dict(
+            records=records, record_types=record_types, fields=fields,
+            kinds=list(kinds), mix=mix, error_rate=error_rate,
+            unknown_rate=unknown_rate, seed=seed,
+            ),
+        results=results,
+        )
+
+def main(argv=None):
+    options = OptionParser(usage='%prog [options]')
+    options.add_option('--records', type='int', default=100000)
+    options.add_option('--record-types', type='int', default=3)
+    options.add_option('--fields', type='int', default=10)
+    options.add_option('--kinds', default='str,int,one_of',
+                       help='comma separated, from: %s' % ', '.join(
+                           sorted(convertors)
+                           ))
+    options.add_option('--mix', default=None,
+                       help='comma separated weights for each record type')
+    options.add_option('--error-rate', type='float', default=0.0)
+    options.add_option('--unknown-rate', type='float', default=0.0)
+    options.add_option('--stages', default=','.join(sorted(stages)))
+    options.add_option('--seed', type='int', default=0)
+    options.add_option('--output', default=None,
+                       help='file to write JSON results to, '
+                            'defaults to stdout')
+    options, args = options.parse_args(argv)
+    mix = options.mix
+    if mix:
+        mix = [float(weight) for weight in mix.split(',')]
+    results = run(
+        records=options.records,
+        record_types=options.record_types,
+        fields=options.fields,
+        kinds=options.kinds.split(','),
+        mix=mix,
+        error_rate=options.error_rate,
+        unknown_rate=options.unknown_rate,
+        stages=options.stages.split(','),
+        seed=options.seed,
+        )
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as target:
+            target.write(output)
+    else:
+        print output
+
+if __name__ == '__main__':
+    main()
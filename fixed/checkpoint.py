@@ -0,0 +1,74 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+import json
+import os
+
+class Checkpoint(object):
+    # A position between two rows of a file: the byte offset of the
+    # next row, the number of rows before it and the number of results
+    # the parser yielded for them, which is what a Handler's line
+    # numbers count.
+
+    def __init__(self, offset=0, line_no=0, results=0):
+        self.offset, self.line_no, self.results = offset, line_no, results
+
+    @classmethod
+    def load(cls, path):
+        # a checkpoint at the start of the file if there is no state file
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as source:
+            state = json.load(source)
+        return cls(state['offset'], state['line_no'], state['results'])
+
+    def save(self, path):
+        # written to a temporary file first, so that a state file is
+        # never left half written
+        temp = path + '.tmp'
+        with open(temp, 'w') as target:
+            json.dump(dict(offset=self.offset, line_no=self.line_no,
+                           results=self.results), target)
+        os.rename(temp, path)
+
+    def _key(self):
+        return self.offset, self.line_no, self.results
+
+    def __eq__(self, other):
+        return isinstance(other, Checkpoint) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<Checkpoint offset=%i line_no=%i results=%i>' % self._key()
+
+class Tracked(object):
+    # Wraps a Chunker or Lines so that the byte offset just after, and
+    # the line number of, the row most recently yielded are known.
+    # If a checkpoint is given, the stream is first moved to its offset
+    # and line numbers continue from it.
+    # Offsets are only useful if the stream can seek to them, so
+    # compressed and prefetched streams cannot be tracked.
+
+    def __init__(self, source, checkpoint=None):
+        if not hasattr(source.stream, 'seek'):
+            raise TypeError('Sources whose streams cannot seek, such as '
+                            'compressed ones, cannot be tracked')
+        self.source = source
+        self.start = checkpoint or Checkpoint()
+        self.offset, self.line_no = self.start.offset, self.start.line_no
+
+    def __iter__(self):
+        start = self.start
+        self.offset, self.line_no = start.offset, start.line_no
+        if start.offset:
+            self.source.stream.seek(start.offset)
+        for self.offset, row in self.source.tracked(start.offset):
+            self.line_no += 1
+            yield row
+
+    def checkpoint(self, results=0):
+        # the position after the row most recently yielded, where the
+        # parser has yielded the given number of results
+        return Checkpoint(self.offset, self.line_no, results)
@@ -0,0 +1,157 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+# Control totals, declared in the controls of a Parser, are accumulated
+# from records as they are parsed and checked against fields of trailer
+# records. When a trailer is parsed, every control checked against one
+# of its fields is compared and then reset, so files with a trailer per
+# batch of records are checked batch by batch.
+
+from exceptions import ControlTotalError, ConversionError
+
+class Control(object):
+    # The base for controls, which also provide value, returning what a
+    # record adds to the total.
+
+    def __init__(self, records, field):
+        # the record types accumulated from
+        if not isinstance(records, (list, tuple)):
+            records = [records]
+        self.records = records
+        # the Field of the trailer record type checked against
+        self.field = field
+
+    def needs(self):
+        # the fields that must be parsed to check this control
+        return [self.field]
+
+    def __repr__(self):
+        return '<%s of %s checked against %s.%s>' % (
+            self.__class__.__name__,
+            ', '.join(record.__name__ for record in self.records),
+            self.field._record.__name__, self.field.name
+            )
+
+class Count(Control):
+    # the number of records of the given types
+
+    def value(self, record):
+        return 1
+
+class Total(Control):
+    # the sum of a field of a record type, given as the Field
+
+    def __init__(self, field, trailer_field):
+        super(Total, self).__init__(field._record, trailer_field)
+        self.total_field = field
+        self.name = field.name
+
+    def value(self, record):
+        return getattr(record, self.name)
+
+    def needs(self):
+        return [self.total_field, self.field]
+
+    def __repr__(self):
+        return '<Total of %s.%s checked against %s.%s>' % (
+            self.records[0].__name__, self.name,
+            self.field._record.__name__, self.field.name
+            )
+
+class Totals(object):
+    # The control totals accumulated while parsing with a Parser
+    # instance. Each result is passed to check, which returns what to
+    # yield in its place, and end is called at the end of input.
+    #
+    # Records of types only parsed for the controls, because they are
+    # not in parse_only, are not yielded, nor are problems converting
+    # them unless they are trailers, as those show up as mismatches.
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.controls = controls = parser.controls
+        self.totals = [0] * len(controls)
+        # the number of records accumulated into each total
+        self.counts = [0] * len(controls)
+        # result class -> [(index, control)] to accumulate
+        self.accumulate = accumulate = {}
+        # result class -> [(index, field name)] to check
+        self.check_fields = check_fields = {}
+        # record type -> [indexes] of the controls checked against it
+        self.checked = checked = {}
+        # result classes and record types not to yield
+        self.hidden = hidden = set()
+        for type in set(parser.record_mapping.values()):
+            record = getattr(type, 'record', type)
+            classes = type.type, type.lazy_type
+            if record in parser.hidden:
+                hidden.update(classes)
+                hidden.add(record)
+            for i, control in enumerate(controls):
+                if record in control.records:
+                    for cls in classes:
+                        accumulate.setdefault(cls, []).append((i, control))
+                if record is control.field._record:
+                    checked.setdefault(record, []).append(i)
+                    for cls in classes:
+                        check_fields.setdefault(cls, []).append(
+                            (i, control.field.name)
+                            )
+
+    def _reset(self, indexes):
+        for i in indexes:
+            self.totals[i] = self.counts[i] = 0
+
+    def check(self, result):
+        # returns what to yield in place of the result, or None
+        cls = result.__class__
+        if cls is ConversionError:
+            record = self.parser.record_type(result.line)
+            indexes = self.checked.get(record)
+            if indexes is not None:
+                # the trailer cannot be checked, but still ends a batch
+                self._reset(indexes)
+            elif record in self.hidden:
+                return None
+            return result
+        accumulate = self.accumulate.get(cls)
+        if accumulate is not None:
+            try:
+                # lazy records are only converted here
+                values = [control.value(result) for i, control in accumulate]
+            except ConversionError, e:
+                if cls in self.hidden:
+                    return None
+                return e
+            totals, counts = self.totals, self.counts
+            for (i, control), value in zip(accumulate, values):
+                totals[i] += value
+                counts[i] += 1
+        check_fields = self.check_fields.get(cls)
+        if check_fields is not None:
+            indexes = [i for i, name in check_fields]
+            try:
+                expected = [getattr(result, name) for i, name in check_fields]
+            except ConversionError, e:
+                self._reset(indexes)
+                return e
+            problems = {}
+            for (i, name), value in zip(check_fields, expected):
+                if value != self.totals[i]:
+                    problems[name] = (value, self.totals[i])
+            self._reset(indexes)
+            if problems:
+                return ControlTotalError(problems, result)
+        if cls in self.hidden:
+            return None
+        return result
+
+    def end(self):
+        # a ControlTotalError with no trailer if records were accumulated
+        # after the last trailer, otherwise None
+        problems = {}
+        for i, control in enumerate(self.controls):
+            if self.counts[i]:
+                problems[control.field.name] = (None, self.totals[i])
+        if problems:
+            return ControlTotalError(problems, None)
@@ -25,6 +25,9 @@ class FixedException(Exception):
     def __getitem__(self, index):
         return getattr(self, self.__slots__[index])
 
+    def __reduce__(self):
+        return self.__class__, tuple(self)
+
     def __str__(self):
         return ', '.join(
                 ['%s=%r' % (name, getattr(self, name))
@@ -47,4 +50,21 @@ class ConversionError(FixedException):
     def __init__(self, problems, line):
         self.problems, self.line = problems, line
 
+class WrongLength(FixedException):
+    __slots__ = ('expected', 'line')
+    def __init__(self, expected, line):
+        self.expected, self.line = expected, line
+
+class StructureError(FixedException):
+    __slots__ = ('problem', 'line_no', 'record')
+    def __init__(self, problem, line_no, record):
+        self.problem, self.line_no, self.record = problem, line_no, record
 
+class ControlTotalError(FixedException):
+    # problems maps the name of each field of the trailer that does not
+    # match to (value in the trailer, value accumulated). If records
+    # were accumulated after the last trailer, one is yielded at the end
+    # of input with no trailer and None for each value in the trailer.
+    __slots__ = ('problems', 'trailer')
+    def __init__(self, problems, trailer):
+        self.problems, self.trailer = problems, trailer
@@ -2,6 +2,7 @@
 # See license.txt for license details.
 
 from constants import one_of
+from writer import default_render
 
 class Ordered(object):
     order = 0
@@ -11,11 +12,67 @@ class Ordered(object):
         Ordered.order += 1
         return obj
         
+class Cache(object):
+    # Remembers the results of a convertor for up to size distinct
+    # values, starting again when full. Exceptions are not cached.
+
+    def __init__(self, convertor, size):
+        self.convertor = convertor
+        self.size = size
+        self.values = {}
+        self.hits = self.misses = 0
+
+    def __call__(self, text):
+        values = self.values
+        if text in values:
+            self.hits += 1
+            return values[text]
+        value = self.convertor(text)
+        self.misses += 1
+        if len(values) >= self.size:
+            values.clear()
+        values[text] = value
+        return value
+
+    def __repr__(self):
+        # so that Problems read the same as for the convertor
+        return repr(self.convertor)
+
+class Decoded(object):
+    # Decodes the bytes of a field before passing the text on to a
+    # convertor, if there is one.
+
+    def __init__(self, encoding, convertor):
+        self.encoding = encoding
+        self.convertor = convertor
+
+    def __call__(self, raw):
+        text = raw.decode(self.encoding)
+        if self.convertor is None:
+            return text
+        return self.convertor(text)
+
+    def __repr__(self):
+        return '<%r decoding %s>' % (self.convertor, self.encoding)
+
 class Field(Ordered):
-    def __init__(self, size, convertor=None, start=None):
+    def __init__(self, size, convertor=None, start=None, cache=None,
+                 render=None, encoding=None):
         self.size = size
         self.convertor = convertor
         self.start = start
+        # if None, the Record's encoding is used
+        self.encoding = encoding
+        # what is used to turn values back into text when writing
+        if render is None:
+            render = default_render(convertor)
+        self.render = render
+        # what is used to convert when parsing
+        if cache and convertor is not None:
+            self.cache = self.convert = Cache(convertor, cache)
+        else:
+            self.cache = None
+            self.convert = convertor
         if isinstance(convertor, one_of):
             for attr, const in convertor.attrs.items():
                 if attr in self.__dict__:
@@ -0,0 +1,147 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+from exceptions import ControlTotalError, StructureError
+
+HEADER = 'header'
+DETAIL = 'detail'
+TRAILER = 'trailer'
+
+class Group(object):
+    # A header record, the detail records after it and the trailer
+    # record that ends them.
+
+    def __init__(self, header, line_no):
+        self.header = header
+        self.line_no = line_no
+        # a list, or an iterator if details are streamed
+        self.details = []
+        # None if the group has no trailer
+        self.trailer = None
+        self.trailer_line_no = None
+        # (line number, exception) for each problem found in the group
+        self.errors = []
+
+    def __repr__(self):
+        return '<Group at line %i: %r>' % (self.line_no, self.header)
+
+class _Pushback(object):
+    # an iterator that items can be put back on
+
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.pushed = []
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.pushed:
+            return self.pushed.pop()
+        return self.iterator.next()
+
+    def push(self, item):
+        self.pushed.append(item)
+
+class Groups(object):
+    # Subclass and set header and trailer to record types, or their
+    # projections, then iterate over an instance wrapping a Parser to get
+    # a Group for each header record.
+    #
+    # Line numbers count the results of the parser, as those passed to
+    # Handler methods do.
+    #
+    # As with Parser, problems are yielded as exceptions:
+    # - a StructureError for a trailer without a header, a record
+    #   outside a group or a header without a trailer, which follows
+    #   the incomplete group
+    # - exceptions from the parser outside a group
+    # Exceptions from the parser within a group, and records of types
+    # not in details, are added to the group's errors.
+    # A ControlTotalError yielded in place of a trailer still ends its
+    # group, with the trailer it has.
+    #
+    # If stream_details is True, each group is yielded as soon as its
+    # header is found and its details are an iterator over the records
+    # as they are parsed, so that large groups are never held in memory.
+    # The trailer and errors of the group are only complete once its
+    # details have been iterated over. Any details not iterated over
+    # are skipped when the next group is asked for.
+
+    header = None
+    trailer = None
+    # the record types that can be in a group, None for any
+    details = None
+    stream_details = False
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+        # result class -> HEADER, TRAILER or DETAIL
+        self.kinds = kinds = {}
+        for kind, types in ((DETAIL, self.details or ()),
+                            (HEADER, [self.header]),
+                            (TRAILER, [self.trailer])):
+            for type in types:
+                kinds[type.type] = kinds[type.lazy_type] = kind
+
+    def _kind(self, result):
+        if (result.__class__ is ControlTotalError and
+            self.kinds.get(result.trailer.__class__) is TRAILER):
+            return TRAILER
+        kind = self.kinds.get(result.__class__)
+        if kind is None and self.details is None and not isinstance(
+            result, Exception
+            ):
+            kind = DETAIL
+        return kind
+
+    def __iter__(self):
+        results = _Pushback(enumerate(self.iterable, 1))
+        for line_no, result in results:
+            kind = self._kind(result)
+            if kind is HEADER:
+                group = Group(result, line_no)
+                details = self._details(group, results)
+                if self.stream_details:
+                    group.details = details
+                    yield group
+                    for detail in details:
+                        pass
+                else:
+                    group.details = list(details)
+                    yield group
+                if group.trailer is None:
+                    yield StructureError('Header without trailer',
+                                         group.line_no, group.header)
+            elif kind is TRAILER:
+                if isinstance(result, ControlTotalError):
+                    yield result
+                    result = result.trailer
+                yield StructureError('Trailer without header', line_no, result)
+            elif isinstance(result, Exception):
+                yield result
+            else:
+                yield StructureError('Record outside group', line_no, result)
+
+    def _details(self, group, results):
+        for line_no, result in results:
+            kind = self._kind(result)
+            if kind is DETAIL:
+                yield result
+            elif kind is TRAILER:
+                if isinstance(result, ControlTotalError):
+                    group.errors.append((line_no, result))
+                    result = result.trailer
+                group.trailer = result
+                group.trailer_line_no = line_no
+                return
+            elif kind is HEADER:
+                # the start of the next group
+                results.push((line_no, result))
+                return
+            elif isinstance(result, Exception):
+                group.errors.append((line_no, result))
+            else:
+                group.errors.append((line_no, StructureError(
+                    'Unexpected record', line_no, result
+                    )))
@@ -1,23 +1,68 @@
 # Copyright (c) 2012 Simplistix Ltd
 # See license.txt for license details.
 
+import sys
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
+from threading import Lock
+
+from checkpoint import Tracked
 from exceptions import FixedException
+from records import Projection
+from sources import Pushed
+
+# orderings for results when handling in threads
+FILE = 'file'
+TYPE = 'type'
 
 class HandlerMeta(type):
     
     def __new__(cls, class_name, bases, dict_):
         dict_['handlers'] = handlers = {}
+        # record type -> Batch
+        dict_['batches'] = batches = {}
         dict_['parse_only'] = parse_only = []
+        dict_['fields'] = fields = {}
+        # record type -> conditions rows must match to be parsed
+        dict_['where'] = where = {}
         discs = {}
+        handled = {}
         for name, obj in dict_.items():
+            for record, conditions in getattr(obj, '__where__', {}).items():
+                if where.setdefault(record, conditions) != conditions:
+                    raise TypeError(
+                        'Conflicting conditions for %s: %r and %r' % (
+                            record.__name__, where[record], conditions
+                            ))
             handles = getattr(obj, '__handles__', ())
             for thing in handles:
                 if isinstance(thing, type) and issubclass(thing, FixedException):
                     handlers[thing] = obj
                 else:
-                    handlers[thing.type] = obj
-                    dict_['parser'] = thing._parser
-                    parse_only.append(thing)
+                    batch = None
+                    if isinstance(thing, Batch):
+                        batch, thing = thing, thing.type
+                        batch.method = obj
+                    if isinstance(thing, Projection):
+                        record = thing.record
+                        fields[record] = thing.names
+                    else:
+                        record = thing
+                    if handled.setdefault(record, thing) is not thing:
+                        raise TypeError(
+                            'Conflicting fields handled for %s: %r and %r' % (
+                                record.__name__, handled[record], thing
+                                ))
+                    if batch is None:
+                        handlers[thing.type] = obj
+                        handlers[thing.lazy_type] = obj
+                    else:
+                        batches[thing.type] = batch
+                        batches[thing.lazy_type] = batch
+                    dict_['parser'] = record._parser
+                    if record not in parse_only:
+                        parse_only.append(record)
         return type.__new__(cls, class_name, bases, dict_)
 
 class Handler(object):
@@ -25,14 +70,79 @@ class Handler(object):
     __metaclass__ = HandlerMeta
 
     parse_unknown = True
+    lazy = False
+
+    # If set, handler methods are called in a pool of this many threads,
+    # with at most max_in_flight calls outstanding at any one time.
+    # Results are yielded in the order given by ordering:
+    # FILE - the order of the records in the file
+    # TYPE - as they complete, but with calls for records of the same
+    #        type made one at a time, in file order
+    # None - as they complete
+    threads = None
+    max_in_flight = 1000
+    ordering = FILE
+
+    # If set to a fixed.stats.Stats, what is found when parsing is
+    # recorded in it, along with the time taken by each handler method
+    # if its time_handlers is True.
+    stats = None
+
+    # When handling a Tracked source without threads or batch handlers,
+    # line numbers continue from any checkpoint it was started from.
+    # If checkpoint_every is set, a checkpoint is passed to checkpointed
+    # after that many records, and at the end of the source, once all
+    # the records before it have been handled.
+    checkpoint_every = None
+    # if set, checkpoints are saved to this file by default
+    state_file = None
     
     def handle(self, iterable):
         for record in self.handled(iterable):
             pass
               
     def handled(self, iterable):
+        stats = self.stats
+        if stats is not None and stats.time_handlers:
+            self._time_handlers(stats)
+        if isinstance(iterable, Tracked):
+            if not (self.threads or self.batches):
+                return self._handled_tracked(iterable)
+            if self.checkpoint_every:
+                raise TypeError('Checkpoints cannot be taken when using '
+                                'threads or batch handlers')
+        if self.threads:
+            if self.ordering == FILE:
+                return self._handled_in_order(iterable)
+            return self._handled_as_completed(iterable)
+        if self.batches:
+            return self._handled_calls(iterable)
+        return self._handled(iterable)
+
+    def pushed(self, feed):
+        # handle data as it is pushed in, see fixed.sources.Pushed
+        return Pushed(self.handled, feed)
+
+    def _time_handlers(self, stats):
+        # timed versions of the class's handlers, used by this instance
+        timed = {}
+        def time(method):
+            if method not in timed:
+                timed[method] = stats.timed(method)
+            return timed[method]
+        cls = self.__class__
+        self.handlers = dict((type, time(method))
+                             for type, method in cls.handlers.items())
+        self.batches = batches = {}
+        for type, batch in cls.batches.items():
+            timed_batch = Batch(batch.type, batch.size, batch.flush_on_switch)
+            timed_batch.method = time(batch.method)
+            batches[type] = timed_batch
+
+    def _handled(self, iterable):
         for i, record in enumerate(self.parser(
-            iterable, self.parse_only, self.parse_unknown
+            iterable, self.parse_only, self.parse_unknown, self.lazy,
+            self.fields, self.stats, self.where
             )):
             handler = self.handlers.get(record.__class__)
             if handler is not None:
@@ -40,13 +150,232 @@ class Handler(object):
             elif isinstance(record, Exception):
                 raise record
 
+    def _handled_tracked(self, source):
+        every = self.checkpoint_every
+        # line numbers count the parser's results, as in _handled
+        line_no = source.start.results
+        count = 0
+        last = None
+        for record in self.parser(
+            source, self.parse_only, self.parse_unknown, self.lazy,
+            self.fields, self.stats, self.where
+            ):
+            line_no += 1
+            handler = self.handlers.get(record.__class__)
+            if handler is not None:
+                yield handler(self, source, line_no, record)
+            elif isinstance(record, Exception):
+                raise record
+            if every:
+                count += 1
+                if count >= every:
+                    count = 0
+                    # parsing is lazy, so the source is still at the
+                    # record's row
+                    last = source.checkpoint(line_no)
+                    self.checkpointed(last)
+        if every:
+            checkpoint = source.checkpoint(line_no)
+            if checkpoint != last:
+                self.checkpointed(checkpoint)
+
+    def checkpointed(self, checkpoint):
+        # override to record checkpoints elsewhere
+        if self.state_file:
+            checkpoint.save(self.state_file)
+
+    def _handled_calls(self, iterable):
+        for handler, args in self._calls(iterable):
+            if handler is None:
+                raise args
+            yield handler(*args)
+
+    def _calls(self, iterable):
+        # yields (handler, args) for each record or batch of records to
+        # be handled, or (None, exception) for each exception that is not
+        handlers, batches = self.handlers, self.batches
+        # record type -> (line numbers, records)
+        pending = {}
+        last = None
+        for i, record in enumerate(self.parser(
+            iterable, self.parse_only, self.parse_unknown, self.lazy,
+            self.fields, self.stats, self.where
+            )):
+            type = record.__class__
+            if type is not last:
+                if last in pending and batches[last].flush_on_switch:
+                    yield self._batch(iterable, last, pending.pop(last))
+                last = type
+            batch = batches.get(type)
+            if batch is not None:
+                line_nos, records = pending.setdefault(type, ([], []))
+                line_nos.append(i+1)
+                records.append(record)
+                if len(records) >= batch.size:
+                    yield self._batch(iterable, type, pending.pop(type))
+                continue
+            handler = handlers.get(type)
+            if handler is not None:
+                yield handler, (self, iterable, i+1, record)
+            elif isinstance(record, Exception):
+                # handle the records before the exception first
+                for call in self._flush(iterable, pending):
+                    yield call
+                yield None, record
+        for call in self._flush(iterable, pending):
+            yield call
+
+    def _batch(self, iterable, type, pending):
+        line_nos, records = pending
+        return self.batches[type].method, (self, iterable, line_nos, records)
+
+    def _flush(self, iterable, pending):
+        # in the order of the first record in each batch
+        for type, batch in sorted(pending.items(), key=lambda i: i[1][0][0]):
+            yield self._batch(iterable, type, batch)
+        pending.clear()
+
+    def _handled_in_order(self, iterable):
+        pool = ThreadPool(self.threads)
+        try:
+            # results still to be yielded
+            window = deque()
+            # an exception not handled, raised once the calls made for the
+            # records before it have completed
+            unhandled = None
+            for handler, args in self._calls(iterable):
+                if handler is None:
+                    unhandled = args
+                    break
+                window.append(pool.apply_async(_call, (handler, args)))
+                while len(window) >= self.max_in_flight:
+                    yield _outcome(window.popleft().get())
+            while window:
+                yield _outcome(window.popleft().get())
+            if unhandled is not None:
+                raise unhandled
+        finally:
+            pool.terminate()
+
+    def _handled_as_completed(self, iterable):
+        pool = ThreadPool(self.threads)
+        done = Queue()
+        lanes = {}
+        in_flight = 0
+        # an exception not handled, raised once the calls made for the
+        # records before it have completed
+        unhandled = None
+        try:
+            for handler, args in self._calls(iterable):
+                if handler is None:
+                    unhandled = args
+                    break
+                if self.ordering == TYPE:
+                    records = args[-1]
+                    if isinstance(records, list):
+                        records = records[0]
+                    type = records.__class__
+                    lane = lanes.get(type)
+                    if lane is None:
+                        lane = lanes[type] = Lane(pool, done.put)
+                    lane.submit(handler, args)
+                else:
+                    pool.apply_async(_call, (handler, args),
+                                     callback=done.put)
+                in_flight += 1
+                while in_flight >= self.max_in_flight:
+                    in_flight -= 1
+                    yield _outcome(done.get())
+            while in_flight:
+                in_flight -= 1
+                yield _outcome(done.get())
+            if unhandled is not None:
+                raise unhandled
+        finally:
+            pool.terminate()
+
+def _call(handler, args):
+    try:
+        return True, handler(*args)
+    except:
+        return False, sys.exc_info()
+
+def _outcome(outcome):
+    ok, value = outcome
+    if ok:
+        return value
+    raise value[0], value[1], value[2]
+
+class Lane(object):
+    # Makes calls one at a time, in the order they are submitted, using
+    # threads from a pool.
+
+    def __init__(self, pool, done):
+        self.pool, self.done = pool, done
+        self.pending = deque()
+        self.lock = Lock()
+        self.running = False
+
+    def submit(self, handler, args):
+        with self.lock:
+            self.pending.append((handler, args))
+            if self.running:
+                return
+            self.running = True
+        self.pool.apply_async(self._run)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.running = False
+                    return
+                handler, args = self.pending.popleft()
+            self.done(_call(handler, args))
+
 class handles(object):
-    def __init__(self, type):
+    # If where is given, it is a mapping of field names to values and
+    # only records whose fields have those values are parsed and
+    # handled, see fixed.records.compile_predicate.
+    def __init__(self, type, fields=None, where=None):
+        self.record = type
+        if fields:
+            type = type.projection(fields)
         self.type = type
+        self.where = where
     def __call__(self, method):
         if getattr(method, '__handles__', None) is None:
             method.__handles__ = []
         method.__handles__.append(self.type)
+        if self.where:
+            if getattr(method, '__where__', None) is None:
+                method.__where__ = {}
+            method.__where__[self.record] = self.where
         return method
     
     
+
+
+class Batch(object):
+    # How records of one type are passed to a handler method in lists
+
+    method = None
+
+    def __init__(self, type, size, flush_on_switch):
+        self.type = type
+        self.size = size
+        self.flush_on_switch = flush_on_switch
+
+    def __repr__(self):
+        return '<Batch of %i %r>' % (self.size, self.type)
+
+class handles_batch(handles):
+    # The decorated method is called with lists of line numbers and
+    # records, of up to size records each. Batches are passed on when
+    # full, at the end of the file, before any exception is raised and,
+    # if flush_on_switch is True, when a record of another type is
+    # found.
+    def __init__(self, type, size=1000, flush_on_switch=False, fields=None,
+                 where=None):
+        super(handles_batch, self).__init__(type, fields, where)
+        self.type = Batch(self.type, size, flush_on_switch)
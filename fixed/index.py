@@ -0,0 +1,201 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+import json
+import os
+from array import array
+from hashlib import md5
+
+from sources import Chunker
+
+class Index(object):
+    # The byte offsets of the records of each type in a file, found in
+    # one pass so that the records of one type, or a range of them, can
+    # later be read without parsing the rest of the file.
+    #
+    # If width is given, the file is of concatenated records of that
+    # width, otherwise it is of newline terminated records.
+    #
+    # The index is kept in a sidecar file next to the data file, which
+    # is ignored if the size, modification time or a hash of the start
+    # and end of the data file have changed.
+
+    version = 1
+    suffix = '.idx'
+    # the amount of data from each end of the file that is hashed
+    sample_size = 1024*1024
+
+    def __init__(self, parser, path, width=None):
+        self.parser = parser
+        self.path = path
+        self.width = width
+        # record type name -> array of byte offsets
+        self.offsets = {}
+        # record type name -> array of line numbers, only needed for
+        # newline terminated records
+        self.line_nos = {}
+        self.unknown = 0
+        self.signature = None
+
+    @classmethod
+    def open(cls, parser, path, width=None):
+        # load the sidecar file, building and saving it if it is missing
+        # or out of date
+        index = cls(parser, path, width)
+        if not index.load():
+            index.build()
+            index.save()
+        return index
+
+    @property
+    def index_path(self):
+        return self.path + self.suffix
+
+    def current_signature(self):
+        stat = os.stat(self.path)
+        hash = md5()
+        with open(self.path, 'rb') as source:
+            hash.update(source.read(self.sample_size))
+            if stat.st_size > self.sample_size:
+                source.seek(max(self.sample_size,
+                                stat.st_size - self.sample_size))
+                hash.update(source.read())
+        return dict(size=stat.st_size, mtime=stat.st_mtime,
+                    hash=hash.hexdigest())
+
+    def _rows(self, source):
+        # yields (offset, row)
+        offset = 0
+        width = self.width
+        if width:
+            for row in Chunker(source, width):
+                yield offset, row
+                offset += width
+        else:
+            for line in source:
+                yield offset, line.rstrip('\r\n')
+                offset += len(line)
+
+    def build(self):
+        self.signature = self.current_signature()
+        record_type = self.parser.record_type
+        # line numbers are only kept for newline terminated records,
+        # otherwise they can be worked out from the offsets
+        keep_line_nos = not self.width
+        offsets, line_nos = {}, {}
+        # record type -> (offsets.append, line_nos.append)
+        appends = {}
+        unknown = 0
+        with open(self.path, 'rb') as source:
+            for line_no, (offset, row) in enumerate(self._rows(source), 1):
+                type = record_type(row)
+                if type is None:
+                    unknown += 1
+                    continue
+                append = appends.get(type)
+                if append is None:
+                    name = type.__name__
+                    offsets[name] = array('L')
+                    line_nos[name] = array('L')
+                    append = appends[type] = (offsets[name].append,
+                                              line_nos[name].append)
+                append[0](offset)
+                if keep_line_nos:
+                    append[1](line_no)
+        if not keep_line_nos:
+            line_nos = {}
+        self.offsets, self.line_nos, self.unknown = offsets, line_nos, unknown
+
+    def save(self):
+        # a line of JSON describing the arrays that follow it
+        names = sorted(self.offsets)
+        header = dict(
+            version=self.version,
+            signature=self.signature,
+            width=self.width,
+            itemsize=array('L').itemsize,
+            unknown=self.unknown,
+            types=[(name, len(self.offsets[name])) for name in names],
+            )
+        with open(self.index_path, 'wb') as target:
+            target.write(json.dumps(header) + '\n')
+            for name in names:
+                self.offsets[name].tofile(target)
+                if name in self.line_nos:
+                    self.line_nos[name].tofile(target)
+
+    def load(self):
+        # returns False if there is no usable sidecar file
+        try:
+            source = open(self.index_path, 'rb')
+        except IOError:
+            return False
+        with source:
+            try:
+                header = json.loads(source.readline())
+            except ValueError:
+                return False
+            if (header.get('version') != self.version or
+                header.get('width') != self.width or
+                header.get('itemsize') != array('L').itemsize or
+                header.get('signature') != self.current_signature()):
+                return False
+            offsets, line_nos = {}, {}
+            try:
+                for name, count in header['types']:
+                    offsets[name] = _read(source, count)
+                    if not self.width:
+                        line_nos[name] = _read(source, count)
+            except EOFError:
+                # truncated
+                return False
+        self.signature = header['signature']
+        self.unknown = header['unknown']
+        self.offsets, self.line_nos = offsets, line_nos
+        return True
+
+    def count(self, record):
+        # the number of records of the given type
+        return len(self.offsets.get(record.__name__, ()))
+
+    def line_numbers(self, record, start=None, stop=None):
+        # the line numbers of the records that rows would yield
+        offsets = self.offsets.get(record.__name__, ())[start:stop]
+        if self.width:
+            width = self.width
+            return [offset // width + 1 for offset in offsets]
+        return self.line_nos.get(record.__name__, ())[start:stop]
+
+    def rows(self, record, start=None, stop=None):
+        # Yields the rows of the given record type, optionally only those
+        # from start up to stop, counting records of that type from 0.
+        # These can be passed to a Parser or Handler, but note that the
+        # line numbers these give will be counted from 1 within the rows
+        # yielded.
+        offsets = self.offsets.get(record.__name__, ())[start:stop]
+        width = self.width
+        with open(self.path, 'rb') as source:
+            position = 0
+            for offset in offsets:
+                if offset != position:
+                    source.seek(offset)
+                if width:
+                    row = source.read(width)
+                    position = offset + width
+                else:
+                    row = source.readline()
+                    position = offset + len(row)
+                    row = row.rstrip('\r\n')
+                yield row
+
+    def __repr__(self):
+        return '<Index of %s: %s>' % (self.path, ', '.join(
+            '%s=%i' % (name, len(offsets))
+            for name, offsets in sorted(self.offsets.items())
+            ))
+
+def _read(source, count):
+    items = array('L')
+    if count:
+        items.fromfile(source, count)
+    return items
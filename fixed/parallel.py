@@ -0,0 +1,268 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+# Parsing of a single large file of concatenated fixed width records,
+# or handling of many files, across a pool of processes. Workers are
+# forked, so parser and handler classes need not be importable, but this
+# does mean a platform that supports fork is required.
+
+import mmap
+import os
+import sys
+import traceback
+from collections import deque
+from cPickle import HIGHEST_PROTOCOL, dumps
+from glob import glob
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+from timeit import default_timer
+
+from constants import one_of
+from controls import Totals
+from exceptions import ConversionError
+from sources import open_source
+
+def _record_types(parser):
+    # a stable ordering of record types, shared by parent and workers
+    return sorted(set(parser.record_mapping.values()),
+                  key=lambda r: (r.disc.slice.start, r.disc.text))
+
+def _constant_indexes(record):
+    # Constants are returned as their text and looked up again in the
+    # parent so that identity with the one_of constants is preserved.
+    return [(i, convert) for i, (s, convert) in enumerate(record.fields)
+            if isinstance(convert, one_of)]
+
+class _Worker(object):
+
+    def __init__(self, parser, path, width, parse_only, parse_unknown):
+        self.parser = parser
+        self.width = width
+        self.parse_only = parse_only
+        self.parse_unknown = parse_unknown
+        with open(path, 'rb') as source:
+            self.map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        self.types = {}
+        for i, record in enumerate(_record_types(parser)):
+            self.types[record.type] = self.types[record.lazy_type] = (
+                i, _constant_indexes(record)
+                )
+
+    def __call__(self, shard):
+        start, stop = shard
+        map, width = self.map, self.width
+        current = [start]
+        def rows():
+            for offset in xrange(start, stop, width):
+                current[0] = offset
+                yield buffer(map, offset, width)
+        results = []
+        append = results.append
+        types = self.types
+        parsed = self.parser(rows(), self.parse_only, self.parse_unknown)
+        # control totals run across shards, so are checked in the parent
+        parsed.controls = ()
+        # parsing is lazy, so when a result is yielded, the current
+        # offset is that of the row it came from
+        for result in parsed:
+            line_no = current[0] // width + 1
+            type_info = types.get(result.__class__)
+            if result.__class__ is ConversionError:
+                # convertors may not pickle, so the parent explains the row
+                append((line_no, None, result.line))
+            elif type_info is None:
+                append((line_no, None, result))
+            else:
+                index, constants = type_info
+                try:
+                    # lazy records are converted here
+                    values = list(result)
+                except ConversionError:
+                    append((line_no, None, result._line[:]))
+                    continue
+                for i, _ in constants:
+                    values[i] = values[i].text
+                append((line_no, index, tuple(values)))
+        return results
+
+_worker = None
+
+def _init(*args):
+    global _worker
+    _worker = _Worker(*args)
+
+def _parse(shard):
+    return _worker(shard)
+
+def parse(parser, path, width,
+          parse_only=None, parse_unknown=True,
+          processes=None, shard_size=100000, max_in_flight=None):
+    # Yields (line_no, result) tuples in file order, where line_no is
+    # the 1-based position of the record in the file and result is what
+    # the parser would have yielded for it. Each process parses shards
+    # of shard_size records. A trailing short record is ignored.
+    # At most max_in_flight shards, by default twice the number of
+    # processes, are parsed or held waiting to be yielded at any one
+    # time, so memory use does not depend on the size of the file.
+    # Any controls of the parser are checked as the results are yielded,
+    # with a ControlTotalError for records after the last trailer given
+    # the line number after the last record.
+    size = os.path.getsize(path)
+    end = size - size % width
+    if not end:
+        return
+    step = shard_size * width
+    shards = ((start, min(start+step, end)) for start in xrange(0, end, step))
+    processes = processes or cpu_count()
+    max_in_flight = max_in_flight or 2 * processes
+
+    types = []
+    for record in _record_types(parser):
+        types.append((record.type, _constant_indexes(record)))
+    new = tuple.__new__
+    check = totals = None
+    if parser.controls:
+        totals = Totals(parser((), parse_only, parse_unknown))
+        check = totals.check
+
+    pool = Pool(processes, _init,
+                (parser, path, width, parse_only, parse_unknown))
+    try:
+        # shards being parsed, in file order
+        window = deque()
+        for shard in islice(shards, max_in_flight):
+            window.append(pool.apply_async(_parse, (shard, )))
+        while window:
+            results = window.popleft().get()
+            # keep the processes busy while these results are yielded
+            shard = next(shards, None)
+            if shard is not None:
+                window.append(pool.apply_async(_parse, (shard, )))
+            for line_no, index, result in results:
+                if index is None:
+                    if isinstance(result, str):
+                        result = parser.record_type(result).explain(result)
+                else:
+                    type, constants = types[index]
+                    if constants:
+                        result = list(result)
+                        for i, convert in constants:
+                            result[i] = convert[result[i]]
+                    result = new(type, result)
+                if check is not None:
+                    result = check(result)
+                    if result is None:
+                        continue
+                yield line_no, result
+    finally:
+        pool.terminate()
+    if totals is not None:
+        error = totals.end()
+        if error is not None:
+            yield end // width + 1, error
+
+class FileResult(object):
+    # The outcome of handling one file with run
+
+    def __init__(self, path, state=None, error=None, seconds=0.0):
+        self.path = path
+        # what the state function returned for the file's handler
+        self.state = state
+        # the formatted traceback if handling the file failed
+        self.error = error
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<FileResult %s %s>' % (self.path, 'ok' if self.ok else 'error')
+
+class Summary(object):
+    # The outcome of run
+
+    def __init__(self, files, result=None):
+        # a FileResult for each file, in the order the files were given
+        self.files = files
+        # what reduce returned, if it was passed
+        self.result = result
+
+    @property
+    def errors(self):
+        return [result for result in self.files if not result.ok]
+
+    def __repr__(self):
+        return '<Summary files=%i errors=%i>' % (
+            len(self.files), len(self.errors)
+            )
+
+def handler_state(handler):
+    # by default, the state of a handler is its instance dictionary
+    return dict(vars(handler))
+
+class _FileWorker(object):
+
+    def __init__(self, handler, state, width, lines, block_size):
+        self.handler = handler
+        self.state = state
+        self.width, self.lines = width, lines
+        self.block_size = block_size
+
+    def __call__(self, path):
+        start = default_timer()
+        try:
+            handler = self.handler()
+            with open_source(path, self.width, self.lines,
+                             self.block_size) as source:
+                handler.handle(source)
+            state = self.state(handler)
+            # so that a state that cannot be sent back to the parent is
+            # reported against its file
+            dumps(state, HIGHEST_PROTOCOL)
+        except Exception:
+            return FileResult(path, error=''.join(
+                traceback.format_exception(*sys.exc_info())
+                ), seconds=default_timer()-start)
+        return FileResult(path, state, seconds=default_timer()-start)
+
+_file_worker = None
+
+def _init_files(*args):
+    global _file_worker
+    _file_worker = _FileWorker(*args)
+
+def _handle_file(indexed):
+    index, path = indexed
+    return index, _file_worker(path)
+
+def run(handler, files, width=None, lines=False, block_size=None,
+        processes=None, state=handler_state, reduce=None):
+    # Handle each of the files, which may be a list of paths or a glob
+    # pattern, with a new instance of the Handler subclass, in a pool
+    # of processes. Each process has one file open at a time, so the
+    # number of processes also limits the number of files open at once.
+    # Files may be compressed, see fixed.sources.open_source.
+    # The state function is called with the handler once it has handled
+    # a file and must return something that can be pickled. If reduce
+    # is passed, it is called with a list of the states of the files
+    # that were handled without error, and what it returns is the
+    # result of the Summary returned.
+    if isinstance(files, basestring):
+        files = sorted(glob(files))
+    files = list(files)
+    results = [None] * len(files)
+    if files:
+        pool = Pool(min(processes or cpu_count(), len(files)),
+                    _init_files, (handler, state, width, lines, block_size))
+        try:
+            for index, result in pool.imap_unordered(
+                _handle_file, enumerate(files)
+                ):
+                results[index] = result
+        finally:
+            pool.terminate()
+    summary = Summary(results)
+    if reduce is not None:
+        summary.result = reduce([r.state for r in results if r.ok])
+    return summary
@@ -1,11 +1,54 @@
 # Copyright (c) 2012 Simplistix Ltd
 # See license.txt for license details.
 
-from collections import namedtuple
-from operator import attrgetter
-
-from exceptions import UnknownRecordType
+from controls import Totals
+from exceptions import FixedException, UnknownRecordType
 from records import Record
+from sources import Pushed
+
+class Node(object):
+    # Looks up a slice of a row, giving either a record key, another
+    # node to consult, or the default if the slice is not found.
+
+    __slots__ = ('slice', 'mapping', 'default')
+
+    def __init__(self, slice, mapping, default):
+        self.slice, self.mapping, self.default = slice, mapping, default
+
+    def __repr__(self):
+        return '<Node (%s-%s) %r default=%r>' % (
+            self.slice.start, self.slice.stop, self.mapping, self.default
+            )
+
+def build_tree(groups, default=None):
+    # groups is a sorted list of (start, stop, {text: key}).
+    # Discriminators that start where the first group does are reached
+    # through it, so longer discriminators are preferred to shorter ones
+    # that prefix them. Discriminators that start elsewhere are tried,
+    # in order of position, when those fail to match.
+    if not groups:
+        return default
+    start, stop, texts = groups[0]
+    longer = {}
+    others = []
+    for group in groups[1:]:
+        if group[0] == start:
+            for text, key in group[2].items():
+                longer.setdefault(text[:stop-start], {}).setdefault(
+                    group[:2], {}
+                    )[text] = key
+        else:
+            others.append(group)
+    default = build_tree(others, default)
+    mapping = {}
+    for prefix, longer_groups in longer.items():
+        mapping[prefix] = build_tree(
+            sorted((s, e, t) for (s, e), t in longer_groups.items()),
+            texts.get(prefix, default)
+            )
+    for text, key in texts.items():
+        mapping.setdefault(text, key)
+    return Node(slice(start, stop), mapping, default)
 
 class ParserMeta(type):
 
@@ -16,14 +59,28 @@ class ParserMeta(type):
         for name, obj in dict_.items():
             if isinstance(obj, type) and issubclass(obj, Record):
                 disc = obj.disc
-                discs[disc.slice.start, disc.slice.stop] = disc
+                discs.setdefault(
+                    (disc.slice.start, disc.slice.stop), {}
+                    )[disc.text] = obj
                 records.append(obj)
-                record_mapping[disc.text] = obj
-        discs = discs.values()
-        if len(discs)>1:
-            raise TypeError('Inconsistent discriminators: %r' % discs)
-        if discs:
-            dict_['disc_slice'] = discs[0].slice
+        groups = sorted((s, e, t) for (s, e), t in discs.items())
+        if len(groups)>1:
+            # Inconsistent discriminators are found using a tree of
+            # lookups, with records keyed on discriminator position
+            # as well as text.
+            dispatch_groups = []
+            for start, stop, texts in groups:
+                keys = {}
+                for text, obj in texts.items():
+                    keys[text] = key = (start, stop, text)
+                    record_mapping[key] = obj
+                dispatch_groups.append((start, stop, keys))
+            dict_['dispatch'] = build_tree(dispatch_groups)
+        elif groups:
+            record_mapping.update(groups[0][2])
+        if groups:
+            # this is used to report the discriminator of unknown records
+            dict_['disc_slice'] = slice(*groups[0][:2])
         parser = type.__new__(cls, class_name, bases, dict_)
         for record in records:
             record._parser = parser
@@ -31,37 +88,329 @@ class ParserMeta(type):
 
 ignore = object()
 
+class Validation(object):
+    # The outcome of Parser.validate
+
+    def __init__(self):
+        self.rows = 0
+        # (line number, exception) for each problem found
+        self.errors = []
+        # False if validation stopped because of too many errors
+        self.complete = True
+
+    @property
+    def valid(self):
+        return self.complete and not self.errors
+
+    def summary(self):
+        # exception class name -> count
+        summary = {}
+        for line_no, error in self.errors:
+            name = error.__class__.__name__
+            summary[name] = summary.get(name, 0) + 1
+        return summary
+
+    def __repr__(self):
+        return '<Validation rows=%i errors=%i complete=%r>' % (
+            self.rows, len(self.errors), self.complete
+            )
+
 class Parser(object):
 
     __metaclass__ = ParserMeta
+
+    dispatch = None
+
+    # fixed.controls.Control instances for the control totals to check
+    controls = ()
     
-    def __init__(self, iterable, parse_only=None, parse_unknown=True):
+    def __init__(self, iterable, parse_only=None, parse_unknown=True,
+                 lazy=False, fields=None, stats=None, where=None):
         self.iterable = iterable
         self.parse_unknown = parse_unknown
-        if parse_only:
-            record_mapping = {}
-            for k, type in self.record_mapping.items():
-                if type in parse_only:
-                    t = type
-                else:
-                    t = ignore
-                record_mapping[k] = t
-            self.record_mapping = record_mapping
+        # a fixed.stats.Stats to record what is found in, if any
+        self.stats = stats
+        # discriminator -> predicate that rows must match to be parsed,
+        # for the record types given conditions in where
+        self.predicates = predicates = {}
+        # discriminator -> function to parse a row, or ignore
+        self.parsers = parsers = {}
+        # discriminator -> record type or, where fields has been used to
+        # name the only fields to parse for that type, its projection
+        self.record_mapping = record_mapping = {}
+        # records needed for control totals are always parsed, but those
+        # not in parse_only are not yielded
+        controlled = set()
+        for control in self.controls:
+            controlled.update(control.records)
+            controlled.add(control.field._record)
+            for record in list(control.records) + [control.field._record]:
+                # rows not matching would never be added to the totals
+                if where and record in where:
+                    raise TypeError(
+                        '%s cannot be filtered with where as it is used by %r'
+                        % (record.__name__, control)
+                        )
+            for field in control.needs():
+                names = (fields or {}).get(field._record)
+                if names is not None and field.name not in names:
+                    raise TypeError('%s.%s is needed for %r' % (
+                        field._record.__name__, field.name, control
+                        ))
+        # record types parsed only for the controls
+        self.hidden = hidden = set()
+        for k, record in self.__class__.record_mapping.items():
+            type = record
+            if (parse_only and record not in parse_only and
+                record not in controlled):
+                parse = ignore
+            else:
+                if parse_only and record not in parse_only:
+                    hidden.add(record)
+                if fields and record in fields:
+                    type = record.projection(fields[record])
+                parse = type.lazy_type if lazy else type.parse
+                if where and record in where:
+                    predicates[k] = record.predicate(where[record])
+            record_mapping[k] = type
+            parsers[k] = parse
+
+    @classmethod
+    def pushed(cls, feed, *args, **kw):
+        # parse data as it is pushed in, see fixed.sources.Pushed; any
+        # other parameters are passed on as when making a parser
+        return Pushed(lambda rows: cls(rows, *args, **kw), feed)
+
+    @classmethod
+    def record_type(cls, row):
+        # the record type for a row, or None if it is not known
+        if cls.dispatch is None:
+            key = row[cls.disc_slice]
+        else:
+            key = cls.dispatch
+            while key.__class__ is Node:
+                key = key.mapping.get(row[key.slice], key.default)
+        return cls.record_mapping.get(key)
 
     def __iter__(self):
         # NB: this will always return an object for each record in the
         #     file, so enumerate can reliably be used to figure out
         #     line numbers if needed
+        # NB: rows may be buffers on a MappedFile, so they are only
+        #     turned into strings with row[:] when reporting problems
+        if self.stats is not None:
+            results = self._counted()
+        elif self.predicates:
+            results = self._filtered()
+        elif self.dispatch is None:
+            results = self._sliced()
+        else:
+            results = self._dispatched()
+        if self.controls:
+            return self._controlled(results)
+        return results
+
+    def _sliced(self):
+        # all discriminators are in the same place
         for row in self.iterable:
-            disc = row[self.disc_slice]
-            record_type = self.record_mapping.get(disc)
-            if record_type is None:
+            try:
+                disc = row[self.disc_slice]
+            except TypeError:
+                # problems found by the source, such as WrongLength
+                if isinstance(row, FixedException):
+                    yield row
+                    continue
+                raise
+            parse = self.parsers.get(disc)
+            if parse is None:
                 if self.parse_unknown:
-                    yield UnknownRecordType(disc, row)
+                    yield UnknownRecordType(disc, row[:])
                 continue
-            elif record_type is ignore:
+            elif parse is ignore:
                 continue
             try:
-                yield record_type(row)
+                yield parse(row)
             except Exception:
-                yield record_type.explain(row)
+                yield self.record_mapping[disc].explain(row[:])
+
+    def _dispatched(self):
+        # discriminators are in different places
+        for row in self.iterable:
+            key = self.dispatch
+            try:
+                while key.__class__ is Node:
+                    key = key.mapping.get(row[key.slice], key.default)
+            except TypeError:
+                if isinstance(row, FixedException):
+                    yield row
+                    continue
+                raise
+            parse = self.parsers.get(key)
+            if parse is None:
+                if self.parse_unknown:
+                    yield UnknownRecordType(row[self.disc_slice], row[:])
+                continue
+            elif parse is ignore:
+                continue
+            try:
+                yield parse(row)
+            except Exception:
+                yield self.record_mapping[key].explain(row[:])
+
+    def _controlled(self, results):
+        # check the control totals, see fixed.controls.Totals
+        totals = Totals(self)
+        check = totals.check
+        for result in results:
+            result = check(result)
+            if result is not None:
+                yield result
+        error = totals.end()
+        if error is not None:
+            yield error
+
+    def _filtered(self):
+        # as _sliced and _dispatched, but only parsing rows that match
+        # the predicate for their record type, if there is one
+        parsers, predicates = self.parsers, self.predicates
+        dispatch, disc_slice = self.dispatch, self.disc_slice
+        for row in self.iterable:
+            try:
+                if dispatch is None:
+                    key = row[disc_slice]
+                else:
+                    key = dispatch
+                    while key.__class__ is Node:
+                        key = key.mapping.get(row[key.slice], key.default)
+            except TypeError:
+                if isinstance(row, FixedException):
+                    yield row
+                    continue
+                raise
+            parse = parsers.get(key)
+            if parse is None:
+                if self.parse_unknown:
+                    yield UnknownRecordType(row[disc_slice], row[:])
+                continue
+            elif parse is ignore:
+                continue
+            predicate = predicates.get(key)
+            if predicate is not None and not predicate(row):
+                continue
+            try:
+                yield parse(row)
+            except Exception:
+                yield self.record_mapping[key].explain(row[:])
+
+    def _counted(self):
+        # as _sliced and _dispatched, but recording what is found in
+        # self.stats, which is kept off those paths so that it costs
+        # nothing when not used
+        stats = self.stats
+        if stats.time_fields:
+            parsers = stats.parsers(self)
+        else:
+            parsers = self.parsers
+        # key -> record type name
+        names = {}
+        for k, type in self.record_mapping.items():
+            names[k] = getattr(type, 'record', type).__name__
+        records, errors = stats.records, stats.errors
+        predicates, filtered = self.predicates, stats.filtered
+        dispatch, disc_slice = self.dispatch, self.disc_slice
+        every = stats.every
+        stats.start()
+        try:
+            for row in self.iterable:
+                if every and stats.rows and not stats.rows % every:
+                    # once the previous row has been dealt with
+                    stats.report()
+                stats.rows += 1
+                try:
+                    if dispatch is None:
+                        key = row[disc_slice]
+                    else:
+                        key = dispatch
+                        while key.__class__ is Node:
+                            key = key.mapping.get(row[key.slice], key.default)
+                except TypeError:
+                    if not isinstance(row, FixedException):
+                        raise
+                    name = row.__class__.__name__
+                    stats.source_errors[name] = (
+                        stats.source_errors.get(name, 0) + 1
+                        )
+                    yield row
+                    continue
+                stats.bytes += len(row)
+                parse = parsers.get(key)
+                if parse is None:
+                    stats.unknown += 1
+                    if self.parse_unknown:
+                        yield UnknownRecordType(row[disc_slice], row[:])
+                    continue
+                elif parse is ignore:
+                    stats.ignored += 1
+                    continue
+                name = names[key]
+                predicate = predicates.get(key)
+                if predicate is not None and not predicate(row):
+                    filtered[name] = filtered.get(name, 0) + 1
+                    continue
+                try:
+                    record = parse(row)
+                except Exception:
+                    errors[name] = errors.get(name, 0) + 1
+                    yield self.record_mapping[key].explain(row[:])
+                else:
+                    records[name] = records.get(name, 0) + 1
+                    yield record
+        finally:
+            stats.stop()
+
+    def validate(self, max_errors=None):
+        # Check that rows would parse without building records, stopping
+        # once more than max_errors problems have been found. Only the
+        # problems found are explained.
+        validation = Validation()
+        errors = validation.errors
+        checks = {}
+        for k, parse in self.parsers.items():
+            if parse is ignore:
+                checks[k] = ignore
+            else:
+                checks[k] = self.record_mapping[k].check
+        dispatch, disc_slice = self.dispatch, self.disc_slice
+        line_no = 0
+        for line_no, row in enumerate(self.iterable, 1):
+            try:
+                if dispatch is None:
+                    key = row[disc_slice]
+                else:
+                    key = dispatch
+                    while key.__class__ is Node:
+                        key = key.mapping.get(row[key.slice], key.default)
+            except TypeError:
+                if not isinstance(row, FixedException):
+                    raise
+                error = row
+            else:
+                check = checks.get(key)
+                if check is ignore:
+                    continue
+                elif check is None:
+                    if not self.parse_unknown:
+                        continue
+                    error = UnknownRecordType(row[disc_slice], row[:])
+                else:
+                    try:
+                        check(row)
+                        continue
+                    except Exception:
+                        error = self.record_mapping[key].explain(row[:])
+            errors.append((line_no, error))
+            if max_errors is not None and len(errors) > max_errors:
+                validation.complete = False
+                break
+        validation.rows = line_no
+        return validation
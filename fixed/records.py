@@ -4,8 +4,10 @@
 from collections import namedtuple
 from operator import attrgetter
 
+from constants import Constant
 from exceptions import Problem, ConversionError
-from fields import Discriminator, Ordered, Skip
+from fields import Decoded, Discriminator, Ordered, Skip
+from writer import compile_format, encoded
 
 class RecordMeta(type):
 
@@ -17,6 +19,9 @@ class RecordMeta(type):
         for name, obj in elements.items():
             if isinstance(obj, Ordered):
                 obj.name = name
+                # underscored, as constants of one_of fields are
+                # stored as attributes of the field
+                obj._record = cls
                 specs.append(obj)
         specs.sort(key=attrgetter('order'))
 
@@ -24,6 +29,9 @@ class RecordMeta(type):
         discriminator = []
         type_fields = []
         cls.fields = []
+        # as above, but with any convert caches in place of convertors
+        cls.parse_fields = []
+        renders = []
         
         for obj in specs:
             if isinstance(obj, Skip):
@@ -34,11 +42,24 @@ class RecordMeta(type):
                 next_index = index + obj.size
                 type_fields.append(obj.name)
                 s = slice(index, next_index)
-                cls.fields.append((s, obj.convertor))
+                convertor, convert, render = (
+                    obj.convertor, obj.convert, obj.render
+                    )
 
                 if isinstance(obj, Discriminator):
                     obj.slice = s
                     discriminator.append(obj)
+                else:
+                    # discriminators are always compared as bytes
+                    encoding = obj.encoding or cls.encoding
+                    if encoding:
+                        convertor = Decoded(encoding, convertor)
+                        convert = Decoded(encoding, convert)
+                        render = encoded(render, encoding)
+
+                cls.fields.append((s, convertor))
+                cls.parse_fields.append((s, convert))
+                renders.append((s, render))
                     
                 index = next_index
 
@@ -51,32 +72,320 @@ class RecordMeta(type):
             raise TypeError('No discriminator specified')
         cls.disc = discriminator[0]
         cls.type = namedtuple(class_name+'Type', type_fields)
+        cls.lazy_type = lazy_type(class_name, cls.type, cls.parse_fields)
+        cls.projections = {}
+        cls.check = staticmethod(compile_check(class_name, cls.parse_fields))
+        width = cls.width
+        if width is None:
+            width = max(s.stop for s, _ in cls.fields)
+        cls.format = staticmethod(compile_format(class_name, renders, width))
+        cls.renders = renders
+        if cls.lazy:
+            cls.parse = cls.lazy_type
+        else:
+            cls.parse = staticmethod(
+                compile_parse(class_name, cls.type, cls.parse_fields)
+                )
+
+def compile_parse(class_name, type, fields):
+    # Build a straight-line function for a record type, with the slice
+    # bounds and convertors bound in, so that no per-field decisions
+    # are made when parsing each line.
+    namespace = dict(new=tuple.__new__, type=type)
+    elements = []
+    for i, (s, convert) in enumerate(fields):
+        element = 'line[%i:%i]' % (s.start, s.stop)
+        if convert is not None:
+            name = 'convert%i' % i
+            namespace[name] = convert
+            element = '%s(%s)' % (name, element)
+        elements.append(element)
+    source = 'def parse(line):\n    return new(type, (%s,))\n' % (
+        ', '.join(elements)
+        )
+    exec compile(source, '<%s parser>' % class_name, 'exec') in namespace
+    return namespace['parse']
+
+def compile_check(class_name, fields):
+    # As compile_parse, but only runs the convertors so that a line can
+    # be checked without building a record.
+    namespace = {}
+    lines = []
+    for i, (s, convert) in enumerate(fields):
+        if convert is not None:
+            name = 'convert%i' % i
+            namespace[name] = convert
+            lines.append('    %s(line[%i:%i])\n' % (name, s.start, s.stop))
+    source = 'def check(line):\n%s' % (''.join(lines) or '    pass\n')
+    exec compile(source, '<%s checker>' % class_name, 'exec') in namespace
+    return namespace['check']
+
+def raw_text(value, size):
+    # the text of a value as it would appear in a field of the given
+    # size, for constants and values that are already text
+    if isinstance(value, Constant):
+        return value.text.ljust(size)
+    return str(value).ljust(size)
+
+def converted_in(convert, values):
+    # A test for whether the raw text of a field converts to one of the
+    # values. Rows that cannot be converted are let through, so that
+    # parsing them gives a ConversionError as it would without a
+    # condition.
+    def test(raw):
+        try:
+            return convert(raw) in values
+        except Exception:
+            return True
+    return test
+
+def compile_predicate(record, conditions):
+    # Build a function that checks the named fields of a line against
+    # the values given for them, so that lines can be filtered before
+    # they are parsed. Constants and strings are compared with the raw
+    # text of the field, without converting anything. Other values are
+    # compared with the field converted, as there may be many ways of
+    # writing them, such as ' 42', '042' and '42 ' for 42, and only that
+    # field is converted. A value that is a set, list or tuple matches
+    # any of its items.
+    indexes = dict((name, i) for i, name in enumerate(record.type._fields))
+    unknown = sorted(name for name in conditions if name not in indexes)
+    if unknown:
+        raise TypeError('%s has no fields %r' % (record.__name__, unknown))
+    namespace = {}
+    tests = []
+    for i, name in enumerate(sorted(conditions)):
+        s, convert = record.parse_fields[indexes[name]]
+        size = s.stop - s.start
+        value = conditions[name]
+        if isinstance(value, (set, frozenset, list, tuple)):
+            values = list(value)
+        else:
+            values = [value]
+        texts = set()
+        others = []
+        for value in values:
+            if convert is not None and not isinstance(value, (Constant, str)):
+                others.append(value)
+                continue
+            text = raw_text(value, size)
+            if len(text) != size:
+                raise TypeError('%r is not %i characters in %s.%s' % (
+                    value, size, record.__name__, name
+                    ))
+            texts.add(text)
+        element = 'line[%i:%i]' % (s.start, s.stop)
+        parts = []
+        if len(texts) == 1:
+            parts.append('%s == %r' % (element, texts.pop()))
+        elif texts:
+            namespace['texts%i' % i] = frozenset(texts)
+            parts.append('%s in texts%i' % (element, i))
+        if others:
+            namespace['converted%i' % i] = converted_in(convert, others)
+            parts.append('converted%i(%s)' % (i, element))
+        if len(parts) > 1:
+            tests.append('(%s)' % ' or '.join(parts))
+        else:
+            tests.extend(parts)
+    source = 'def predicate(line):\n    return %s\n' % (
+        ' and '.join(tests) or 'True'
+        )
+    exec compile(source, '<%s predicate>' % record.__name__, 'exec') in namespace
+    return namespace['predicate']
+
+class LazyField(object):
+    # Slices and converts a field on first access, after which the
+    # value is found in the instance dictionary.
+
+    def __init__(self, name, slice, convert):
+        self.name, self.slice, self.convert = name, slice, convert
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+        raw = obj._line[self.slice]
+        convert = self.convert
+        if convert is None:
+            value = raw
+        else:
+            try:
+                value = convert(raw)
+            except Exception, e:
+                raise ConversionError(
+                    {self.name: Problem(raw, convert, e)}, obj._line[:]
+                    )
+        obj.__dict__[self.name] = value
+        return value
+
+class Lazy(object):
+    # Behaves like the record's namedtuple type, but only converts
+    # fields when they are used. This is not a tuple, as code that reads
+    # the storage of tuples directly, such as argument unpacking,
+    # would find it empty.
+
+    def __init__(self, line):
+        if line.__class__ is buffer:
+            # rows from a MappedFile are buffers on the mapping, which
+            # may be closed before the record is used
+            line = line[:]
+        self._line = line
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __iter__(self):
+        return iter([getattr(self, name) for name in self._fields])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self)[index]
+        return getattr(self, self._fields[index])
+
+    def __getslice__(self, i, j):
+        return tuple(self)[i:j]
+
+    def __contains__(self, value):
+        return value in tuple(self)
+
+    def __add__(self, other):
+        return tuple(self) + _as_tuple(other)
+
+    def __radd__(self, other):
+        return _as_tuple(other) + tuple(self)
+
+    def __eq__(self, other):
+        return tuple(self) == _as_tuple(other)
+
+    def __ne__(self, other):
+        return tuple(self) != _as_tuple(other)
+
+    def __lt__(self, other):
+        return tuple(self) < _as_tuple(other)
+
+    def __le__(self, other):
+        return tuple(self) <= _as_tuple(other)
+
+    def __gt__(self, other):
+        return tuple(self) > _as_tuple(other)
+
+    def __ge__(self, other):
+        return tuple(self) >= _as_tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return repr(self._type._make(self))
+
+    def __reduce__(self):
+        return self._type, tuple(self)
+
+    def count(self, value):
+        return tuple(self).count(value)
+
+    def index(self, value):
+        return tuple(self).index(value)
+
+    def _asdict(self):
+        return self._type._make(self)._asdict()
+
+    def _replace(self, **kw):
+        return self._type._make(self)._replace(**kw)
+
+def _as_tuple(other):
+    if isinstance(other, Lazy):
+        return tuple(other)
+    return other
+
+def lazy_type(class_name, type, fields):
+    namespace = dict(_type=type, _fields=type._fields)
+    for name, (s, convert) in zip(type._fields, fields):
+        namespace[name] = LazyField(name, s, convert)
+    return type.__class__(class_name+'LazyType', (Lazy,), namespace)
+
+def explain(type, fields, line):
+    problems = {}
+    elements = []
+    for name, field in zip(type._fields, fields):
+        s, convert = field
+        raw = line[s]
+        try:
+            value = (convert or str)(line[s])
+        except Exception, e:
+            problems[name] = Problem(raw, convert, e)
+        else:
+            elements.append(value)
+    if problems:
+        return ConversionError(problems, line)
+    return type(*elements)
+
+class Projection(object):
+    # A record type reduced to the named fields, which are the only
+    # ones sliced and converted when parsing.
+
+    def __init__(self, record, names):
+        if not names:
+            raise TypeError('No fields specified')
+        indexes = dict((name, i) for i, name in enumerate(record.type._fields))
+        unknown = [name for name in names if name not in indexes]
+        if unknown:
+            raise TypeError('%s has no fields %r' % (record.__name__, unknown))
+        class_name = record.__name__
+        self.record, self.names = record, names
+        self.fields = [record.fields[indexes[name]] for name in names]
+        self.parse_fields = [record.parse_fields[indexes[name]]
+                             for name in names]
+        self.type = namedtuple(class_name+'Type', names)
+        self.lazy_type = lazy_type(class_name, self.type, self.parse_fields)
+        if record.lazy:
+            self.parse = self.lazy_type
+        else:
+            self.parse = compile_parse(class_name, self.type, self.parse_fields)
+        self.check = compile_check(class_name, self.parse_fields)
+
+    def explain(self, line):
+        return explain(self.type, self.fields, line)
+
+    def __repr__(self):
+        return '<Projection of %s: %s>' % (
+            self.record.__name__, ', '.join(self.names)
+            )
 
 class Record(object):
     
     __metaclass__ = RecordMeta
 
+    # set to True to only convert fields when they are used
+    lazy = False
+
+    # the width of lines written, defaults to the end of the last field
+    width = None
+
+    # if set, fields are decoded from bytes using this encoding when
+    # they are converted, unless they specify their own encoding
+    encoding = None
+
     def __new__(self, line):
         # fast
-        return self.type(*(
-            line[s] if convert is None else convert(line[s])
-            for s, convert in self.fields
-            ))
+        return self.parse(line)
 
     @classmethod
     def explain(cls, line):
         # safe and verbose, but slow
-        problems = {}
-        elements = []
-        for name, field in zip(cls.type._fields, cls.fields):
-            s, convert = field
-            raw = line[s]
-            try:
-                value = (convert or str)(line[s])
-            except Exception, e:
-                problems[name] = Problem(raw, convert, e)
-            else:
-                elements.append(value)
-        if problems:
-            return ConversionError(problems, line)
-        return cls.type(*elements)
+        return explain(cls.type, cls.fields, line)
+
+    @classmethod
+    def predicate(cls, conditions):
+        # see compile_predicate
+        return compile_predicate(cls, conditions)
+
+    @classmethod
+    def projection(cls, names):
+        # the same projection is always returned for the same names, so
+        # its type can be used for dispatch
+        names = tuple(names)
+        projection = cls.projections.get(names)
+        if projection is None:
+            projection = cls.projections[names] = Projection(cls, names)
+        return projection
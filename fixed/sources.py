@@ -0,0 +1,446 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+import bz2
+import mmap
+import os
+import sys
+import zlib
+from Queue import Empty, Queue
+from threading import Thread
+
+from exceptions import WrongLength
+
+try:
+    import lzma
+except ImportError:
+    try:
+        # the backport needed for xz files on Python 2
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+class RecordFeed(object):
+    # Split data into concatenated fixed width records as it arrives,
+    # such as from a socket, without doing any I/O itself.
+
+    def __init__(self, width):
+        self.width = width
+        self.remainder = ''
+
+    def feed(self, data):
+        # returns the records completed by data
+        width = self.width
+        if self.remainder:
+            data = self.remainder + data
+        end = len(data) - len(data) % width
+        self.remainder = data[end:]
+        return [data[start:start+width] for start in xrange(0, end, width)]
+
+    def close(self):
+        # a trailing short record is dropped
+        self.remainder = ''
+        return []
+
+class Chunker(object):
+    # Turn a stream of concatenated fixed width records into an iterable
+    # of records, reading the stream in large blocks rather than one
+    # record at a time. A trailing short record is dropped.
+
+    block_size = 4*1024*1024
+
+    def __init__(self, stream, width, block_size=None):
+        self.stream = stream
+        self.width = width
+        if block_size is not None:
+            self.block_size = block_size
+
+    def __iter__(self):
+        width = self.width
+        # always read a whole number of records where possible
+        size = max(self.block_size // width, 1) * width
+        read = self.stream.read
+        feed = RecordFeed(width)
+        while True:
+            block = read(size)
+            if not block:
+                break
+            for record in feed.feed(block):
+                yield record
+
+    def tracked(self, offset=0):
+        # yields (offset, record), where offset is that just after the
+        # record, counting from the given offset
+        width = self.width
+        for record in self:
+            offset += width
+            yield offset, record
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class MappedFile(object):
+    # Memory map a file of concatenated fixed width records and yield
+    # each record as a read-only buffer on the mapping. Nothing is copied
+    # until a slice of a record, such as its discriminator, is taken.
+    # A trailing short record is dropped.
+
+    def __init__(self, file, width):
+        self.width = width
+        size = os.fstat(file.fileno()).st_size
+        if size:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # empty files cannot be mapped
+            self.map = ''
+        self.end = size - size % width
+
+    def __iter__(self):
+        map, width = self.map, self.width
+        for offset in xrange(0, self.end, width):
+            yield buffer(map, offset, width)
+
+    def close(self):
+        if self.map:
+            self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class LineFeed(object):
+    # Split data into newline terminated fixed width records as it
+    # arrives, such as from a socket, without doing any I/O itself.
+    # Both \n and \r\n terminators are handled. If a width is given,
+    # any line not of that width is returned as a WrongLength rather
+    # than a record.
+
+    def __init__(self, width=None):
+        self.width = width
+        self.remainder = ''
+
+    def _checked(self, lines):
+        width = self.width
+        if width is None:
+            return lines
+        return [line if len(line) == width else WrongLength(width, line)
+                for line in lines]
+
+    def feed(self, data):
+        # returns the lines completed by data
+        if self.remainder:
+            data = self.remainder + data
+        end = data.rfind('\n')
+        if end < 0:
+            self.remainder = data
+            return []
+        self.remainder = data[end+1:]
+        data = data[:end]
+        if '\r' in data:
+            data = data.replace('\r\n', '\n')
+            if data.endswith('\r'):
+                data = data[:-1]
+        return self._checked(data.split('\n'))
+
+    def close(self):
+        # returns the last line, if it was not terminated
+        remainder, self.remainder = self.remainder, ''
+        if remainder.endswith('\r'):
+            remainder = remainder[:-1]
+        if remainder:
+            return self._checked([remainder])
+        return []
+
+class Lines(object):
+    # Turn a stream of newline terminated fixed width records into an
+    # iterable of records, reading the stream in large blocks and
+    # splitting each block in one go. See LineFeed for details.
+
+    block_size = 4*1024*1024
+
+    def __init__(self, stream, width=None, block_size=None):
+        self.stream = stream
+        self.width = width
+        if block_size is not None:
+            self.block_size = block_size
+
+    def __iter__(self):
+        read = self.stream.read
+        size = self.block_size
+        feed = LineFeed(self.width)
+        while True:
+            block = read(size)
+            if not block:
+                break
+            for line in feed.feed(block):
+                yield line
+        for line in feed.close():
+            yield line
+
+    def tracked(self, offset=0):
+        # Yields (offset, line), where offset is that just after the
+        # line and its terminator, counting from the given offset. The
+        # lines are split one at a time so that the length of each
+        # terminator is known.
+        read = self.stream.read
+        size = self.block_size
+        checked = LineFeed(self.width)._checked
+        remainder = ''
+        while True:
+            block = read(size)
+            if not block:
+                break
+            data = remainder + block
+            end = data.rfind('\n')
+            if end < 0:
+                remainder = data
+                continue
+            remainder = data[end+1:]
+            raw = data[:end].split('\n')
+            for piece, line in zip(raw, checked([
+                piece[:-1] if piece.endswith('\r') else piece
+                for piece in raw
+                ])):
+                offset += len(piece) + 1
+                yield offset, line
+        if remainder:
+            offset += len(remainder)
+            if remainder.endswith('\r'):
+                remainder = remainder[:-1]
+            if remainder:
+                yield offset, checked([remainder])[0]
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class Pushed(object):
+    # Runs a pipeline that pulls rows, such as a Parser or the handled
+    # method of a Handler, on data pushed to it, such as from a socket.
+    # The data is split into rows by feed, a RecordFeed or LineFeed.
+    # Each call to feed or close returns the results of the pipeline
+    # for the rows completed by the data given. Line numbers, pending
+    # batches and control totals carry on from one call to the next, so
+    # the results are those the pipeline would give for all the data
+    # in one go.
+    #
+    # The pipeline runs in a background thread, which each call passes
+    # its rows to and waits for until the pipeline asks for more, so
+    # close must be called once all the data has been pushed.
+
+    def __init__(self, pipeline, feed):
+        self.splitter = feed
+        self.rows = Queue()
+        self.results = Queue()
+        self.finished = False
+        self.thread = Thread(target=self._run, args=(pipeline, ))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _source(self, collected):
+        get, put = self.rows.get, self.results.put
+        while True:
+            rows = get()
+            if rows is None:
+                return
+            for row in rows:
+                yield row
+            # the pipeline has dealt with all the rows it has been given
+            put((True, collected[:]))
+            del collected[:]
+
+    def _run(self, pipeline):
+        collected = []
+        try:
+            for result in pipeline(self._source(collected)):
+                collected.append(result)
+        except:
+            self.results.put((False, sys.exc_info()))
+        else:
+            self.results.put((True, collected))
+
+    def _send(self, rows):
+        if self.finished:
+            raise ValueError('No more data can be pushed')
+        self.rows.put(rows)
+        ok, results = self.results.get()
+        if not ok:
+            self.finished = True
+            raise results[0], results[1], results[2]
+        return results
+
+    def feed(self, data):
+        return self._send(self.splitter.feed(data))
+
+    def close(self):
+        results = self._send(self.splitter.close())
+        results.extend(self._send(None))
+        self.finished = True
+        self.thread.join()
+        return results
+
+class Decompressed(object):
+    # A stream of the data decompressed from a compressed file, read in
+    # large blocks. Each read returns whatever one block decompresses
+    # to, whatever size is asked for, which Chunker and Lines handle.
+    # Files of several concatenated compressed streams are supported.
+    # EOFError is raised if the file ends part way through a stream, so
+    # that a truncated file is not taken to be complete. The checksums
+    # at the end of each stream are checked by the decompressors.
+
+    block_size = 1024*1024
+
+    def __init__(self, file, decompressor, block_size=None):
+        self.file = file
+        # called to make a decompressor for each compressed stream
+        self.decompressor = decompressor
+        if block_size is not None:
+            self.block_size = block_size
+        self.current = decompressor()
+        # whether any data has been passed to the current decompressor
+        self.started = False
+        self.pending = ''
+
+    def read(self, size=None):
+        while True:
+            raw, self.pending = self.pending, ''
+            if not raw:
+                raw = self.file.read(self.block_size)
+                if not raw:
+                    if self.started and not _ended(self.current):
+                        raise EOFError('Compressed file ended before the '
+                                       'end of a stream')
+                    self.started = False
+                    return ''
+            try:
+                data = self.current.decompress(raw)
+            except EOFError:
+                # the previous stream ended exactly at the end of a block
+                self.current = self.decompressor()
+                self.pending = raw
+                continue
+            self.started = True
+            if self.current.unused_data:
+                # the start of the next stream
+                self.pending = self.current.unused_data
+                self.current = self.decompressor()
+                self.started = False
+            if data:
+                return data
+
+    def close(self):
+        self.file.close()
+
+def _ended(decompressor):
+    # Whether a decompressor has reached the end of its stream. Once
+    # they have, bz2 and lzma decompressors raise EOFError when given
+    # more data, while zlib ones put it in unused_data.
+    try:
+        decompressor.decompress('\x00')
+    except EOFError:
+        return True
+    except Exception:
+        return False
+    return decompressor.unused_data == '\x00'
+
+class Prefetched(object):
+    # A stream read in blocks by a background thread, so that reading,
+    # and any decompression, overlaps with parsing. At most depth
+    # blocks are held waiting to be read.
+
+    def __init__(self, stream, block_size=4*1024*1024, depth=2):
+        self.stream = stream
+        self.blocks = Queue(depth)
+        self.done = False
+        self.stopped = False
+        self.thread = Thread(target=self._read, args=(block_size, ))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _read(self, block_size):
+        put, read = self.blocks.put, self.stream.read
+        try:
+            while not self.stopped:
+                block = read(block_size)
+                put((True, block))
+                if not block:
+                    break
+        except:
+            put((False, sys.exc_info()))
+
+    def read(self, size=None):
+        # blocks are the size the thread reads, whatever size is asked for
+        if self.done:
+            return ''
+        ok, block = self.blocks.get()
+        if not ok:
+            self.done = True
+            raise block[0], block[1], block[2]
+        if not block:
+            self.done = True
+        return block
+
+    def close(self):
+        self.done = self.stopped = True
+        # let the thread finish if it is waiting to add a block
+        while self.thread.is_alive():
+            try:
+                self.blocks.get(timeout=0.1)
+            except Empty:
+                pass
+        self.stream.close()
+
+# (magic bytes at the start of a file, callable returning a decompressor)
+compressions = [
+    ('\x1f\x8b', lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)),
+    ]
+# bz2 magic bytes end with the block size, 1 to 9
+compressions.extend(('BZh%i' % size, bz2.BZ2Decompressor)
+                    for size in range(1, 10))
+if lzma is not None:
+    compressions.append(('\xfd7zXZ\x00', lzma.LZMADecompressor))
+
+def decompressor_for(start):
+    # the decompressor factory for a file starting with start, or None
+    for magic, decompressor in compressions:
+        if start.startswith(magic):
+            return decompressor
+    if start.startswith('\xfd7zXZ\x00'):
+        raise ImportError('backports.lzma is needed to read xz files')
+
+def open_source(path, width=None, lines=False, block_size=None,
+                background=False):
+    # Open a file of concatenated records of the given width, or of
+    # newline terminated records if lines is True, that may be gzip,
+    # bz2 or xz compressed. If background is True, the file is read and
+    # decompressed in a background thread.
+    # The Chunker or Lines returned should be closed when done with.
+    if width is None and not lines:
+        raise TypeError('width is needed unless lines is True')
+    stream = open(path, 'rb')
+    try:
+        decompressor = decompressor_for(stream.read(6))
+    except:
+        stream.close()
+        raise
+    stream.seek(0)
+    if decompressor is not None:
+        stream = Decompressed(stream, decompressor)
+    if background:
+        stream = Prefetched(stream, block_size or Chunker.block_size)
+    if lines:
+        return Lines(stream, width, block_size)
+    return Chunker(stream, width, block_size)
@@ -0,0 +1,145 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+from threading import Lock
+from timeit import default_timer
+
+from parser import ignore
+from records import compile_parse
+
+class Timed(object):
+    # Calls a function, adding one to the count and the time it took to
+    # the total in timing, which is a [calls, seconds] list.
+
+    def __init__(self, function, timing, lock=None):
+        self.function, self.timing, self.lock = function, timing, lock
+
+    def __call__(self, *args):
+        start = default_timer()
+        try:
+            return self.function(*args)
+        finally:
+            seconds = default_timer() - start
+            timing = self.timing
+            if self.lock is None:
+                timing[0] += 1
+                timing[1] += seconds
+            else:
+                with self.lock:
+                    timing[0] += 1
+                    timing[1] += seconds
+
+    def __repr__(self):
+        return repr(self.function)
+
+class Stats(object):
+    # Pass to a Parser, or set on a Handler, to count what is found when
+    # parsing. If time_fields is True, the time taken by each field's
+    # convertor is recorded, except for lazy records. If time_handlers
+    # is True, the time taken by each handler method is recorded.
+    # If a callback is given, it is called with the results of as_dict
+    # every `every` rows, if that is set, and when parsing finishes.
+
+    def __init__(self, time_fields=False, time_handlers=False,
+                 callback=None, every=None):
+        self.time_fields = time_fields
+        self.time_handlers = time_handlers
+        self.callback = callback
+        self.every = every
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.started = None
+        # record type name -> count
+        self.records = {}
+        self.errors = {}
+        # record type name -> count of rows not matching the predicate
+        # given for the record type
+        self.filtered = {}
+        self.unknown = 0
+        self.ignored = 0
+        # exception class name -> count, for problems found by the source
+        self.source_errors = {}
+        # 'RecordName.field' -> [calls, seconds]
+        self.fields = {}
+        # handler method name -> [calls, seconds]
+        self.handlers = {}
+
+    def start(self):
+        self.started = default_timer()
+
+    def stop(self):
+        if self.started is not None:
+            self.seconds += default_timer() - self.started
+            self.started = None
+        self.report()
+
+    def report(self):
+        if self.callback is not None:
+            self.callback(self.as_dict())
+
+    def elapsed(self):
+        seconds = self.seconds
+        if self.started is not None:
+            seconds += default_timer() - self.started
+        return seconds
+
+    def parsers(self, parser):
+        # parse functions for a Parser instance that time each convertor
+        parsers = {}
+        compiled = {}
+        for key, parse in parser.parsers.items():
+            type = parser.record_mapping[key]
+            if parse is ignore or parse is type.lazy_type:
+                parsers[key] = parse
+                continue
+            timed = compiled.get(type)
+            if timed is None:
+                record = getattr(type, 'record', type)
+                fields = []
+                for name, (s, convert) in zip(type.type._fields,
+                                              type.parse_fields):
+                    if convert is not None:
+                        timing = self.fields.setdefault(
+                            '%s.%s' % (record.__name__, name), [0, 0.0]
+                            )
+                        convert = Timed(convert, timing)
+                    fields.append((s, convert))
+                timed = compiled[type] = compile_parse(
+                    record.__name__, type.type, fields
+                    )
+            parsers[key] = timed
+        return parsers
+
+    def timed(self, method):
+        timing = self.handlers.setdefault(method.__name__, [0, 0.0])
+        return Timed(method, timing, self.lock)
+
+    def as_dict(self):
+        seconds = self.elapsed()
+        return dict(
+            rows=self.rows,
+            bytes=self.bytes,
+            seconds=seconds,
+            rows_per_second=self.rows / seconds if seconds else None,
+            bytes_per_second=self.bytes / seconds if seconds else None,
+            records=dict(self.records),
+            errors=dict(self.errors),
+            filtered=dict(self.filtered),
+            unknown=self.unknown,
+            ignored=self.ignored,
+            source_errors=dict(self.source_errors),
+            fields=_timings(self.fields),
+            handlers=_timings(self.handlers),
+            )
+
+    def __repr__(self):
+        return '<Stats rows=%i bytes=%i>' % (self.rows, self.bytes)
+
+def _timings(timings):
+    return dict((name, dict(calls=calls, seconds=seconds))
+                for name, (calls, seconds) in timings.items())
@@ -0,0 +1,82 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+from decimal import Decimal
+from unittest import TestCase
+
+import numpy as np
+from testfixtures import ShouldRaise, compare
+
+from .. import Constant, Discriminator, Field, Record, Skip, one_of
+from ..arrays import parse_array, raw_dtype, register, vectorized
+
+class TestArrays(TestCase):
+
+    def setUp(self):
+        class ARecord(Record):
+            prefix = Discriminator('A')
+            count = Field(2, int)
+            price = Field(4, float)
+            unused = Skip(1)
+            code = Field(1, one_of(
+                x = Constant('X', 'an X'),
+                y = Constant('Y', 'a Y'),
+                ))
+            text = Field(2)
+        self.record = ARecord
+
+    def test_raw_dtype(self):
+        dtype = raw_dtype(self.record)
+        compare(dtype.names, ('prefix', 'count', 'price', 'code', 'text'))
+        compare(dtype.itemsize, 11)
+        compare(dtype.fields['code'], (np.dtype('S1'), 8))
+
+    def test_raw_dtype_width(self):
+        compare(raw_dtype(self.record, 12).itemsize, 12)
+
+    def test_parse(self):
+        result = parse_array(self.record, 'A 21.50 XabA13 2.5-Ycd')
+        compare(len(result), 2)
+        compare(result['prefix'].tolist(), ['A', 'A'])
+        compare(result['count'].dtype, np.dtype(np.int64))
+        compare(result['count'].tolist(), [2, 13])
+        compare(result['price'].tolist(), [1.5, 2.5])
+        self.assertTrue(result['code'][0] is self.record.code.x)
+        self.assertTrue(result['code'][1] is self.record.code.y)
+        compare(result['text'].tolist(), ['ab', 'cd'])
+
+    def test_width_and_trailing_short_record(self):
+        result = parse_array(self.record, 'A 21.50 Xab\nA13 2.5-Ycd\nA', 12)
+        compare(result['count'].tolist(), [2, 13])
+        compare(result['text'].tolist(), ['ab', 'cd'])
+
+    def test_empty(self):
+        compare(len(parse_array(self.record, '')), 0)
+
+    def test_fallback(self):
+        class ARecord(Record):
+            prefix = Discriminator('A')
+            amount = Field(4, Decimal)
+        result = parse_array(ARecord, 'A 1.5A 2.0')
+        compare(result['amount'].tolist(), [Decimal('1.5'), Decimal('2.0')])
+
+    def test_register(self):
+        def implied(text):
+            return int(text) / 100.0
+        register(implied, lambda column: column.astype(np.int64) / 100.0)
+        try:
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                amount = Field(4, implied)
+            result = parse_array(ARecord, 'A0150A1234')
+        finally:
+            del vectorized[implied]
+        compare(result['amount'].tolist(), [1.5, 12.34])
+
+    def test_conversion_error(self):
+        with ShouldRaise(ValueError):
+            parse_array(self.record, 'AXX1.50 Xab')
+
+    def test_unknown_constant(self):
+        with ShouldRaise(KeyError('Z')):
+            parse_array(self.record, 'A 21.50 Zab')
@@ -0,0 +1,65 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+from decimal import Decimal
+from unittest import TestCase
+
+from testfixtures import TempDirectory, compare
+
+from .. import ConversionError, UnknownRecordType
+from ..benchmark import generate, make_parser, run
+
+class TestBenchmark(TestCase):
+
+    def setUp(self):
+        self.dir = TempDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def test_make_parser(self):
+        parser = make_parser(2, 3, ('int', 'decimal'))
+        compare(['A', 'B'], sorted(parser.record_mapping))
+        record = parser.record_mapping['A']
+        compare(['int', 'decimal', 'int'], record.kinds)
+        parsed = record('A       1    2.50       3')
+        compare((1, Decimal('2.50'), 3), parsed[1:])
+
+    def test_generate(self):
+        parser = make_parser(2, 2)
+        path = self.dir.getpath('test.dat')
+        width = generate(parser, path, 100, mix=[3, 1], seed=1)
+        compare(17, width)
+        with open(path, 'rb') as source:
+            data = source.read()
+        compare(1700, len(data))
+        lines = [data[i:i+width] for i in range(0, len(data), width)]
+        results = list(parser(lines))
+        counts = {}
+        for result in results:
+            name = result.__class__.__name__
+            counts[name] = counts.get(name, 0) + 1
+        compare(['Record0Type', 'Record1Type'], sorted(counts))
+        self.assertTrue(counts['Record0Type'] > counts['Record1Type'])
+
+    def test_generate_errors_and_unknowns(self):
+        parser = make_parser(1, 2, ('int', ))
+        path = self.dir.getpath('test.dat')
+        width = generate(parser, path, 200, error_rate=0.5,
+                         unknown_rate=0.5)
+        with open(path, 'rb') as source:
+            data = source.read()
+        lines = [data[i:i+width] for i in range(0, len(data), width)]
+        types = set(r.__class__ for r in parser(lines))
+        compare(set([parser.record_mapping['A'].type,
+                     ConversionError, UnknownRecordType]), types)
+
+    def test_run(self):
+        results = run(records=50, stages=['chunker', 'parser', 'handler'],
+                      error_rate=0.1, directory=self.dir.path)
+        compare(['chunker', 'parser', 'handler'],
+                [r['stage'] for r in results['results']])
+        for result in results['results']:
+            compare(50 * 81, result['bytes'])
+            self.assertTrue(result['peak_rss_kb'] > 0)
+        compare(50, results['results'][0]['results'])
+        # the temporary data file is removed
+        self.dir.compare([])
@@ -0,0 +1,176 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+import gzip
+from StringIO import StringIO
+from unittest import TestCase
+
+from testfixtures import ShouldRaise, TempDirectory, compare
+
+from .. import (
+    Checkpoint,
+    Chunker,
+    Discriminator,
+    Field,
+    Handler,
+    Lines,
+    Parser,
+    Record,
+    Tracked,
+    WrongLength,
+    handles,
+    handles_batch,
+    open_source,
+    )
+
+class TestCheckpoint(TestCase):
+
+    def setUp(self):
+        self.dir = TempDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def test_save_and_load(self):
+        path = self.dir.getpath('state')
+        Checkpoint(30, 10, 8).save(path)
+        compare(Checkpoint(30, 10, 8), Checkpoint.load(path))
+        self.dir.compare(['state'])
+
+    def test_load_missing(self):
+        compare(Checkpoint(0, 0), Checkpoint.load(self.dir.getpath('state')))
+
+    def test_repr(self):
+        compare('<Checkpoint offset=3 line_no=1 results=0>',
+                repr(Checkpoint(3, 1)))
+
+class TestTracked(TestCase):
+
+    def test_chunker(self):
+        source = Tracked(Chunker(StringIO('AXXBYYCZZ'), 3))
+        positions = [(row, source.offset, source.line_no) for row in source]
+        compare([('AXX', 3, 1), ('BYY', 6, 2), ('CZZ', 9, 3)], positions)
+        compare(Checkpoint(9, 3), source.checkpoint())
+
+    def test_chunker_resume(self):
+        source = Tracked(Chunker(StringIO('AXXBYYCZZ'), 3), Checkpoint(3, 1))
+        positions = [(row, source.offset, source.line_no) for row in source]
+        compare([('BYY', 6, 2), ('CZZ', 9, 3)], positions)
+
+    def test_lines(self):
+        source = Tracked(Lines(StringIO('AXX\r\nBYY\nCZZ'), block_size=4))
+        positions = [(row, source.offset, source.line_no) for row in source]
+        compare([('AXX', 5, 1), ('BYY', 9, 2), ('CZZ', 12, 3)], positions)
+
+    def test_lines_resume(self):
+        source = Tracked(Lines(StringIO('AXX\r\nBYY\nCZZ\n')),
+                         Checkpoint(5, 1))
+        positions = [(row, source.offset, source.line_no) for row in source]
+        compare([('BYY', 9, 2), ('CZZ', 13, 3)], positions)
+
+    def test_lines_wrong_length(self):
+        source = Tracked(Lines(StringIO('AXX\nBY\nCZZ\r'), width=3))
+        rows = list(source)
+        compare(WrongLength, rows[1].__class__)
+        compare(['AXX', 'CZZ'], [rows[0], rows[2]])
+        compare(Checkpoint(11, 3), source.checkpoint())
+
+    def test_compressed(self):
+        dir = TempDirectory()
+        self.addCleanup(dir.cleanup)
+        path = dir.getpath('data.gz')
+        output = gzip.open(path, 'wb')
+        output.write('AXX')
+        output.close()
+        with open_source(path, 3) as source:
+            with ShouldRaise(TypeError(
+                'Sources whose streams cannot seek, such as compressed ones, '
+                'cannot be tracked'
+                )):
+                Tracked(source)
+
+class TestHandlerCheckpoints(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(1, int)
+            class BRecord(Record):
+                prefix = Discriminator('B')
+                data = Field(1)
+        self.parser = TheParser
+        self.dir = TempDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def make_handler(self, **attrs):
+        class MyHandler(Handler):
+            checkpoints = None
+            def checkpointed(self, checkpoint):
+                self.checkpoints.append(checkpoint)
+                Handler.checkpointed(self, checkpoint)
+            @handles(self.parser.ARecord)
+            def handle_A(self, source, line_no, rec):
+                return line_no, rec.data
+        handler = MyHandler()
+        handler.checkpoints = []
+        for name, value in attrs.items():
+            setattr(handler, name, value)
+        return handler
+
+    def test_checkpoints(self):
+        handler = self.make_handler(checkpoint_every=2)
+        source = Tracked(Chunker(StringIO('A1BXA2A3A4'), 2))
+        # B records are not parsed, so are not counted, as when the
+        # source is not tracked
+        compare([(1, 1), (2, 2), (3, 3), (4, 4)],
+                list(handler.handled(source)))
+        compare([Checkpoint(6, 3, 2), Checkpoint(10, 5, 4)],
+                handler.checkpoints)
+        untracked = self.make_handler().handled(['A1', 'BX', 'A2', 'A3', 'A4'])
+        compare([(1, 1), (2, 2), (3, 3), (4, 4)], list(untracked))
+
+    def test_checkpoint_at_end(self):
+        handler = self.make_handler(checkpoint_every=2)
+        source = Tracked(Chunker(StringIO('A1A2A3BX'), 2))
+        list(handler.handled(source))
+        compare([Checkpoint(4, 2, 2), Checkpoint(8, 4, 3)],
+                handler.checkpoints)
+
+    def test_resume(self):
+        path = self.dir.getpath('state')
+        data = 'A1\nBX\nA2\nA3\nA4\n'
+
+        class Died(Exception):
+            pass
+
+        handler = self.make_handler(checkpoint_every=1, state_file=path)
+        seen = []
+        with ShouldRaise(Died):
+            for result in handler.handled(Tracked(Lines(StringIO(data)))):
+                seen.append(result)
+                if len(seen) == 2:
+                    raise Died()
+        compare([(1, 1), (2, 2)], seen)
+        # the second record was handled, but the checkpoint after it was
+        # not taken, so it will be handled again
+        compare(Checkpoint(3, 1, 1), Checkpoint.load(path))
+
+        handler = self.make_handler(checkpoint_every=1, state_file=path)
+        source = Tracked(Lines(StringIO(data)), Checkpoint.load(path))
+        compare([(2, 2), (3, 3), (4, 4)], list(handler.handled(source)))
+        compare(Checkpoint(15, 5, 4), Checkpoint.load(path))
+
+    def test_no_checkpoints(self):
+        handler = self.make_handler()
+        source = Tracked(Chunker(StringIO('A1BXA2'), 2), Checkpoint(2, 1, 1))
+        compare([(2, 2)], list(handler.handled(source)))
+        compare([], handler.checkpoints)
+
+    def test_batches(self):
+        class MyHandler(Handler):
+            checkpoint_every = 1
+            @handles_batch(self.parser.ARecord)
+            def handle_A(self, source, line_nos, recs):
+                pass
+        with ShouldRaise(TypeError('Checkpoints cannot be taken when using '
+                                   'threads or batch handlers')):
+            MyHandler().handled(Tracked(Chunker(StringIO('A1'), 2)))
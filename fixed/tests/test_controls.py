@@ -0,0 +1,201 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+from decimal import Decimal
+from unittest import TestCase
+
+from testfixtures import Comparison as C, ShouldRaise, compare, generator
+
+from .. import (
+    ControlTotalError,
+    ConversionError,
+    Count,
+    Discriminator,
+    Field,
+    Handler,
+    Parser,
+    Record,
+    Total,
+    handles,
+    )
+
+class TestControls(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class Header(Record):
+                prefix = Discriminator('H')
+            class Detail(Record):
+                prefix = Discriminator('D')
+                amount = Field(4, Decimal)
+            class Trailer(Record):
+                prefix = Discriminator('T')
+                count = Field(2, int)
+                total = Field(5, Decimal)
+            controls = [
+                Count(Detail, Trailer.count),
+                Total(Detail.amount, Trailer.total),
+                ]
+        self.parser = TheParser
+
+    def test_match(self):
+        P = self.parser
+        compare(generator(
+            P.Header.type('H'),
+            P.Detail.type('D', Decimal('1.5')),
+            P.Detail.type('D', Decimal('2.0')),
+            P.Trailer.type('T', 2, Decimal('3.5')),
+            ), P(['H', 'D1.5', 'D2.0', 'T 2  3.5']))
+
+    def test_mismatch(self):
+        P = self.parser
+        results = list(P(['H', 'D1.5', 'D2.0', 'T 3  3.5']))
+        compare(4, len(results))
+        compare(C(ControlTotalError,
+                  problems=dict(count=(3, 2)),
+                  trailer=P.Trailer.type('T', 3, Decimal('3.5')),
+                  strict=False), results[3])
+
+    def test_per_batch(self):
+        P = self.parser
+        results = list(P(['H', 'D1.5', 'T 1  1.5',
+                          'H', 'D2.0', 'D1.0', 'T 2  2.0']))
+        compare(C(ControlTotalError,
+                  problems=dict(total=(Decimal('2.0'), Decimal('3.0'))),
+                  strict=False), results[-1])
+        compare(P.Trailer.type('T', 1, Decimal('1.5')), results[2])
+
+    def test_conversion_errors_not_counted(self):
+        P = self.parser
+        results = list(P(['DX.X', 'T 1  0.0']))
+        compare(ControlTotalError, results[1].__class__)
+
+    def test_lazy(self):
+        P = self.parser
+        results = list(P(['D1.5', 'T 1  1.5'], lazy=True))
+        compare([P.Detail.type('D', Decimal('1.5')),
+                 P.Trailer.type('T', 1, Decimal('1.5'))], results)
+
+    def test_lazy_conversion_error(self):
+        P = self.parser
+        results = list(P(['D1.5', 'DX.X', 'T 1  1.5'], lazy=True))
+        compare(3, len(results))
+        compare(C(ConversionError, line='DX.X', strict=False), results[1])
+        compare(P.Trailer.type('T', 1, Decimal('1.5')), results[2])
+
+    def test_lazy_trailer_conversion_error(self):
+        P = self.parser
+        results = list(P(['D1.5', 'T X  1.5', 'D2.0', 'T 1  2.0'], lazy=True))
+        compare(C(ConversionError, line='T X  1.5', strict=False), results[1])
+        compare(P.Trailer.type('T', 1, Decimal('2.0')), results[3])
+
+    def test_parse_only(self):
+        # records needed for controls are parsed, but not yielded
+        P = self.parser
+        compare([P.Header.type('H')],
+                list(P(['H', 'D1.5', 'T 1  1.5'], parse_only=[P.Header])))
+        results = list(P(['H', 'D1.5', 'T 2  1.5'], parse_only=[P.Header]))
+        compare(2, len(results))
+        compare(P.Header.type('H'), results[0])
+        compare(C(ControlTotalError,
+                  problems=dict(count=(2, 1)),
+                  strict=False), results[1])
+
+    def test_parse_only_conversion_error(self):
+        # problems converting records only parsed for the controls show
+        # up as mismatches
+        P = self.parser
+        results = list(P(['H', 'DX.X', 'T 1  0.0'], parse_only=[P.Header]))
+        compare(2, len(results))
+        compare(C(ControlTotalError,
+                  problems=dict(count=(1, 0)),
+                  strict=False), results[1])
+
+    def test_fields(self):
+        P = self.parser
+        compare([P.Detail.projection(['amount']).type(Decimal('1.5')),
+                 P.Trailer.type('T', 1, Decimal('1.5'))],
+                list(P(['D1.5', 'T 1  1.5'], fields={P.Detail: ['amount']})))
+
+    def test_fields_missing(self):
+        P = self.parser
+        with ShouldRaise(TypeError(
+            'Detail.amount is needed for '
+            '<Total of Detail.amount checked against Trailer.total>'
+            )):
+            P([], fields={P.Detail: ['prefix']})
+        with ShouldRaise(TypeError(
+            'Trailer.count is needed for '
+            '<Count of Detail checked against Trailer.count>'
+            )):
+            P([], fields={P.Trailer: ['total']})
+
+    def test_where(self):
+        P = self.parser
+        with ShouldRaise(TypeError(
+            'Detail cannot be filtered with where as it is used by '
+            '<Count of Detail checked against Trailer.count>'
+            )):
+            P(['D1.5', 'D2.0', 'T 2  3.5'],
+              where={P.Detail: {'amount': '1.5'}})
+        with ShouldRaise(TypeError(
+            'Trailer cannot be filtered with where as it is used by '
+            '<Count of Detail checked against Trailer.count>'
+            )):
+            P([], where={P.Trailer: {'count': 2}})
+        compare([P.Header.type('H')],
+                list(P(['H', 'D1.5', 'T 1  1.5'], parse_only=[P.Header],
+                       where={P.Header: {'prefix': 'H'}})))
+
+    def test_handler_where(self):
+        P = self.parser
+        class MyHandler(Handler):
+            @handles(P.Detail, where={'amount': '1.5'})
+            def handle_detail(self, source, line_no, rec):
+                return rec.amount
+        with ShouldRaise(TypeError):
+            MyHandler().handle(['D1.5', 'D2.0', 'T 2  3.5'])
+
+    def test_missing_trailer(self):
+        P = self.parser
+        results = list(P(['H', 'D1.5', 'T 1  1.5', 'H', 'D2.0']))
+        compare(6, len(results))
+        compare(C(ControlTotalError,
+                  problems=dict(count=(None, 1),
+                                total=(None, Decimal('2.0'))),
+                  trailer=None,
+                  strict=False), results[5])
+
+    def test_nothing_after_trailer(self):
+        P = self.parser
+        compare(3, len(list(P(['D1.5', 'T 1  1.5', 'H']))))
+
+    def test_handler(self):
+        P = self.parser
+        class MyHandler(Handler):
+            @handles(P.Header)
+            def handle_header(self, source, line_no, rec):
+                return line_no
+        compare([1], list(MyHandler().handled(['H', 'D1.5', 'T 1  1.5'])))
+        with ShouldRaise(ControlTotalError):
+            MyHandler().handle(['H', 'D1.5', 'T 1  2.5'])
+
+    def test_several_record_types(self):
+        class TheParser(Parser):
+            class A(Record):
+                prefix = Discriminator('A')
+            class B(Record):
+                prefix = Discriminator('B')
+            class Trailer(Record):
+                prefix = Discriminator('T')
+                count = Field(1, int)
+            controls = [Count([A, B], Trailer.count)]
+        compare(TheParser.Trailer.type('T', 3),
+                list(TheParser(['A', 'B', 'A', 'T3']))[-1])
+
+    def test_repr(self):
+        P = self.parser
+        compare('<Count of Detail checked against Trailer.count>',
+                repr(P.controls[0]))
+        compare('<Total of Detail.amount checked against Trailer.total>',
+                repr(P.controls[1]))
@@ -1,6 +1,10 @@
+from pickle import dumps, loads
 from unittest import TestCase
 
-from .. import FixedException, UnknownRecordType, ConversionError, Problem
+from .. import (
+    FixedException, UnknownRecordType, ConversionError, Problem, WrongLength,
+    ControlTotalError
+    )
 
 class TestUnknown(TestCase):
 
@@ -60,6 +64,47 @@ class TestConversionError(TestCase):
             "problems={'foo': 'x'}, line='XYZ'"
             )
     
+class TestWrongLength(TestCase):
+
+    def setUp(self):
+        self.e = WrongLength(3, 'XY')
+
+    def test_subclassing(self):
+        self.assertTrue(isinstance(self.e, FixedException))
+
+    def test_attributes(self):
+        self.assertEqual(self.e.expected, 3)
+        self.assertEqual(self.e.line, 'XY')
+
+    def test_tuple(self):
+        self.assertEqual(self.e[0], 3)
+        self.assertEqual(self.e[1], 'XY')
+        self.assertEqual(len(self.e), 2)
+
+    def test_repr(self):
+        self.assertEqual(
+            repr(self.e),
+            "<WrongLength expected=3, line='XY'>"
+            )
+
+class TestControlTotalError(TestCase):
+
+    def setUp(self):
+        self.e = ControlTotalError(dict(count=(3, 2)), 'T3')
+
+    def test_subclassing(self):
+        self.assertTrue(isinstance(self.e, FixedException))
+
+    def test_attributes(self):
+        self.assertEqual(self.e.problems, dict(count=(3, 2)))
+        self.assertEqual(self.e.trailer, 'T3')
+
+    def test_repr(self):
+        self.assertEqual(
+            repr(self.e),
+            "<ControlTotalError problems={'count': (3, 2)}, trailer='T3'>"
+            )
+
 class TestProblem(TestCase):
 
     def setUp(self):
@@ -76,3 +121,21 @@ class TestProblem(TestCase):
             repr(self.p),
             "<Problem: Could not convert 'X' using <type 'int'>, gave TypeError('Foo',)>"
             )
+
+class TestPickle(TestCase):
+
+    def test_unknown(self):
+        e = loads(dumps(UnknownRecordType('X', 'XYZ'), 2))
+        self.assertTrue(isinstance(e, UnknownRecordType))
+        self.assertEqual(e.discriminator, 'X')
+        self.assertEqual(e.line, 'XYZ')
+
+    def test_conversion_error(self):
+        e = loads(dumps(ConversionError(
+            dict(foo=Problem('X', int, ValueError('Foo'))), 'XYZ'
+            )))
+        self.assertTrue(isinstance(e, ConversionError))
+        self.assertEqual(str(e.problems['foo']),
+                         "Could not convert 'X' using <type 'int'>, "
+                         "gave ValueError('Foo',)")
+        self.assertEqual(e.line, 'XYZ')
@@ -5,7 +5,7 @@ from unittest import TestCase
 
 from testfixtures import ShouldRaise, compare
 
-from .. import Discriminator, Field, Skip, Constant, one_of, all
+from .. import Discriminator, Field, Record, Skip, Constant, one_of, all
 
 class TestField(TestCase):
 
@@ -29,6 +29,63 @@ class TestField(TestCase):
         f2 = Field(2)
         self.assertTrue(f1.order < f2.order)
 
+    def test_render(self):
+        from ..writer import constant, left, right
+        def render(value, size): pass
+        compare(Field(1).render, None)
+        compare(Field(1, int).render, right)
+        compare(Field(1, lambda text: text).render, left)
+        compare(Field(1, one_of(Constant('X'))).render, constant)
+        compare(Field(1, int, render=render).render, render)
+
+    def test_no_cache(self):
+        f = Field(1, int)
+        compare(f.cache, None)
+        self.assertTrue(f.convert is int)
+
+    def test_cache(self):
+        f = Field(1, int, cache=10)
+        self.assertTrue(f.convertor is int)
+        self.assertTrue(f.convert is f.cache)
+        compare(f.cache.size, 10)
+        compare(repr(f.cache), "<type 'int'>")
+
+    def test_cache_no_convertor(self):
+        f = Field(1, cache=10)
+        compare(f.cache, None)
+        compare(f.convert, None)
+
+class TestCache(TestCase):
+
+    def setUp(self):
+        self.calls = calls = []
+        def conv(text):
+            calls.append(text)
+            return int(text)
+        self.cache = Field(1, conv, cache=2).cache
+
+    def test_hits_and_misses(self):
+        compare([1, 2, 1, 1], [self.cache(t) for t in '1211'])
+        compare(self.calls, ['1', '2'])
+        compare(self.cache.hits, 2)
+        compare(self.cache.misses, 2)
+
+    def test_bounded(self):
+        compare([1, 2, 3, 1], [self.cache(t) for t in '1231'])
+        compare(self.calls, ['1', '2', '3', '1'])
+        self.assertTrue(len(self.cache.values) <= 2)
+
+    def test_exception_not_cached(self):
+        for i in range(2):
+            with ShouldRaise(ValueError(
+                "invalid literal for int() with base 10: 'X'"
+                )):
+                self.cache('X')
+        compare(self.calls, ['X', 'X'])
+        compare(self.cache.values, {})
+        compare(self.cache.hits, 0)
+        compare(self.cache.misses, 0)
+
 class TestConstants(TestCase):
 
     def test_attributes(self):
@@ -97,6 +154,10 @@ class TestConstants(TestCase):
         with ShouldRaise(TypeError('convertor is None, not a one_of instance')):
             all(f)
 
+    def test_field_overwrite_cache_attr(self):
+        with ShouldRaise(AttributeError("Constant cannot be stored as 'cache'")):
+            Field(1, one_of(Constant('C', 'cache')))
+
     def test_field_overwrite_attr(self):
         with ShouldRaise(AttributeError("Constant cannot be stored as 'size'")):
             Field(1, one_of(Constant('S', 'size')))
@@ -105,6 +166,12 @@ class TestConstants(TestCase):
         with ShouldRaise(AttributeError("Constant cannot be stored as 'size'")):
             Field(1, one_of(Constant('S', 'size'), Constant('T', 'size')))
         
+    def test_field_constant_named_record(self):
+        class R(Record):
+            prefix = Discriminator('R')
+            kind = Field(1, one_of(Constant('X', 'record')))
+        self.assertTrue(R.kind.record is R.kind.convertor.attrs['record'])
+
     def test_field_different_widths(self):
         with ShouldRaise(TypeError("<XX> does not have a size of 1")):
             Field(1, one_of(Constant('XX')))
@@ -0,0 +1,212 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+from unittest import TestCase
+
+from testfixtures import Comparison as C, compare
+
+from .. import (
+    ControlTotalError,
+    ConversionError,
+    Count,
+    Discriminator,
+    Field,
+    Group,
+    Groups,
+    Parser,
+    Record,
+    StructureError,
+    UnknownRecordType,
+    )
+
+class TestGroups(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class Header(Record):
+                prefix = Discriminator('H')
+                batch = Field(2)
+            class Detail(Record):
+                prefix = Discriminator('D')
+                amount = Field(2, int)
+            class Note(Record):
+                prefix = Discriminator('N')
+                text = Field(2)
+            class Trailer(Record):
+                prefix = Discriminator('T')
+                count = Field(2, int)
+        self.parser = TheParser
+        class Batches(Groups):
+            header = TheParser.Header
+            trailer = TheParser.Trailer
+        self.groups = Batches
+
+    def check_group(self, group, line_no, header, details, trailer,
+                    trailer_line_no, errors=()):
+        compare(Group, group.__class__)
+        compare(line_no, group.line_no)
+        compare(header, group.header)
+        compare(details, list(group.details))
+        compare(trailer, group.trailer)
+        compare(trailer_line_no, group.trailer_line_no)
+        compare(list(errors), group.errors)
+
+    def test_simple(self):
+        P = self.parser
+        groups = list(self.groups(P([
+            'H01', 'D01', 'D02', 'T02',
+            'H02', 'T00',
+            ])))
+        compare(2, len(groups))
+        self.check_group(groups[0], 1, P.Header.type('H', '01'),
+                         [P.Detail.type('D', 1), P.Detail.type('D', 2)],
+                         P.Trailer.type('T', 2), 4)
+        self.check_group(groups[1], 5, P.Header.type('H', '02'),
+                         [], P.Trailer.type('T', 0), 6)
+        compare("<Group at line 5: HeaderType(prefix='H', batch='02')>",
+                repr(groups[1]))
+
+    def test_details_restricted(self):
+        P = self.parser
+        class Batches(self.groups):
+            details = [P.Detail]
+        group, = Batches(P(['H01', 'D01', 'NXX', 'T01']))
+        compare([P.Detail.type('D', 1)], group.details)
+        compare([(3, C(StructureError, strict=False,
+                       problem='Unexpected record',
+                       line_no=3,
+                       record=P.Note.type('N', 'XX')))],
+                group.errors)
+
+    def test_parser_problems(self):
+        P = self.parser
+        results = list(self.groups(P(['XXX', 'H01', 'DXX', 'QQQ', 'T01'])))
+        compare(UnknownRecordType, results[0].__class__)
+        group = results[1]
+        compare([], group.details)
+        compare([(3, ConversionError), (4, UnknownRecordType)],
+                [(line_no, e.__class__) for line_no, e in group.errors])
+
+    def test_structure_errors(self):
+        P = self.parser
+        results = list(self.groups(P([
+            'D01', 'T01', 'H01', 'D01', 'H02', 'D02',
+            ])))
+        compare(C(StructureError, strict=False,
+                  problem='Record outside group',
+                  line_no=1, record=P.Detail.type('D', 1)), results[0])
+        compare(C(StructureError, strict=False,
+                  problem='Trailer without header',
+                  line_no=2, record=P.Trailer.type('T', 1)), results[1])
+        self.check_group(results[2], 3, P.Header.type('H', '01'),
+                         [P.Detail.type('D', 1)], None, None)
+        compare(C(StructureError, strict=False,
+                  problem='Header without trailer',
+                  line_no=3, record=P.Header.type('H', '01')), results[3])
+        self.check_group(results[4], 5, P.Header.type('H', '02'),
+                         [P.Detail.type('D', 2)], None, None)
+        compare(C(StructureError, strict=False,
+                  problem='Header without trailer',
+                  line_no=5, record=P.Header.type('H', '02')), results[5])
+        compare(6, len(results))
+
+    def test_projections(self):
+        P = self.parser
+        class Batches(Groups):
+            header = P.Header.projection(['batch'])
+            trailer = P.Trailer
+        group, = Batches(P(['H01', 'D01', 'T01'],
+                           fields={P.Header: ['batch']}))
+        compare(P.Header.projection(['batch']).type('01'), group.header)
+
+    def test_control_total_error(self):
+        class P(Parser):
+            class Header(Record):
+                prefix = Discriminator('H')
+                batch = Field(2)
+            class Detail(Record):
+                prefix = Discriminator('D')
+                amount = Field(2, int)
+            class Trailer(Record):
+                prefix = Discriminator('T')
+                count = Field(2, int)
+            controls = [Count(Detail, Trailer.count)]
+        class Batches(Groups):
+            header = P.Header
+            trailer = P.Trailer
+        results = list(Batches(P([
+            'H01', 'D01', 'T02', 'T01',
+            ])))
+        compare(3, len(results))
+        self.check_group(results[0], 1, P.Header.type('H', '01'),
+                         [P.Detail.type('D', 1)], P.Trailer.type('T', 2), 3,
+                         [(3, C(ControlTotalError, strict=False,
+                                problems=dict(count=(2, 1)),
+                                trailer=P.Trailer.type('T', 2)))])
+        compare(C(ControlTotalError, strict=False,
+                  problems=dict(count=(1, 0))), results[1])
+        compare(C(StructureError, strict=False,
+                  problem='Trailer without header',
+                  line_no=4, record=P.Trailer.type('T', 1)), results[2])
+
+    def test_lazy(self):
+        P = self.parser
+        group, = self.groups(P(['H01', 'D01', 'T01'], lazy=True))
+        compare(P.Header.type('H', '01'), group.header)
+        compare([P.Detail.type('D', 1)], group.details)
+
+class TestStreamedGroups(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class Header(Record):
+                prefix = Discriminator('H')
+            class Detail(Record):
+                prefix = Discriminator('D')
+                amount = Field(1, int)
+            class Trailer(Record):
+                prefix = Discriminator('T')
+        self.parser = TheParser
+        class Batches(Groups):
+            header = TheParser.Header
+            trailer = TheParser.Trailer
+            stream_details = True
+        self.groups = Batches
+
+    def test_streamed(self):
+        P = self.parser
+        consumed = []
+        def rows():
+            for row in ['H', 'D1', 'D2', 'T', 'H', 'D3', 'T']:
+                consumed.append(row)
+                yield row
+        groups = iter(self.groups(P(rows())))
+        group = groups.next()
+        compare(['H'], consumed)
+        compare(None, group.trailer)
+        details = iter(group.details)
+        compare(P.Detail.type('D', 1), details.next())
+        compare(['H', 'D1'], consumed)
+        compare([P.Detail.type('D', 2)], list(details))
+        compare(P.Trailer.type('T'), group.trailer)
+        compare(4, group.trailer_line_no)
+        group = groups.next()
+        compare([P.Detail.type('D', 3)], list(group.details))
+        compare([], list(groups))
+
+    def test_details_skipped(self):
+        P = self.parser
+        groups = list(self.groups(P(['H', 'D1', 'D2', 'T', 'H', 'T'])))
+        compare([1, 5], [group.line_no for group in groups])
+        compare([P.Trailer.type('T')] * 2, [group.trailer for group in groups])
+
+    def test_header_without_trailer(self):
+        P = self.parser
+        groups = iter(self.groups(P(['H', 'D1', 'H', 'T'])))
+        group = groups.next()
+        compare([P.Detail.type('D', 1)], list(group.details))
+        compare(C(StructureError, strict=False,
+                  problem='Header without trailer',
+                  line_no=1, record=P.Header.type('H')), groups.next())
+        compare(3, groups.next().line_no)
+        compare([], list(groups))
@@ -1,8 +1,14 @@
+from StringIO import StringIO
+from threading import Lock
+from time import sleep
 from unittest import TestCase
 
 from testfixtures import Comparison as C, ShouldRaise, generator, compare
 
-from ..import Parser, Record, Field, Discriminator, Handler, handles
+from ..import (
+    Parser, Record, Field, Discriminator, Handler, handles, handles_batch
+    )
+from ..handler import FILE, TYPE
 import fixed
 
 class TestHandlers(TestCase):
@@ -137,3 +143,305 @@ class TestHandlers(TestCase):
             (source, 1, self.parser.ARecord.type('A', 'XX')),
             (source, 2, self.parser.BRecord.type('B', 'YY')),
             ), handler.handled(source))
+
+    def test_source_exception_handling(self):
+        class MyHandler(Handler):
+            @handles(self.parser.ARecord)
+            def handle_ARecord(self, source, line_no, rec):
+                return line_no, rec
+            @handles(fixed.WrongLength)
+            def handle_wrong_length(self, source, line_no, rec):
+                return line_no, rec
+
+        handler = MyHandler()
+        source = fixed.Lines(StringIO('AXX\nAX\n'), 3)
+        compare(generator(
+            (1, self.parser.ARecord.type('A', 'XX')),
+            (2, C('fixed.WrongLength', expected=3, line='AX', args=())),
+            ), handler.handled(source))
+
+    def test_lazy(self):
+
+        class MyHandler(Handler):
+
+            lazy = True
+
+            @handles(self.parser.ARecord)
+            def handle_ARecord(self, source, line_no, rec):
+                return line_no, rec
+
+        handler = MyHandler()
+        source = ['AXX', 'BYY']
+        records = list(handler.handled(source))
+        compare([(1, self.parser.ARecord.type('A', 'XX'))], records)
+        self.assertTrue(isinstance(records[0][1],
+                                   self.parser.ARecord.lazy_type))
+
+    def test_fields(self):
+
+        class MyHandler(Handler):
+
+            @handles(self.parser.ARecord, fields=['data'])
+            def handle_ARecord(self, source, line_no, rec):
+                return line_no, rec
+
+            @handles(self.parser.BRecord)
+            def handle_BRecord(self, source, line_no, rec):
+                return line_no, rec
+
+        projection = self.parser.ARecord.projection(['data'])
+        compare(MyHandler.fields, {self.parser.ARecord: ('data', )})
+        compare(generator(
+            (1, projection.type('XX')),
+            (2, self.parser.BRecord.type('B', 'YY')),
+            ), MyHandler().handled(['AXX', 'BYY']))
+
+    def test_fields_conflict(self):
+        with ShouldRaise(TypeError(
+            "Conflicting fields handled for ARecord: "
+            "<Projection of ARecord: prefix> and <Projection of ARecord: data>"
+            )):
+            class MyHandler(Handler):
+
+                @handles(self.parser.ARecord, fields=['data'])
+                @handles(self.parser.ARecord, fields=['prefix'])
+                def handle_ARecord(self, source, line_no, rec):
+                    pass
+
+class TestWhereHandlers(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                status = Field(1)
+                data = Field(1, int)
+            class BRecord(Record):
+                prefix = Discriminator('B')
+                data = Field(1)
+        self.parser = TheParser
+
+    def test_handles(self):
+        class MyHandler(Handler):
+            @handles(self.parser.ARecord, where=dict(status='X'))
+            def handle_A(self, source, line_no, rec):
+                return line_no, rec.data
+        compare([(1, 1), (2, 3)],
+                list(MyHandler().handled(['AX1', 'AYZ', 'AX3'])))
+
+    def test_handles_batch(self):
+        class MyHandler(Handler):
+            @handles_batch(self.parser.ARecord, fields=['data'],
+                           where=dict(status='X'))
+            def handle_A(self, source, line_nos, recs):
+                return [rec.data for rec in recs]
+        compare([[1, 3]], list(MyHandler().handled(['AX1', 'AYZ', 'AX3'])))
+
+    def test_conflicting_conditions(self):
+        with ShouldRaise(TypeError) as s:
+            class MyHandler(Handler):
+                @handles(self.parser.ARecord, where=dict(status='X'))
+                def handle_A(self, source, line_no, rec):
+                    pass
+                @handles(self.parser.ARecord, where=dict(status='Y'))
+                def handle_A_again(self, source, line_no, rec):
+                    pass
+        self.assertTrue(str(s.raised).startswith(
+            'Conflicting conditions for ARecord'
+            ))
+
+class TestThreadedHandlers(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                delay = Field(1, int)
+            class BRecord(Record):
+                prefix = Discriminator('B')
+                delay = Field(1, int)
+        self.parser = TheParser
+        self.source = ['A3', 'B0', 'A0', 'B2', 'A1']
+
+    def make_handler(self, **attrs):
+        class MyHandler(Handler):
+            threads = 4
+
+            def __init__(self):
+                self.lock = Lock()
+                self.running = self.max_running = 0
+                self.started = []
+
+            @handles(self.parser.ARecord)
+            @handles(self.parser.BRecord)
+            def handle(self, source, line_no, rec):
+                with self.lock:
+                    self.started.append(line_no)
+                    self.running += 1
+                    self.max_running = max(self.running, self.max_running)
+                sleep(rec.delay * 0.02)
+                with self.lock:
+                    self.running -= 1
+                return line_no
+
+        for name, value in attrs.items():
+            setattr(MyHandler, name, value)
+        return MyHandler()
+
+    def test_file_order(self):
+        handler = self.make_handler()
+        compare([1, 2, 3, 4, 5], list(handler.handled(self.source)))
+        self.assertTrue(handler.max_running > 1)
+
+    def test_unordered(self):
+        handler = self.make_handler(ordering=None)
+        results = list(handler.handled(self.source))
+        compare([1, 2, 3, 4, 5], sorted(results))
+        self.assertFalse(results == [1, 2, 3, 4, 5])
+        self.assertTrue(handler.max_running > 1)
+
+    def test_type_order(self):
+        handler = self.make_handler(ordering=TYPE)
+        results = list(handler.handled(self.source))
+        compare([1, 3, 5], [r for r in results if r in (1, 3, 5)])
+        compare([2, 4], [r for r in results if r in (2, 4)])
+        # calls for the same type are made one at a time, in order
+        compare([1, 3, 5], [r for r in handler.started if r in (1, 3, 5)])
+        compare(handler.max_running, 2)
+
+    def test_max_in_flight(self):
+        for ordering in FILE, TYPE, None:
+            handler = self.make_handler(ordering=ordering, max_in_flight=1)
+            compare([1, 2, 3, 4, 5], list(handler.handled(self.source)))
+            compare(handler.max_running, 1)
+
+    def test_handler_exception(self):
+        class MyHandler(Handler):
+            threads = 2
+            @handles(self.parser.ARecord)
+            def handle(self, source, line_no, rec):
+                if line_no == 3:
+                    raise ValueError(line_no)
+                return line_no
+        for ordering in FILE, TYPE, None:
+            MyHandler.ordering = ordering
+            with ShouldRaise(ValueError(3)):
+                list(MyHandler().handled(self.source))
+
+    def test_unhandled_exception(self):
+        for ordering in FILE, TYPE, None:
+            handler = self.make_handler(ordering=ordering)
+            results = []
+            with ShouldRaise(fixed.UnknownRecordType('C', 'C0')):
+                for result in handler.handled(['A0', 'B0', 'C0', 'A0']):
+                    results.append(result)
+            compare([1, 2], sorted(results))
+            # no handlers are called for the records after the exception
+            compare([1, 2], sorted(handler.started))
+
+    def test_unhandled_exception_after_many(self):
+        # every record before the exception is handled before it is raised
+        for ordering in FILE, TYPE, None:
+            handler = self.make_handler(ordering=ordering)
+            results = []
+            with ShouldRaise(fixed.UnknownRecordType('C', 'C0')):
+                for result in handler.handled(['A1'] * 10 + ['C0', 'A0']):
+                    results.append(result)
+            compare(range(1, 11), sorted(results))
+            compare(range(1, 11), sorted(handler.started))
+
+class TestBatchHandlers(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(1, int)
+            class BRecord(Record):
+                prefix = Discriminator('B')
+                data = Field(1)
+        self.parser = TheParser
+        self.A = TheParser.ARecord.type
+        self.B = TheParser.BRecord.type
+
+    def make_handler(self, **kw):
+        class MyHandler(Handler):
+            @handles_batch(self.parser.ARecord, **kw)
+            def handle_A(self, source, line_nos, recs):
+                return 'A', line_nos, recs
+            @handles(self.parser.BRecord)
+            def handle_B(self, source, line_no, rec):
+                return 'B', line_no, rec
+        return MyHandler()
+
+    def test_size(self):
+        handler = self.make_handler(size=2)
+        A, B = self.A, self.B
+        compare([
+            ('B', 2, B('B', 'X')),
+            ('A', [1, 3], [A('A', 1), A('A', 2)]),
+            ('A', [4], [A('A', 3)]),
+            ], list(handler.handled(['A1', 'BX', 'A2', 'A3'])))
+
+    def test_flush_on_switch(self):
+        handler = self.make_handler(size=10, flush_on_switch=True)
+        A, B = self.A, self.B
+        compare([
+            ('A', [1, 2], [A('A', 1), A('A', 2)]),
+            ('B', 3, B('B', 'X')),
+            ('A', [4], [A('A', 3)]),
+            ], list(handler.handled(['A1', 'A2', 'BX', 'A3'])))
+
+    def test_end_of_file(self):
+        handler = self.make_handler()
+        compare([
+            ('A', [1, 2], [self.A('A', 1), self.A('A', 2)]),
+            ], list(handler.handled(['A1', 'A2'])))
+
+    def test_flushed_before_exception(self):
+        handler = self.make_handler()
+        results = []
+        with ShouldRaise(fixed.UnknownRecordType('C', 'CX')):
+            for result in handler.handled(['A1', 'CX', 'A2']):
+                results.append(result)
+        compare([('A', [1], [self.A('A', 1)])], results)
+
+    def test_conversion_error_handled(self):
+        class MyHandler(Handler):
+            @handles_batch(self.parser.ARecord)
+            def handle_A(self, source, line_nos, recs):
+                return line_nos
+            @handles(fixed.ConversionError)
+            def handle_error(self, source, line_no, rec):
+                return line_no
+        compare([2, [1, 3]], list(MyHandler().handled(['A1', 'AX', 'A2'])))
+
+    def test_multiple_batches_ordered_by_first_record(self):
+        class MyHandler(Handler):
+            @handles_batch(self.parser.ARecord)
+            @handles_batch(self.parser.BRecord)
+            def handle(self, source, line_nos, recs):
+                return line_nos
+        compare([[1, 3], [2]],
+                list(MyHandler().handled(['A1', 'BX', 'A2'])))
+
+    def test_fields(self):
+        class MyHandler(Handler):
+            @handles_batch(self.parser.BRecord, fields=['data'])
+            def handle(self, source, line_nos, recs):
+                return recs
+        projection = self.parser.BRecord.projection(['data'])
+        compare([[projection.type('X')]],
+                list(MyHandler().handled(['A1', 'BX'])))
+
+    def test_threads(self):
+        for ordering in FILE, TYPE, None:
+            handler = self.make_handler(size=2)
+            handler.threads = 2
+            handler.ordering = ordering
+            results = list(handler.handled(['A1', 'BX', 'A2', 'A3']))
+            compare(3, len(results))
+            if ordering == FILE:
+                compare([('B', 2, self.B('B', 'X')),
+                         ('A', [1, 3], [self.A('A', 1), self.A('A', 2)]),
+                         ('A', [4], [self.A('A', 3)])], results)
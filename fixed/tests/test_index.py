@@ -0,0 +1,113 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+import os
+from unittest import TestCase
+
+from testfixtures import TempDirectory, compare
+
+from .. import Discriminator, Field, Handler, Index, Parser, Record, handles
+
+class TestIndex(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class Header(Record):
+                prefix = Discriminator('H')
+                data = Field(2)
+            class Detail(Record):
+                prefix = Discriminator('D')
+                data = Field(2, int)
+            class Trailer(Record):
+                prefix = Discriminator('T')
+                count = Field(2, int)
+        self.parser = TheParser
+        self.dir = TempDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def test_fixed_width(self):
+        path = self.dir.write('data', 'HXXD01D02XYZD03T03')
+        index = Index.open(self.parser, path, width=3)
+        compare(3, index.count(self.parser.Detail))
+        compare(1, index.unknown)
+        compare(['D02', 'D03'],
+                list(index.rows(self.parser.Detail, 1)))
+        compare([3, 5], index.line_numbers(self.parser.Detail, 1))
+        compare([self.parser.Trailer.type('T', 3)],
+                list(self.parser(index.rows(self.parser.Trailer))))
+        compare('<Index of %s: Detail=3, Header=1, Trailer=1>' % path,
+                repr(index))
+
+    def test_lines(self):
+        path = self.dir.write('data', 'HXX\r\nD01\r\nXYZ\r\nD02\r\nD03\r\nT03')
+        index = Index.open(self.parser, path)
+        compare(['D01', 'D02', 'D03'], list(index.rows(self.parser.Detail)))
+        compare(['D02'], list(index.rows(self.parser.Detail, 1, 2)))
+        compare([2, 4, 5], list(index.line_numbers(self.parser.Detail)))
+        compare(['T03'], list(index.rows(self.parser.Trailer)))
+
+    def test_unknown_type(self):
+        class Other(Record):
+            prefix = Discriminator('O')
+        path = self.dir.write('data', 'HXX')
+        index = Index.open(self.parser, path, width=3)
+        compare(0, index.count(Other))
+        compare([], list(index.rows(Other)))
+        compare([], index.line_numbers(Other))
+
+    def test_sidecar_reused(self):
+        path = self.dir.write('data', 'HXXD01D02T02')
+        Index.open(self.parser, path, width=3)
+        self.assertTrue(os.path.exists(path + '.idx'))
+        built = []
+        class Tracked(Index):
+            def build(self):
+                built.append(True)
+                Index.build(self)
+        index = Tracked.open(self.parser, path, width=3)
+        compare([], built)
+        compare(['D01', 'D02'], list(index.rows(self.parser.Detail)))
+
+    def test_sidecar_invalidated(self):
+        path = self.dir.write('data', 'HXXD01D02T02')
+        Index.open(self.parser, path, width=3)
+        self.dir.write('data', 'HXXD01D02D03T03')
+        index = Index.open(self.parser, path, width=3)
+        compare(['D01', 'D02', 'D03'], list(index.rows(self.parser.Detail)))
+
+    def test_sidecar_same_size_and_time_different_content(self):
+        path = self.dir.write('data', 'HXXD01D02T02')
+        Index.open(self.parser, path, width=3)
+        stat = os.stat(path)
+        self.dir.write('data', 'HXXD01T01D02')
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+        index = Index.open(self.parser, path, width=3)
+        compare(['T01'], list(index.rows(self.parser.Trailer)))
+
+    def test_sidecar_different_width(self):
+        path = self.dir.write('data', 'HXXD01')
+        Index.open(self.parser, path, width=3)
+        index = Index.open(self.parser, path, width=6)
+        compare(0, index.count(self.parser.Detail))
+
+    def test_sidecar_corrupt(self):
+        path = self.dir.write('data', 'HXXD01D02T02')
+        Index.open(self.parser, path, width=3)
+        with open(path + '.idx', 'rb') as source:
+            data = source.read()
+        self.dir.write('data.idx', data[:-4])
+        index = Index.open(self.parser, path, width=3)
+        compare(2, index.count(self.parser.Detail))
+        self.dir.write('data.idx', 'rubbish')
+        index = Index.open(self.parser, path, width=3)
+        compare(2, index.count(self.parser.Detail))
+
+    def test_handler(self):
+        parser = self.parser
+        class MyHandler(Handler):
+            @handles(parser.Detail)
+            def handle_detail(self, source, line_no, rec):
+                return rec.data
+        path = self.dir.write('data', 'HXXD01D02T02')
+        index = Index.open(parser, path, width=3)
+        compare([2], list(MyHandler().handled(index.rows(parser.Detail, 1))))
@@ -0,0 +1,248 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+from unittest import TestCase
+
+from testfixtures import Comparison as C, Replacer, TempDirectory, compare
+
+import gzip
+import os
+from multiprocessing import pool
+from time import sleep
+
+from .. import (
+    Constant, ControlTotalError, Count, Discriminator, Field, Handler,
+    Parser, Record, Total, handles, one_of
+    )
+from ..parallel import parse, run
+
+class TestParallel(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(1, int)
+                const = Field(1, one_of(
+                    x = Constant('X', 'an X'),
+                    y = Constant('Y', 'a Y'),
+                    ))
+            class BRecord(Record):
+                prefix = Discriminator('B')
+                data = Field(2)
+        self.parser = TheParser
+        self.dir = TempDirectory()
+        self.path = self.dir.write('file', 'A1XBYYCZZA2YAQXBXX')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_simple(self):
+        A, B = self.parser.ARecord, self.parser.BRecord
+        expected = [
+            (1, A.type('A', 1, A.const.x)),
+            (2, B.type('B', 'YY')),
+            (3, C('fixed.UnknownRecordType', discriminator='C', line='CZZ', strict=False)),
+            (4, A.type('A', 2, A.const.y)),
+            (5, C('fixed.ConversionError', line='AQX', strict=False)),
+            (6, B.type('B', 'XX')),
+            ]
+        for shard_size in 1, 2, 4, 10:
+            actual = list(parse(self.parser, self.path, 3,
+                                processes=2, shard_size=shard_size))
+            compare(expected, actual)
+            self.assertTrue(actual[0][1].const is A.const.x)
+
+    def test_parse_only(self):
+        B = self.parser.BRecord
+        compare([
+            (2, B.type('B', 'YY')),
+            (3, C('fixed.UnknownRecordType', discriminator='C', line='CZZ', strict=False)),
+            (6, B.type('B', 'XX')),
+            ], list(parse(self.parser, self.path, 3,
+                          parse_only=[B], processes=2, shard_size=2)))
+
+    def test_parse_unknown(self):
+        A = self.parser.ARecord
+        compare([
+            (1, A.type('A', 1, A.const.x)),
+            (4, A.type('A', 2, A.const.y)),
+            (5, C('fixed.ConversionError', line='AQX', strict=False)),
+            ], list(parse(self.parser, self.path, 3,
+                          parse_only=[A], parse_unknown=False,
+                          processes=2, shard_size=2)))
+
+    def test_convertor_not_picklable(self):
+        def convert(text):
+            return int(text)
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(1, lambda text: convert(text))
+        A = TheParser.ARecord
+        path = self.dir.write('lambdas', 'A1AXA2')
+        actual = list(parse(TheParser, path, 2, processes=2, shard_size=1))
+        compare([
+            (1, A.type('A', 1)),
+            (2, C('fixed.ConversionError', line='AX', strict=False)),
+            (3, A.type('A', 2)),
+            ], actual)
+        compare(['data'], actual[1][1].problems.keys())
+        compare('X', actual[1][1].problems['data'].raw)
+
+    def test_lazy(self):
+        class TheParser(Parser):
+            class DRecord(Record):
+                lazy = True
+                prefix = Discriminator('D')
+                data = Field(2, int)
+        D = TheParser.DRecord
+        path = self.dir.write('lazy', 'D01DXXD03')
+        compare([
+            (1, D.type('D', 1)),
+            (2, C('fixed.ConversionError', line='DXX', strict=False)),
+            (3, D.type('D', 3)),
+            ], list(parse(TheParser, path, 3, processes=2, shard_size=1)))
+
+    def test_bounded(self):
+        path = self.dir.write('many', 'A1X' * 100)
+        submitted = []
+        class CountingPool(pool.Pool):
+            def apply_async(self, *args, **kw):
+                submitted.append(args)
+                return pool.Pool.apply_async(self, *args, **kw)
+        with Replacer() as r:
+            r.replace('fixed.parallel.Pool', CountingPool)
+            results = parse(self.parser, path, 3, processes=2, shard_size=1)
+            compare(1, results.next()[0])
+            sleep(0.1)
+            # the next shard is only asked for once the first is yielded
+            compare(5, len(submitted))
+            compare(range(2, 101), [line_no for line_no, _ in results])
+        compare(100, len(submitted))
+
+    def test_trailing_short_record(self):
+        path = self.dir.write('short', 'BYYA')
+        compare([(1, self.parser.BRecord.type('B', 'YY'))],
+                list(parse(self.parser, path, 3, processes=2)))
+
+    def test_empty(self):
+        path = self.dir.write('empty', '')
+        compare([], list(parse(self.parser, path, 3, processes=2)))
+
+class TestParallelControls(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class Header(Record):
+                prefix = Discriminator('H')
+            class Detail(Record):
+                prefix = Discriminator('D')
+                amount = Field(1, int)
+            class Trailer(Record):
+                prefix = Discriminator('T')
+                total = Field(1, int)
+            controls = [Total(Detail.amount, Trailer.total)]
+        self.parser = TheParser
+        self.dir = TempDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def test_across_shards(self):
+        P = self.parser
+        path = self.dir.write('file', 'H D1D2T3H D4T5D6')
+        compare([
+            (1, P.Header.type('H')),
+            (4, P.Trailer.type('T', 3)),
+            (5, P.Header.type('H')),
+            (7, C(ControlTotalError, problems=dict(total=(5, 4)),
+                  trailer=P.Trailer.type('T', 5), strict=False)),
+            (9, C(ControlTotalError, problems=dict(total=(None, 6)),
+                  trailer=None, strict=False)),
+            ], list(parse(P, path, 2, parse_only=[P.Header, P.Trailer],
+                          processes=2, shard_size=1)))
+
+class TestRun(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(1, int)
+            class BRecord(Record):
+                prefix = Discriminator('B')
+                data = Field(1)
+        class TheHandler(Handler):
+            def __init__(self):
+                self.total = 0
+                self.pid = os.getpid()
+            @handles(TheParser.ARecord)
+            def handle_A(self, source, line_no, rec):
+                self.total += rec.data
+        self.handler = TheHandler
+        self.dir = TempDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def test_simple(self):
+        paths = [self.dir.write('1.dat', 'A1BXA2'),
+                 self.dir.write('2.dat', 'A3')]
+        summary = run(self.handler, paths, width=2, processes=2)
+        compare('<Summary files=2 errors=0>', repr(summary))
+        compare(paths, [r.path for r in summary.files])
+        compare([3, 3], [r.state['total'] for r in summary.files])
+        self.assertFalse(os.getpid() in [r.state['pid']
+                                         for r in summary.files])
+        compare(None, summary.result)
+
+    def test_glob_and_reduce(self):
+        self.dir.write('1.dat', 'A1BXA2')
+        self.dir.write('2.dat', 'A3')
+        self.dir.write('ignored.txt', 'A4')
+        summary = run(self.handler, os.path.join(self.dir.path, '*.dat'),
+                      width=2,
+                      reduce=lambda states: sum(s['total'] for s in states))
+        compare(6, summary.result)
+
+    def test_compressed_lines(self):
+        path = self.dir.getpath('1.dat.gz')
+        output = gzip.open(path, 'wb')
+        output.write('A1\nA2\n')
+        output.close()
+        summary = run(self.handler, [path], lines=True,
+                      state=lambda handler: handler.total)
+        compare([3], [r.state for r in summary.files])
+
+    def test_errors(self):
+        paths = [self.dir.write('1.dat', 'A1'),
+                 self.dir.write('2.dat', 'AX'),
+                 self.dir.getpath('missing.dat')]
+        summary = run(self.handler, paths, width=2,
+                      reduce=lambda states: sum(s['total'] for s in states))
+        compare([True, False, False], [r.ok for r in summary.files])
+        compare(1, summary.result)
+        compare(2, len(summary.errors))
+        self.assertTrue('ConversionError' in summary.errors[0].error)
+        self.assertTrue('IOError' in summary.errors[1].error)
+        compare('<FileResult %s error>' % paths[1], repr(summary.files[1]))
+
+    def test_state_not_picklable(self):
+        class RecordKeeper(Handler):
+            total = 0
+            @handles(self.handler.parser.ARecord)
+            def handle_A(self, source, line_no, rec):
+                # the record type is not importable
+                self.last = rec
+                self.total += rec.data
+        paths = [self.dir.write('1.dat', 'A1'),
+                 self.dir.write('2.dat', 'A2')]
+        summary = run(RecordKeeper, paths, width=2,
+                      state=lambda handler: handler.last)
+        compare([False, False], [r.ok for r in summary.files])
+        self.assertTrue('PicklingError' in summary.errors[0].error)
+        summary = run(RecordKeeper, paths, width=2,
+                      state=lambda handler: handler.total)
+        compare([1, 2], [r.state for r in summary.files])
+
+    def test_no_files(self):
+        summary = run(self.handler, [], width=2, reduce=len)
+        compare([], summary.files)
+        compare(0, summary.result)
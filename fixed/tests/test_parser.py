@@ -1,6 +1,7 @@
 # Copyright (c) 2012 Simplistix Ltd
 # See license.txt for license details.
 
+from StringIO import StringIO
 from unittest import TestCase
 
 from testfixtures import (
@@ -16,10 +17,14 @@ from .. import (
     Constant,
     Discriminator,
     Field,
+    Lines,
+    MappedFile,
     Parser,
     Record,
     Skip,
+    Stats,
     UnknownRecordType,
+    WrongLength,
     ConversionError,
     one_of,
     )
@@ -89,6 +94,80 @@ class TestParser(TestCase):
                     self.parser.BRecord.type('B', 'YY'),
                     ), self.parser(Chunker(source, 3)))
     
+    def test_mapped_file(self):
+        with TempDirectory() as dir:
+            path = dir.write('file', 'AXXBYYCZZAX')
+            with open(path, 'rb') as source:
+                with MappedFile(source, 3) as mapped:
+                    compare(generator(
+                        self.parser.ARecord.type('A', 'XX'),
+                        C('fixed.UnknownRecordType',
+                          discriminator='C',
+                          line='CZZ',
+                          args=()),
+                        ), self.parser(mapped,
+                                       parse_only=[self.parser.ARecord]))
+
+    def test_lines(self):
+        compare(generator(
+            self.parser.ARecord.type('A', 'XX'),
+            C('fixed.WrongLength', expected=3, line='BY', args=()),
+            self.parser.BRecord.type('B', 'YY'),
+            ), self.parser(Lines(StringIO('AXX\r\nBY\r\nBYY\r\n'), 3)))
+
+    def test_source_not_sliceable(self):
+        with ShouldRaise(TypeError):
+            list(self.parser([None]))
+
+    def test_lazy(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(2, int)
+        records = list(TheParser(['A 2', 'AXX'], lazy=True))
+        compare([TheParser.ARecord.type('A', 2)], records[:1])
+        self.assertTrue(isinstance(records[1], TheParser.ARecord.lazy_type))
+        with ShouldRaise(ConversionError):
+            records[1].data
+
+    def test_fields(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(2, int)
+                other = Field(1, int)
+            class BRecord(Record):
+                prefix = Discriminator('B')
+                data = Field(2)
+        projection = TheParser.ARecord.projection(['data'])
+        compare(generator(
+            projection.type(2),
+            TheParser.BRecord.type('B', 'YY'),
+            # the other field isn't converted, so can't fail
+            projection.type(3),
+            C('fixed.ConversionError',
+              line='AXXX',
+              problems=dict(data=C('fixed.Problem', strict=False)),
+              strict=False),
+            ), TheParser(['A 21', 'BYY', 'A 3X', 'AXXX'],
+                         fields={TheParser.ARecord: ['data']}))
+
+    def test_fields_parse_only(self):
+        projection = self.parser.ARecord.projection(['data'])
+        compare(generator(
+            projection.type('XX'),
+            ), self.parser(['AXX', 'BYY'],
+                           parse_only=[self.parser.ARecord],
+                           fields={self.parser.ARecord: ['data'],
+                                   self.parser.BRecord: ['data']}))
+
+    def test_fields_lazy(self):
+        projection = self.parser.ARecord.projection(['data'])
+        records = list(self.parser(['AXX'], lazy=True,
+                                   fields={self.parser.ARecord: ['data']}))
+        compare([projection.type('XX')], records)
+        self.assertTrue(isinstance(records[0], projection.lazy_type))
+
     def test_type_identity(self):
         record = iter(self.parser(['AXX'])).next()
 
@@ -110,29 +189,111 @@ class TestParser(TestCase):
         self.assertTrue(record.const == TheParser.ARecord.const.x)
         self.assertTrue(record.const is TheParser.ARecord.const.x)
         
-    def test_inconsisent_discriminator_length(self):
-        with ShouldRaise(TypeError(
-            "Inconsistent discriminators: [<Discriminator 'A' (0-1)>, "
-            "<Discriminator 'BB' (0-2)>]"
-            )):
-            class TheParser(Parser):
-                class ARecord(Record):
-                    prefix = Discriminator('A')
-                class BRecord(Record):
-                    prefix = Discriminator('BB')
-
-    def test_inconsisent_discriminator_offset(self):
-        with ShouldRaise(TypeError(
-            "Inconsistent discriminators: [<Discriminator 'A' (1-2)>, "
-            "<Discriminator 'B' (0-1)>]"
-            )):
-            class TheParser(Parser):
-                class ARecord(Record):
-                    data = Field(1)
-                    prefix = Discriminator('A')
-                class BRecord(Record):
-                    prefix = Discriminator('B')
-                    data = Field(2)
+    def test_different_discriminator_lengths(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(2)
+            class BRecord(Record):
+                prefix = Discriminator('BBB')
+                data = Field(2)
+            class CRecord(Record):
+                prefix = Discriminator('CC')
+                data = Field(2)
+        compare(generator(
+            TheParser.ARecord.type('A', 'XX'),
+            TheParser.BRecord.type('BBB', 'YY'),
+            TheParser.CRecord.type('CC', 'ZZ'),
+            C('fixed.UnknownRecordType',
+              discriminator='B', line='BXXXX', args=()),
+            C('fixed.UnknownRecordType',
+              discriminator='D', line='DXXXX', args=()),
+            ), TheParser(['AXX', 'BBBYY', 'CCZZ', 'BXXXX', 'DXXXX']))
+
+    def test_longer_discriminator_preferred(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(2)
+            class ABRecord(Record):
+                prefix = Discriminator('AB')
+                data = Field(2)
+            class ABCRecord(Record):
+                prefix = Discriminator('ABC')
+                data = Field(2)
+        compare(generator(
+            TheParser.ARecord.type('A', 'XX'),
+            TheParser.ABRecord.type('AB', 'XX'),
+            TheParser.ABCRecord.type('ABC', 'XX'),
+            TheParser.ARecord.type('A', 'CX'),
+            ), TheParser(['AXX', 'ABXX', 'ABCXX', 'ACX']))
+
+    def test_different_discriminator_offsets(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                data = Field(1)
+                prefix = Discriminator('A')
+            class BRecord(Record):
+                prefix = Discriminator('B')
+                data = Field(2)
+        compare(generator(
+            TheParser.ARecord.type('X', 'A'),
+            TheParser.BRecord.type('B', 'YY'),
+            # the first position is tried first
+            TheParser.BRecord.type('B', 'AX'),
+            C('fixed.UnknownRecordType',
+              discriminator='C', line='CXX', args=()),
+            ), TheParser(['XA', 'BYY', 'BAX', 'CXX']))
+
+    def test_same_discriminator_text_different_offsets(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(2)
+            class SubRecord(Record):
+                data = Field(2)
+                prefix = Discriminator('A')
+        compare(generator(
+            TheParser.ARecord.type('A', 'XX'),
+            TheParser.SubRecord.type('XX', 'A'),
+            ), TheParser(['AXX', 'XXA']))
+
+    def test_different_discriminators_parse_only(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(2, int)
+            class BRecord(Record):
+                prefix = Discriminator('BB')
+                data = Field(2)
+        compare(generator(
+            TheParser.ARecord.type('A', 1),
+            C('fixed.ConversionError', line='AXX',
+              problems=dict(data=C('fixed.Problem', strict=False)),
+              strict=False),
+            C('fixed.UnknownRecordType',
+              discriminator='C', line='CXX', args=()),
+            ), TheParser(['A 1', 'BBXX', 'AXX', 'CXX'],
+                         parse_only=[TheParser.ARecord]))
+        compare(generator(
+            TheParser.BRecord.type('BB', 'XX'),
+            ), TheParser(['A 1', 'BBXX', 'CXX'],
+                         parse_only=[TheParser.BRecord],
+                         parse_unknown=False))
+
+    def test_different_discriminators_source_exception(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(2)
+            class BRecord(Record):
+                prefix = Discriminator('BB')
+                data = Field(1)
+        compare(generator(
+            TheParser.ARecord.type('A', 'XX'),
+            C('fixed.WrongLength', expected=3, line='BBXX', args=()),
+            TheParser.BRecord.type('BB', 'X'),
+            ), TheParser(Lines(StringIO('AXX\nBBXX\nBBX\n'), 3)))
 
     def test_duplicate_record_classes(self):
         # can't tell :-(
@@ -205,3 +366,184 @@ class TestParser(TestCase):
             elif isinstance(record, self.parser.BRecord.type):
                 actual.append('B')
         compare(expected, actual)
+
+class TestWhere(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                status = Field(1)
+                data = Field(2, int)
+            class BRecord(Record):
+                prefix = Discriminator('B')
+                data = Field(2)
+        self.parser = TheParser
+
+    def test_simple(self):
+        A, B = self.parser.ARecord, self.parser.BRecord
+        compare(generator(
+            A.type('A', 'X', 1),
+            B.type('B', 'YY'),
+            A.type('A', 'X', 3),
+            ), self.parser(['AX 1', 'AY 2', 'BYY', 'AX 3', 'AYXX'],
+                           where={A: dict(status='X')}))
+
+    def test_zero_padded(self):
+        class TheParser(Parser):
+            class DRecord(Record):
+                prefix = Discriminator('D')
+                v = Field(3, int)
+        D = TheParser.DRecord
+        compare(generator(
+            D.type('D', 42),
+            D.type('D', 42),
+            D.type('D', 42),
+            ), TheParser(['D 42', 'D042', 'D42 ', 'D 43'],
+                         where={D: dict(v=42)}))
+
+    def test_unknown_and_source_problems(self):
+        A = self.parser.ARecord
+        results = list(self.parser(
+            ['CXX', WrongLength(4, 'A'), 'AY 2'],
+            where={A: dict(status='X')},
+            ))
+        compare([UnknownRecordType, WrongLength],
+                [r.__class__ for r in results])
+
+    def test_conversion_problems(self):
+        A = self.parser.ARecord
+        compare([C(ConversionError, strict=False)], list(self.parser(
+            ['AXXX', 'AYXX'], where={A: dict(status='X')}
+            )))
+
+    def test_parse_only(self):
+        A, B = self.parser.ARecord, self.parser.BRecord
+        compare(generator(B.type('B', 'YY')), self.parser(
+            ['AX 1', 'BYY'], parse_only=[B], where={A: dict(status='X')}
+            ))
+
+    def test_fields(self):
+        A = self.parser.ARecord
+        compare(generator(A.projection(['data']).type(1)), self.parser(
+            ['AX 1', 'AY 2'], where={A: dict(status='X')},
+            fields={A: ['data']},
+            ))
+
+    def test_different_discriminators(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                status = Field(1)
+            class BRecord(Record):
+                skip = Skip(1)
+                prefix = Discriminator('B')
+        compare(generator(TheParser.ARecord.type('A', 'X'),
+                          TheParser.BRecord.type('B')),
+                TheParser(['AX', 'AY', 'XB'],
+                          where={TheParser.ARecord: dict(status='X')}))
+
+    def test_stats(self):
+        A = self.parser.ARecord
+        stats = Stats()
+        compare(generator(A.type('A', 'X', 1)), self.parser(
+            ['AX 1', 'AY 2'], where={A: dict(status='X')}, stats=stats
+            ))
+        compare(dict(ARecord=1), stats.filtered)
+        compare(dict(ARecord=1), stats.records)
+
+class TestValidate(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(2, int)
+                const = Field(1, one_of(
+                    x = Constant('X', 'an X'),
+                    ))
+            class BRecord(Record):
+                prefix = Discriminator('B')
+                data = Field(2)
+        self.parser = TheParser
+
+    def test_valid(self):
+        validation = self.parser(['A 1X', 'BXX']).validate()
+        compare(validation.rows, 2)
+        compare(validation.errors, [])
+        compare(validation.complete, True)
+        compare(validation.valid, True)
+        compare(validation.summary(), {})
+
+    def test_empty(self):
+        validation = self.parser([]).validate()
+        compare(validation.rows, 0)
+        compare(validation.valid, True)
+
+    def test_invalid(self):
+        validation = self.parser(
+            ['A 1X', 'AXXX', 'CXX', 'A 1Y', 'BXX']
+            ).validate()
+        compare(validation.rows, 5)
+        compare(validation.errors, [
+            (2, C('fixed.ConversionError', line='AXXX',
+                  problems=dict(data=C('fixed.Problem', strict=False)),
+                  strict=False)),
+            (3, C('fixed.UnknownRecordType',
+                  discriminator='C', line='CXX', args=())),
+            (4, C('fixed.ConversionError', line='A 1Y',
+                  problems=dict(const=C('fixed.Problem', strict=False)),
+                  strict=False)),
+            ])
+        compare(validation.complete, True)
+        compare(validation.valid, False)
+        compare(validation.summary(),
+                dict(ConversionError=2, UnknownRecordType=1))
+        compare(repr(validation),
+                "<Validation rows=5 errors=3 complete=True>")
+
+    def test_max_errors(self):
+        validation = self.parser(
+            ['AXXX', 'CXX', 'DXX', 'EXX']
+            ).validate(max_errors=1)
+        compare(validation.rows, 2)
+        compare([line_no for line_no, e in validation.errors], [1, 2])
+        compare(validation.complete, False)
+        compare(validation.valid, False)
+
+    def test_parse_only_and_unknown(self):
+        validation = self.parser(
+            ['AXXX', 'CXX', 'BXX'],
+            parse_only=[self.parser.BRecord],
+            parse_unknown=False,
+            ).validate()
+        compare(validation.rows, 3)
+        compare(validation.valid, True)
+
+    def test_source_problems(self):
+        validation = self.parser(Lines(StringIO('BXX\nBX\n'), 3)).validate()
+        compare(validation.errors, [
+            (2, C('fixed.WrongLength', expected=3, line='BX', args=())),
+            ])
+
+    def test_different_discriminators(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(2, int)
+            class BRecord(Record):
+                prefix = Discriminator('BB')
+                data = Field(1, int)
+        validation = TheParser(['A 1', 'BB1', 'BBX', 'CXX']).validate()
+        compare(validation.errors, [
+            (3, C('fixed.ConversionError', line='BBX', strict=False)),
+            (4, C('fixed.UnknownRecordType',
+                  discriminator='C', line='CXX', args=())),
+            ])
+
+    def test_fields(self):
+        # only the projected fields are checked
+        validation = self.parser(
+            ['A 1Y'], fields={self.parser.ARecord: ['data']}
+            ).validate()
+        compare(validation.valid, True)
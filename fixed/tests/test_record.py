@@ -5,7 +5,8 @@ from unittest import TestCase
 
 from testfixtures import Comparison as C, ShouldRaise, compare
 
-from .. import Discriminator, Record, Field, Discriminator, Skip
+from .. import ConversionError, Discriminator, Record, Field, Discriminator, Skip
+from .. import Constant, one_of
 
 class TestRecord(TestCase):
 
@@ -135,3 +136,389 @@ class TestRecord(TestCase):
         with ShouldRaise(TypeError('No discriminator specified')):
             class Normal(Record):
                 pass
+
+    def test_parse(self):
+
+        class Normal(Record):
+            id = Discriminator('N')
+            unused = Skip(1)
+            data  = Field(2, int)
+            text = Field(2)
+
+        result = Normal.parse('NX 2AB')
+        compare(Normal.type(id='N', data=2, text='AB'), result, strict=True)
+        compare(Normal('NX 2AB'), result, strict=True)
+
+    def test_check(self):
+
+        class Normal(Record):
+            id = Discriminator('N')
+            data  = Field(2, int)
+            text = Field(2)
+
+        compare(Normal.check('N 2AB'), None)
+        with ShouldRaise(ValueError(
+            "invalid literal for int() with base 10: 'XX'"
+            )):
+            Normal.check('NXXAB')
+
+    def test_check_no_convertors(self):
+
+        class Normal(Record):
+            id = Discriminator('N')
+
+        compare(Normal.check('N'), None)
+
+    def test_parse_convertor_fail(self):
+
+        class Normal(Record):
+            id = Discriminator('N')
+            data  = Field(2, int)
+
+        with ShouldRaise(ValueError(
+            "invalid literal for int() with base 10: 'XX'"
+            )):
+            Normal.parse('NXX')
+
+class TestCachedRecord(TestCase):
+
+    def setUp(self):
+        class Normal(Record):
+            id = Discriminator('N')
+            data  = Field(2, int, cache=10)
+        self.record = Normal
+
+    def test_parse(self):
+        compare([self.record.type('N', 2), self.record.type('N', 2)],
+                [self.record('N 2'), self.record.parse('N 2')])
+        compare(self.record.data.cache.hits, 1)
+        compare(self.record.data.cache.misses, 1)
+
+    def test_fields(self):
+        self.assertTrue(self.record.fields[1][1] is int)
+        self.assertTrue(self.record.parse_fields[1][1] is
+                        self.record.data.cache)
+
+    def test_explain(self):
+        # the slow path uses the convertor directly
+        compare(C('fixed.ConversionError',
+                  line='NXX',
+                  problems=dict(data=C('fixed.Problem',
+                                       raw='XX',
+                                       convert=int,
+                                       strict=False)),
+                  strict=False),
+                self.record.explain('NXX'))
+        compare(self.record.data.cache.misses, 0)
+
+    def test_lazy(self):
+        class Normal(Record):
+            lazy = True
+            id = Discriminator('N')
+            data  = Field(2, int, cache=10)
+        compare(Normal('N 2').data, 2)
+        compare(Normal('N 2').data, 2)
+        compare(Normal.data.cache.hits, 1)
+
+    def test_projection(self):
+        projection = self.record.projection(['data'])
+        compare(projection.parse('N 2'), projection.type(2))
+        compare(self.record.data.cache.misses, 1)
+
+class TestEncoding(TestCase):
+
+    def test_field_encoding(self):
+        class Normal(Record):
+            id = Discriminator('N')
+            text = Field(2, encoding='latin-1')
+            data = Field(2, int, encoding='ascii')
+            raw = Field(2)
+        result = Normal('N\xe9t 2\xe9t')
+        compare(Normal.type(id='N', text=u'\xe9t', data=2, raw='\xe9t'),
+                result, strict=True)
+        self.assertTrue(isinstance(result.id, str))
+        self.assertTrue(isinstance(result.text, unicode))
+        self.assertTrue(isinstance(result.raw, str))
+
+    def test_record_encoding(self):
+        class Normal(Record):
+            encoding = 'latin-1'
+            id = Discriminator('N')
+            text = Field(2)
+            utf8 = Field(2, encoding='utf-8')
+        result = Normal('N\xe9t\xc3\xa9')
+        compare(Normal.type(id='N', text=u'\xe9t', utf8=u'\xe9'), result)
+        self.assertTrue(isinstance(result.id, str))
+
+    def test_lazy(self):
+        class Normal(Record):
+            lazy = True
+            encoding = 'ascii'
+            id = Discriminator('N')
+            text = Field(2)
+            other = Field(2)
+        # the bad bytes are only decoded if used
+        result = Normal('Nok\xe9t')
+        compare(result.text, u'ok')
+        with ShouldRaise(ConversionError):
+            result.other
+
+    def test_explain(self):
+        class Normal(Record):
+            id = Discriminator('N')
+            data = Field(2, int, encoding='ascii')
+        compare(Normal.explain('N 2'), Normal.type('N', 2))
+        error = Normal.explain('N\xe9t')
+        problem = error.problems['data']
+        compare(problem.raw, '\xe9t')
+        self.assertTrue(isinstance(problem.exception, UnicodeDecodeError))
+        compare(repr(problem.convert), "<<type 'int'> decoding ascii>")
+
+    def test_cache(self):
+        class Normal(Record):
+            encoding = 'ascii'
+            id = Discriminator('N')
+            data = Field(2, int, cache=10)
+        compare(Normal('N 2'), Normal.type('N', 2))
+        compare(Normal('N 2'), Normal.type('N', 2))
+        compare(Normal.data.cache.hits, 1)
+
+class TestLazyRecord(TestCase):
+
+    def setUp(self):
+        self.converted = converted = []
+        def convert(text):
+            converted.append(text)
+            return int(text)
+        class Normal(Record):
+            lazy = True
+            id = Discriminator('N')
+            data  = Field(2, convert)
+            text = Field(2)
+        self.record = Normal
+
+    def test_class_attributes(self):
+        self.assertTrue(self.record.parse is self.record.lazy_type)
+        compare(self.record.lazy_type.__name__, 'NormalLazyType')
+        self.assertFalse(issubclass(self.record.lazy_type, tuple))
+
+    def test_attribute_access(self):
+        result = self.record('N 2AB')
+        compare(self.converted, [])
+        compare(result.data, 2)
+        compare(result.data, 2)
+        compare(self.converted, [' 2'])
+        compare(result.text, 'AB')
+
+    def test_namedtuple_behaviour(self):
+        result = self.record('N 2AB')
+        expected = self.record.type(id='N', data=2, text='AB')
+        self.assertTrue(result == expected)
+        self.assertTrue(expected == result)
+        self.assertFalse(result != expected)
+        self.assertFalse(expected != result)
+        compare(hash(result), hash(expected))
+        compare(len(result), 3)
+        compare(result[1], 2)
+        compare(result[-1], 'AB')
+        compare(result[1:], (2, 'AB'))
+        compare(list(result), ['N', 2, 'AB'])
+        compare(tuple(result), ('N', 2, 'AB'))
+        id, data, text = result
+        compare(data, 2)
+        compare(result._asdict(), expected._asdict())
+        compare(result._replace(text='CD'),
+                self.record.type(id='N', data=2, text='CD'))
+        compare(repr(result), "NormalType(id='N', data=2, text='AB')")
+
+    def test_unpacking(self):
+        result = self.record('N 2AB')
+        def f(*args):
+            return args
+        compare(f(*result), ('N', 2, 'AB'))
+        compare(dict(zip(result._fields, result)),
+                dict(id='N', data=2, text='AB'))
+
+    def test_ordering(self):
+        first = self.record('N 1AB')
+        second = self.record('N 2AA')
+        expected = self.record.type(id='N', data=2, text='AA')
+        self.assertTrue(first < second)
+        self.assertTrue(second > first)
+        self.assertTrue(first <= second)
+        self.assertFalse(first >= second)
+        self.assertTrue(first < expected)
+        self.assertTrue(expected > first)
+        self.assertTrue(second <= expected)
+        compare(sorted([second, first]), [first, second])
+
+    def test_containment(self):
+        result = self.record('N 2AB')
+        self.assertTrue(2 in result)
+        self.assertTrue('AB' in result)
+        self.assertFalse(3 in result)
+        compare(result.count(2), 1)
+        compare(result.index('AB'), 2)
+
+    def test_concatenation(self):
+        result = self.record('N 2AB')
+        compare(result + ('x', ), ('N', 2, 'AB', 'x'))
+        compare(('x', ) + result, ('x', 'N', 2, 'AB'))
+
+    def test_not_equal(self):
+        result = self.record('N 2AB')
+        self.assertFalse(result == self.record.type(id='N', data=3, text='AB'))
+        self.assertTrue(result != self.record.type(id='N', data=3, text='AB'))
+
+    def test_pickle(self):
+        # pickles as the namedtuple type, which must be importable
+        result = self.record('N 2AB')
+        compare(result.__reduce__(),
+                (self.record.type, ('N', 2, 'AB')))
+
+    def test_conversion_error(self):
+        result = self.record('NXXAB')
+        compare(result.text, 'AB')
+        try:
+            result.data
+        except ConversionError, e:
+            compare(e.line, 'NXXAB')
+            compare(e.problems.keys(), ['data'])
+            problem = e.problems['data']
+            compare(problem.raw, 'XX')
+            self.assertTrue(isinstance(problem.exception, ValueError))
+        else:
+            self.fail('No exception raised')
+
+class TestProjection(TestCase):
+
+    def setUp(self):
+        class Normal(Record):
+            id = Discriminator('N')
+            data  = Field(2, int)
+            text = Field(2)
+            other = Field(1, int)
+        self.record = Normal
+
+    def test_parse(self):
+        projection = self.record.projection(['text', 'data'])
+        compare(projection.type._fields, ('text', 'data'))
+        compare(projection.type.__name__, 'NormalType')
+        compare(projection.parse('N 2ABX'), projection.type('AB', 2),
+                strict=True)
+
+    def test_cached(self):
+        self.assertTrue(self.record.projection(['text', 'data']) is
+                        self.record.projection(('text', 'data')))
+        self.assertFalse(self.record.projection(['text', 'data']) is
+                         self.record.projection(['data', 'text']))
+
+    def test_explain(self):
+        projection = self.record.projection(['data', 'text'])
+        compare(projection.explain('N 2ABX'), projection.type(2, 'AB'),
+                strict=True)
+        compare(C('fixed.ConversionError',
+                  line='NXXABX',
+                  problems=dict(data=C('fixed.Problem', strict=False)),
+                  strict=False),
+                projection.explain('NXXABX'))
+
+    def test_lazy(self):
+        class Normal(Record):
+            lazy = True
+            id = Discriminator('N')
+            data  = Field(2, int)
+        projection = Normal.projection(['data'])
+        result = projection.parse('N 2')
+        self.assertTrue(isinstance(result, projection.lazy_type))
+        compare(result, projection.type(2))
+
+    def test_repr(self):
+        compare(repr(self.record.projection(['data', 'text'])),
+                '<Projection of Normal: data, text>')
+
+    def test_unknown_field(self):
+        with ShouldRaise(TypeError("Normal has no fields ['foo', 'bar']")):
+            self.record.projection(['data', 'foo', 'bar'])
+
+    def test_no_fields(self):
+        with ShouldRaise(TypeError('No fields specified')):
+            self.record.projection([])
+
+class TestPredicate(TestCase):
+
+    def setUp(self):
+        class Detail(Record):
+            id = Discriminator('D')
+            status = Field(1, one_of(
+                active=Constant('A'),
+                closed=Constant('C'),
+                ))
+            region = Field(3)
+            amount = Field(4, int)
+        self.record = Detail
+
+    def test_text(self):
+        predicate = self.record.predicate(dict(region='UK'))
+        self.assertTrue(predicate('DAUK   12'))
+        self.assertFalse(predicate('DAUSA  12'))
+
+    def test_constant(self):
+        predicate = self.record.predicate(dict(status=self.record.status.active))
+        self.assertTrue(predicate('DAUK   12'))
+        self.assertFalse(predicate('DCUK   12'))
+
+    def test_rendered(self):
+        predicate = self.record.predicate(dict(amount=12))
+        self.assertTrue(predicate('DAUK   12'))
+        self.assertFalse(predicate('DAUK  120'))
+
+    def test_zero_padded(self):
+        predicate = self.record.predicate(dict(amount=42))
+        self.assertTrue(predicate('DAUK   42'))
+        self.assertTrue(predicate('DAUK 0042'))
+        self.assertTrue(predicate('DAUK 42  '))
+        self.assertFalse(predicate('DAUK 0420'))
+
+    def test_not_converted_lets_through(self):
+        # so that parsing gives the ConversionError
+        predicate = self.record.predicate(dict(amount=42))
+        self.assertTrue(predicate('DAUK XXXX'))
+
+    def test_text_for_converted_field(self):
+        predicate = self.record.predicate(dict(amount='  42'))
+        self.assertTrue(predicate('DAUK   42'))
+        self.assertFalse(predicate('DAUK 0042'))
+
+    def test_collection_of_values(self):
+        predicate = self.record.predicate(dict(amount=set([42, '  ab'])))
+        self.assertTrue(predicate('DAUK 0042'))
+        self.assertTrue(predicate('DAUK   ab'))
+        self.assertFalse(predicate('DAUK 0043'))
+
+    def test_collection(self):
+        predicate = self.record.predicate(dict(
+            status=self.record.status.active,
+            region=set(['UK', 'FR']),
+            ))
+        self.assertTrue(predicate('DAUK   12'))
+        self.assertTrue(predicate('DAFR   12'))
+        self.assertFalse(predicate('DCFR   12'))
+        self.assertFalse(predicate('DADE   12'))
+
+    def test_does_not_convert(self):
+        predicate = self.record.predicate(dict(region='UK'))
+        self.assertTrue(predicate('DXUK XXXX'))
+
+    def test_no_conditions(self):
+        self.assertTrue(self.record.predicate({})('DXUK XXXX'))
+
+    def test_unknown_field(self):
+        with ShouldRaise(TypeError("Detail has no fields ['foo']")):
+            self.record.predicate(dict(foo='X'))
+
+    def test_too_long(self):
+        with ShouldRaise(TypeError(
+            "'UKIE' is not 3 characters in Detail.region"
+            )):
+            self.record.predicate(dict(region='UKIE'))
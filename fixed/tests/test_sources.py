@@ -0,0 +1,370 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+import bz2
+import gzip
+import zlib
+from StringIO import StringIO
+from unittest import TestCase
+
+from testfixtures import (
+    Comparison as C, Replacer, ShouldRaise, TempDirectory, compare, generator
+    )
+
+from .. import (
+    Chunker, ConversionError, Count, Discriminator, Field, Handler, LineFeed,
+    Lines, MappedFile, Parser, Record, RecordFeed, UnknownRecordType,
+    handles, handles_batch, open_source
+    )
+from ..sources import Decompressed, Prefetched
+
+class TestChunker(TestCase):
+
+    def test_simple(self):
+        compare(generator('AXX', 'BYY'),
+                Chunker(StringIO('AXXBYY'), 3))
+
+    def test_empty(self):
+        compare(generator(), Chunker(StringIO(''), 3))
+
+    def test_trailing_short_record_dropped(self):
+        compare(generator('AXX', 'BYY'),
+                Chunker(StringIO('AXXBYYC'), 3))
+
+    def test_record_spans_blocks(self):
+        # blocks are rounded down to a whole number of records, but
+        # short reads can still leave a partial record at a boundary
+        class ShortReads(object):
+            def __init__(self, *blocks):
+                self.blocks = list(blocks)
+            def read(self, size):
+                if self.blocks:
+                    return self.blocks.pop(0)
+                return ''
+        compare(generator('AXX', 'BYY', 'CZZ'),
+                Chunker(ShortReads('AX', 'XBYYC', 'Z', 'ZD'), 3))
+
+    def test_block_size(self):
+        stream = StringIO('AXXBYYCZZ')
+        sizes = []
+        read = stream.read
+        def record_read(size):
+            sizes.append(size)
+            return read(size)
+        stream.read = record_read
+        compare(generator('AXX', 'BYY', 'CZZ'),
+                Chunker(stream, 3, block_size=7))
+        compare(sizes, [6, 6, 6])
+
+    def test_block_size_smaller_than_width(self):
+        compare(generator('AXX', 'BYY'),
+                Chunker(StringIO('AXXBYY'), 3, block_size=1))
+
+class TestMappedFile(TestCase):
+
+    def setUp(self):
+        self.dir = TempDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _check(self, content, *expected):
+        path = self.dir.write('file', content)
+        with open(path, 'rb') as source:
+            with MappedFile(source, 3) as mapped:
+                rows = list(mapped)
+                for row in rows:
+                    self.assertTrue(isinstance(row, buffer))
+                compare(expected, tuple(str(row) for row in rows))
+
+    def test_simple(self):
+        self._check('AXXBYY', 'AXX', 'BYY')
+
+    def test_empty(self):
+        self._check('')
+
+    def test_trailing_short_record_dropped(self):
+        self._check('AXXBYYC', 'AXX', 'BYY')
+
+    def test_slicing(self):
+        path = self.dir.write('file', 'AXXBYY')
+        with open(path, 'rb') as source:
+            with MappedFile(source, 3) as mapped:
+                row = list(mapped)[1]
+                compare(row[0:1], 'B')
+                compare(row[:], 'BYY')
+
+    def test_lazy_records_outlive_mapping(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                lazy = True
+                prefix = Discriminator('A')
+                data = Field(2, int)
+        path = self.dir.write('file', 'A01AXX')
+        with open(path, 'rb') as source:
+            with MappedFile(source, 3) as mapped:
+                records = list(TheParser(mapped))
+        compare(1, records[0].data)
+        with ShouldRaise(ConversionError):
+            records[1].data
+
+class TestLines(TestCase):
+
+    def test_simple(self):
+        compare(generator('AXX', 'BYY'),
+                Lines(StringIO('AXX\nBYY\n')))
+
+    def test_crlf(self):
+        compare(generator('AXX', 'BYY'),
+                Lines(StringIO('AXX\r\nBYY\r\n')))
+
+    def test_no_trailing_terminator(self):
+        compare(generator('AXX', 'BYY'),
+                Lines(StringIO('AXX\r\nBYY')))
+
+    def test_no_trailing_terminator_crlf(self):
+        compare(generator('AXX', 'BYY'),
+                Lines(StringIO('AXX\r\nBYY\r')))
+
+    def test_empty(self):
+        compare(generator(), Lines(StringIO('')))
+
+    def test_blank_line(self):
+        compare(generator('AXX', '', 'BYY'),
+                Lines(StringIO('AXX\n\nBYY\n')))
+
+    def test_lines_span_blocks(self):
+        for block_size in range(1, 12):
+            compare(generator('AXX', 'BYY', 'CZZ'),
+                    Lines(StringIO('AXX\r\nBYY\r\nCZZ\r\n'),
+                          block_size=block_size))
+
+    def test_width(self):
+        compare(generator(
+            'AXX',
+            C('fixed.WrongLength', expected=3, line='BY', args=()),
+            C('fixed.WrongLength', expected=3, line='CZZZ', args=()),
+            'DXX',
+            ), Lines(StringIO('AXX\nBY\nCZZZ\r\nDXX\n'), width=3))
+
+class TestRecordFeed(TestCase):
+
+    def test_feed(self):
+        feed = RecordFeed(3)
+        compare(feed.feed('AX'), [])
+        compare(feed.feed('XBYYC'), ['AXX', 'BYY'])
+        compare(feed.feed('ZZ'), ['CZZ'])
+        compare(feed.feed('D'), [])
+        compare(feed.close(), [])
+        compare(feed.feed('EXX'), ['EXX'])
+
+class TestLineFeed(TestCase):
+
+    def test_feed(self):
+        feed = LineFeed()
+        compare(feed.feed('AX'), [])
+        compare(feed.feed('X\r'), [])
+        compare(feed.feed('\nBYY\r\nC'), ['AXX', 'BYY'])
+        compare(feed.feed('ZZ'), [])
+        compare(feed.close(), ['CZZ'])
+        compare(feed.close(), [])
+
+    def test_width(self):
+        feed = LineFeed(3)
+        compare(feed.feed('AXX\nBY\nC'), [
+            'AXX', C('fixed.WrongLength', expected=3, line='BY', args=()),
+            ])
+        compare(feed.close(), [
+            C('fixed.WrongLength', expected=3, line='C', args=()),
+            ])
+
+class TestPushed(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(1, int)
+            class BRecord(Record):
+                prefix = Discriminator('B')
+                data = Field(1)
+            class Trailer(Record):
+                prefix = Discriminator('T')
+                count = Field(1, int)
+            controls = [Count(ARecord, Trailer.count)]
+        self.parser = TheParser
+        class MyHandler(Handler):
+            @handles(TheParser.ARecord)
+            def handle_A(self, source, line_no, rec):
+                return 'A', line_no, rec.data
+            @handles_batch(TheParser.BRecord, size=2)
+            def handle_B(self, source, line_nos, recs):
+                return 'B', line_nos, [rec.data for rec in recs]
+        self.handler = MyHandler
+
+    def test_handler(self):
+        data = 'A1BXA2T2BYA3BZT1A4T1'
+        expected = list(self.handler().handled(RecordFeed(2).feed(data)))
+        pushed = self.handler().pushed(RecordFeed(2))
+        actual = []
+        for piece in 'A1B', 'XA2T', '2BYA', '3BZT', '1A4T', '1':
+            actual.append(pushed.feed(piece))
+        actual.append(pushed.close())
+        compare([
+            [('A', 1, 1)],
+            [('A', 3, 2)],
+            [('B', [2, 4], ['X', 'Y'])],
+            [('A', 5, 3)],
+            [('A', 7, 4)],
+            [],
+            [('B', [6], ['Z'])],
+            ], actual)
+        compare(expected, sum(actual, []))
+
+    def test_handler_lines(self):
+        pushed = self.handler().pushed(LineFeed(2))
+        compare([], pushed.feed('A1'))
+        compare([('A', 1, 1)], pushed.feed('\nA2'))
+        compare([('A', 2, 2)], pushed.feed('\nT2'))
+        compare([], pushed.close())
+
+    def test_parser_controls(self):
+        P = self.parser
+        pushed = P.pushed(RecordFeed(2), parse_only=[P.BRecord])
+        compare([], pushed.feed('A1A2'))
+        compare([P.BRecord.type('B', 'X')], pushed.feed('BXT2A3'))
+        compare([C('fixed.ControlTotalError', trailer=None,
+                   problems=dict(count=(None, 1)), strict=False)],
+                pushed.close())
+
+    def test_exception(self):
+        pushed = self.handler().pushed(RecordFeed(2))
+        compare([('A', 1, 1)], pushed.feed('A1'))
+        with ShouldRaise(UnknownRecordType('C', 'CX')):
+            pushed.feed('CX')
+        with ShouldRaise(ValueError('No more data can be pushed')):
+            pushed.feed('A2')
+
+class TestOpenSource(TestCase):
+
+    def setUp(self):
+        self.dir = TempDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write_gzip(self, name, *members):
+        path = self.dir.getpath(name)
+        with open(path, 'wb') as target:
+            for data in members:
+                stream = StringIO()
+                output = gzip.GzipFile(fileobj=stream, mode='wb')
+                output.write(data)
+                output.close()
+                target.write(stream.getvalue())
+        return path
+
+    def test_plain(self):
+        path = self.dir.write('data', 'AXXBYY')
+        with open_source(path, 3) as source:
+            compare(generator('AXX', 'BYY'), source)
+
+    def test_gzip(self):
+        path = self.write_gzip('data.gz', 'AXXBYY'*1000)
+        with open_source(path, 3) as source:
+            compare(['AXX', 'BYY']*1000, list(source))
+
+    def test_gzip_lines(self):
+        path = self.write_gzip('data.gz', 'AXX\r\nBYY\nCZZ')
+        with open_source(path, lines=True) as source:
+            compare(generator('AXX', 'BYY', 'CZZ'), source)
+
+    def test_gzip_concatenated(self):
+        path = self.write_gzip('data.gz', 'AXXB', 'YYCZZ')
+        with open_source(path, 3) as source:
+            compare(generator('AXX', 'BYY', 'CZZ'), source)
+
+    def test_bz2(self):
+        path = self.dir.write('data.bz2', bz2.compress('AXXBYY'))
+        with open_source(path, 3) as source:
+            compare(generator('AXX', 'BYY'), source)
+
+    def test_bz2_concatenated_at_block_boundary(self):
+        first = bz2.compress('AXX')
+        path = self.dir.write('data.bz2', first + bz2.compress('BYY'))
+        with open(path, 'rb') as raw:
+            stream = Decompressed(raw, bz2.BZ2Decompressor,
+                                  block_size=len(first))
+            compare(generator('AXX', 'BYY'), Chunker(stream, 3))
+
+    def test_gzip_truncated(self):
+        path = self.write_gzip('data.gz', 'AXXBYY'*1000)
+        data = open(path, 'rb').read()
+        for size in len(data) // 2, len(data) - 4:
+            self.dir.write('data.gz', data[:size])
+            with open_source(path, 3) as source:
+                with ShouldRaise(EOFError('Compressed file ended before the '
+                                          'end of a stream')):
+                    list(source)
+
+    def test_gzip_bad_checksum(self):
+        path = self.write_gzip('data.gz', 'AXXBYY')
+        data = open(path, 'rb').read()
+        self.dir.write('data.gz', data[:-8] + '\x00'*4 + data[-4:])
+        with open_source(path, 3) as source:
+            with ShouldRaise(zlib.error):
+                list(source)
+
+    def test_bz2_truncated(self):
+        data = bz2.compress('AXXBYY'*1000)
+        path = self.dir.write('data.bz2', data[:-10])
+        with open_source(path, 3) as source:
+            with ShouldRaise(EOFError):
+                list(source)
+
+    def test_bz2_lookalike(self):
+        path = self.dir.write('data', 'BZhXXBZh')
+        with open_source(path, 4) as source:
+            compare(generator('BZhX', 'XBZh'), source)
+
+    def test_background(self):
+        path = self.write_gzip('data.gz', 'AXXBYY'*1000)
+        with open_source(path, 3, background=True) as source:
+            compare(['AXX', 'BYY']*1000, list(source))
+
+    def test_background_close_early(self):
+        path = self.dir.write('data', 'AXXBYY'*1000)
+        source = open_source(path, 3, block_size=6, background=True)
+        compare('AXX', iter(source).next())
+        source.close()
+        self.assertFalse(source.stream.thread.is_alive())
+
+    def test_xz_without_lzma(self):
+        path = self.dir.write('data.xz', '\xfd7zXZ\x00rest')
+        with Replacer() as r:
+            r.replace('fixed.sources.compressions', [])
+            with ShouldRaise(ImportError(
+                'backports.lzma is needed to read xz files'
+                )):
+                open_source(path, 3)
+
+    def test_width_needed(self):
+        with ShouldRaise(TypeError('width is needed unless lines is True')):
+            open_source(self.dir.write('data', ''))
+
+    def test_empty(self):
+        path = self.dir.write('data', '')
+        with open_source(path, 3) as source:
+            compare(generator(), source)
+
+class TestPrefetched(TestCase):
+
+    def test_exception(self):
+        class Broken(object):
+            def read(self, size):
+                raise IOError('bang')
+            def close(self):
+                pass
+        stream = Prefetched(Broken())
+        with ShouldRaise(IOError('bang')):
+            stream.read()
+        compare('', stream.read())
+        stream.close()
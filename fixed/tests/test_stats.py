@@ -0,0 +1,148 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+from unittest import TestCase
+
+from testfixtures import compare
+
+from .. import (
+    ConversionError,
+    Discriminator,
+    Field,
+    Handler,
+    Parser,
+    Record,
+    Stats,
+    UnknownRecordType,
+    WrongLength,
+    handles,
+    handles_batch,
+    )
+
+class TestParserStats(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(2, int)
+            class BRecord(Record):
+                prefix = Discriminator('B')
+                data = Field(2)
+        self.parser = TheParser
+
+    def check(self, stats, **expected):
+        actual = stats.as_dict()
+        for key in ('seconds', 'rows_per_second', 'bytes_per_second'):
+            actual.pop(key)
+        defaults = dict(rows=0, bytes=0, records={}, errors={}, filtered={},
+                        unknown=0, ignored=0, source_errors={}, fields={},
+                        handlers={})
+        defaults.update(expected)
+        compare(defaults, actual)
+
+    def test_counts(self):
+        stats = Stats()
+        results = list(self.parser(
+            ['A12', 'BXX', 'AXX', 'CXX', WrongLength(3, 'A1'), 'A34'],
+            stats=stats
+            ))
+        compare([self.parser.ARecord.type('A', 12),
+                 self.parser.BRecord.type('B', 'XX')], results[:2])
+        compare([ConversionError, UnknownRecordType, WrongLength],
+                [r.__class__ for r in results[2:5]])
+        self.check(stats, rows=6, bytes=15,
+                   records=dict(ARecord=2, BRecord=1),
+                   errors=dict(ARecord=1),
+                   unknown=1,
+                   source_errors=dict(WrongLength=1))
+        self.assertTrue(stats.seconds > 0)
+
+    def test_parse_only_and_unknown(self):
+        stats = Stats()
+        compare([self.parser.ARecord.type('A', 12)], list(self.parser(
+            ['A12', 'BXX', 'CXX'],
+            parse_only=[self.parser.ARecord], parse_unknown=False,
+            stats=stats
+            )))
+        self.check(stats, rows=3, bytes=9,
+                   records=dict(ARecord=1), ignored=1, unknown=1)
+
+    def test_same_results_as_uncounted(self):
+        rows = ['A12', 'BXX', 'AXX', 'CXX']
+        compare([repr(r) for r in self.parser(rows)],
+                [repr(r) for r in self.parser(
+                    rows, stats=Stats(time_fields=True)
+                    )])
+
+    def test_time_fields(self):
+        stats = Stats(time_fields=True)
+        list(self.parser(['A12', 'AXX', 'BXX'], stats=stats))
+        fields = stats.as_dict()['fields']
+        compare(['ARecord.data'], fields.keys())
+        compare(2, fields['ARecord.data']['calls'])
+
+    def test_time_fields_lazy_not_timed(self):
+        stats = Stats(time_fields=True)
+        record, = self.parser(['A12'], lazy=True, stats=stats)
+        compare(12, record.data)
+        self.check(stats, rows=1, bytes=3, records=dict(ARecord=1))
+
+    def test_callback(self):
+        reports = []
+        stats = Stats(callback=lambda d: reports.append(d['rows']), every=2)
+        list(self.parser(['A12', 'BXX', 'A34', 'BYY', 'A56'], stats=stats))
+        # reported every 2 rows and at the end
+        compare([2, 4, 5], reports)
+
+    def test_reset(self):
+        stats = Stats()
+        list(self.parser(['A12'], stats=stats))
+        stats.reset()
+        self.check(stats)
+
+class TestHandlerStats(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(1, int)
+            class BRecord(Record):
+                prefix = Discriminator('B')
+                data = Field(1)
+        self.parser = TheParser
+
+    def test_time_handlers(self):
+        class MyHandler(Handler):
+            @handles(self.parser.ARecord)
+            def handle_A(self, source, line_no, rec):
+                return rec.data
+            @handles_batch(self.parser.BRecord, size=2)
+            def handle_B(self, source, line_nos, recs):
+                return len(recs)
+        handler = MyHandler()
+        handler.stats = stats = Stats(time_handlers=True)
+        compare([1, 2, 2, 3, 1],
+                list(handler.handled(['A1', 'BX', 'A2', 'BY', 'BZ', 'A3'])))
+        results = stats.as_dict()
+        compare(dict(ARecord=3, BRecord=3), results['records'])
+        compare(dict(handle_A=3, handle_B=2),
+                dict((name, timing['calls'])
+                     for name, timing in results['handlers'].items()))
+        # the class is untouched
+        compare(MyHandler.handle_A.im_func,
+                MyHandler.handlers[self.parser.ARecord.type])
+
+    def test_threads(self):
+        class MyHandler(Handler):
+            threads = 2
+            @handles(self.parser.ARecord)
+            def handle_A(self, source, line_no, rec):
+                return rec.data
+        handler = MyHandler()
+        handler.stats = stats = Stats(time_handlers=True)
+        compare([1, 2, 3], list(handler.handled(['A1', 'A2', 'BX', 'A3'])))
+        compare(3, stats.handlers['handle_A'][0])
+        compare(dict(ARecord=3), stats.records)
+        compare(1, stats.ignored)
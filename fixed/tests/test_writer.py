@@ -0,0 +1,151 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+from decimal import Decimal
+from StringIO import StringIO
+from unittest import TestCase
+
+from testfixtures import ShouldRaise, compare
+
+from .. import (
+    Constant, Discriminator, Field, Parser, Record, Skip, one_of
+    )
+from ..writer import Writer
+
+class TestFormat(TestCase):
+
+    def test_simple(self):
+        class ARecord(Record):
+            prefix = Discriminator('A')
+            count = Field(3, int)
+            unused = Skip(2)
+            amount = Field(5, Decimal)
+            const = Field(1, one_of(
+                x = Constant('X', 'an X'),
+                y = Constant('Y', 'a Y'),
+                ))
+            text = Field(4)
+        line = 'A 12   1.50Yab  '
+        record = ARecord(line)
+        compare(record, ARecord.type('A', 12, Decimal('1.50'),
+                                     ARecord.const.y, 'ab  '))
+        compare(ARecord.format(record), line)
+        compare(ARecord.format(ARecord.type('A', 3, Decimal(2),
+                                            ARecord.const.x, 'z')),
+                'A  3      2Xz   ')
+
+    def test_sparse(self):
+        d = Discriminator('N', start=1)
+        class Normal(Record):
+            id = d
+            data  = Field(1, int, start=4)
+        compare(Normal.format(Normal.type('N', 2)), ' N  2')
+
+    def test_discriminator_not_first(self):
+        f = Field(2, int)
+        d = Discriminator('N')
+        class Normal(Record):
+            data = f
+            id = d
+        compare(Normal.format(Normal('12N')), '12N')
+
+    def test_width(self):
+        class Normal(Record):
+            width = 5
+            id = Discriminator('N')
+            data = Field(1)
+        compare(Normal.format(Normal.type('N', 'X')), 'NX   ')
+
+    def test_render(self):
+        class Normal(Record):
+            id = Discriminator('N')
+            data = Field(4, lambda text: int(text) / 100.0,
+                         render=lambda value, size: '%0*i' % (size, value*100))
+        compare(Normal.format(Normal('N0150')), 'N0150')
+
+    def test_encoding(self):
+        class Normal(Record):
+            encoding = 'utf-8'
+            id = Discriminator('N')
+            text = Field(3)
+            data = Field(2, int)
+        line = 'N\xc3\xa9 12'
+        record = Normal(line)
+        compare(record, Normal.type('N', u'\xe9 ', 12))
+        compare(Normal.format(record), line)
+        compare(Normal.format(Normal.type('N', u'\xe9', 1)), line[:3]+'  1')
+
+    def test_lazy(self):
+        class Normal(Record):
+            lazy = True
+            id = Discriminator('N')
+            data = Field(2, int)
+        compare(Normal.format(Normal('N 2')), 'N 2')
+
+    def test_too_long(self):
+        class Normal(Record):
+            id = Discriminator('N')
+            data = Field(2, int)
+        with ShouldRaise(ValueError(
+            "NormalType(id='N', data=123) gave 'N123', "
+            "which is 4 characters long"
+            )):
+            Normal.format(Normal.type('N', 123))
+
+    def test_overlapping(self):
+        class Normal(Record):
+            id = Discriminator('N')
+            data = Field(2)
+            first = Field(1, start=1)
+        with ShouldRaise(TypeError(
+            'Normal has overlapping fields so cannot be written'
+            )):
+            Normal.format(Normal('NXY'))
+
+class TestWriter(TestCase):
+
+    def setUp(self):
+        class TheParser(Parser):
+            class ARecord(Record):
+                prefix = Discriminator('A')
+                data = Field(2, int)
+            class BRecord(Record):
+                prefix = Discriminator('B')
+                data = Field(2)
+        self.parser = TheParser
+        self.records = [TheParser.ARecord.type('A', 1),
+                        TheParser.BRecord.type('B', 'XX')]
+
+    def test_simple(self):
+        stream = StringIO()
+        with Writer(stream, self.parser) as writer:
+            writer.writelines(self.records)
+            compare(stream.getvalue(), '')
+        compare(stream.getvalue(), 'A 1BXX')
+
+    def test_round_trip(self):
+        source = 'A 1\nBXX\nA12\n'
+        stream = StringIO()
+        with Writer(stream, self.parser, terminator='\n') as writer:
+            writer.writelines(self.parser(source.splitlines()))
+        compare(stream.getvalue(), source)
+
+    def test_buffer_size(self):
+        class Stream(object):
+            def __init__(self):
+                self.writes = []
+            def write(self, data):
+                self.writes.append(data)
+        stream = Stream()
+        writer = Writer(stream, self.parser, buffer_size=2)
+        for record in self.records * 3:
+            writer.write(record)
+        compare(stream.writes, ['A 1BXX', 'A 1BXX', 'A 1BXX'])
+        writer.write(self.records[0])
+        writer.close()
+        compare(stream.writes[-1], 'A 1')
+
+    def test_unknown_type(self):
+        writer = Writer(StringIO(), self.parser)
+        with ShouldRaise(TypeError("Cannot write ('A', 1)")):
+            writer.write(('A', 1))
@@ -0,0 +1,144 @@
+# Copyright (c) 2012 Simplistix Ltd
+# See license.txt for license details.
+
+from decimal import Decimal
+
+from constants import one_of
+
+# renderers take a value and the size of its field and return the text
+# to write, which must be exactly that size
+
+def left(value, size):
+    return str(value).ljust(size)
+
+def right(value, size):
+    return str(value).rjust(size)
+
+def constant(value, size):
+    return value.text.ljust(size)
+
+def encoded(render, encoding):
+    # for fields that are decoded when parsed
+    if render is None:
+        def encode(value, size):
+            return value.encode(encoding).ljust(size)
+    else:
+        def encode(value, size):
+            return render(value, size).encode(encoding)
+    return encode
+
+# convertor -> renderer for values it returns
+renderers = {
+    int: right,
+    long: right,
+    float: right,
+    Decimal: right,
+    }
+
+def default_render(convertor):
+    if convertor is None:
+        # values are already text
+        return None
+    if isinstance(convertor, one_of):
+        return constant
+    try:
+        return renderers.get(convertor, left)
+    except TypeError:
+        # unhashable convertor
+        return left
+
+def compile_format(class_name, fields, width, fill=' '):
+    # Build a straight-line function that turns a record into a line,
+    # the reverse of compile_parse. fields is a sequence of
+    # (slice, render), where a render of None means the value is
+    # already text.
+    order = sorted(range(len(fields)), key=lambda i: fields[i][0].start)
+    namespace = dict(join=''.join, width=width, problem=format_problem)
+    pieces = []
+    index = 0
+    for i in order:
+        s, render = fields[i]
+        if s.start < index:
+            source = (
+                'def format(record):\n'
+                '    raise TypeError(%r)\n' % (
+                    '%s has overlapping fields so cannot be written' % (
+                        class_name
+                        )))
+            break
+        if s.start > index:
+            pieces.append(repr(fill * (s.start - index)))
+        size = s.stop - s.start
+        if render is None:
+            pieces.append('record[%i].ljust(%i)' % (i, size))
+        else:
+            name = 'render%i' % i
+            namespace[name] = render
+            pieces.append('%s(record[%i], %i)' % (name, i, size))
+        index = s.stop
+    else:
+        if width > index:
+            pieces.append(repr(fill * (width - index)))
+        # values that are too long make the line too long
+        source = (
+            'def format(record):\n'
+            '    line = join((%s,))\n'
+            '    if len(line) != width:\n'
+            '        raise problem(record, line)\n'
+            '    return line\n' % ', '.join(pieces)
+            )
+    exec compile(source, '<%s formatter>' % class_name, 'exec') in namespace
+    return namespace['format']
+
+def format_problem(record, line):
+    return ValueError('%r gave %r, which is %i characters long' % (
+        record, line, len(line)
+        ))
+
+class Writer(object):
+    # Write records of the types handled by a parser to a stream,
+    # buffering the formatted lines so that the stream is written to
+    # in large blocks.
+
+    buffer_size = 10000
+
+    def __init__(self, stream, parser, terminator='', buffer_size=None):
+        self.stream = stream
+        self.terminator = terminator
+        if buffer_size is not None:
+            self.buffer_size = buffer_size
+        self.formats = {}
+        for record in parser.record_mapping.values():
+            self.formats[record.type] = record.format
+            self.formats[record.lazy_type] = record.format
+        self.pending = []
+
+    def write(self, record):
+        self.writelines((record, ))
+
+    def writelines(self, records):
+        formats, pending = self.formats, self.pending
+        append, buffer_size = pending.append, self.buffer_size
+        for record in records:
+            format = formats.get(record.__class__)
+            if format is None:
+                raise TypeError('Cannot write %r' % (record, ))
+            append(format(record))
+            if len(pending) >= buffer_size:
+                self.flush()
+
+    def flush(self):
+        pending = self.pending
+        if pending:
+            terminator = self.terminator
+            self.stream.write(terminator.join(pending) + terminator)
+            del pending[:]
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()